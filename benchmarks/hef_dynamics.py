@@ -2,7 +2,7 @@ import os
 import shutil
 import numpy as np
 from oggm.tests.funcs import init_hef, get_test_dir
-from oggm import utils, tasks
+from oggm import cfg, utils, tasks
 from oggm.core import massbalance, flowline
 
 
@@ -59,6 +59,42 @@ def time_hef_run_until_and_store_with_nc():
                               diag_path=os.path.join(testdir, 'diag.nc'))
 
 
+def _hef_run_with_shape_factor(update):
+
+    old = (cfg.PARAMS['use_shape_factor_for_fluxbasedmodel'],
+           cfg.PARAMS['shape_factor_update'])
+    cfg.PARAMS['use_shape_factor_for_fluxbasedmodel'] = 'Adhikari'
+    cfg.PARAMS['shape_factor_update'] = update
+    try:
+        mb_mod = massbalance.RandomMassBalance(gdir, bias=0, seed=0)
+        fls = gdir.read_pickle('model_flowlines')
+        model = flowline.FluxBasedModel(fls, mb_model=mb_mod, y0=0.)
+        model.run_until(200)
+    finally:
+        (cfg.PARAMS['use_shape_factor_for_fluxbasedmodel'],
+         cfg.PARAMS['shape_factor_update']) = old
+    return model
+
+
+def time_hef_run_until_shape_factor_step():
+    _hef_run_with_shape_factor('step')
+
+
+def time_hef_run_until_shape_factor_annual():
+    _hef_run_with_shape_factor('annual')
+
+
+def track_hef_shape_factor_annual_volume_error():
+    # Relative volume difference after 200 years with shape factors
+    # computed once a year instead of at each step
+    ref = _hef_run_with_shape_factor('step').volume_m3
+    vol = _hef_run_with_shape_factor('annual').volume_m3
+    return np.abs(vol - ref) / ref * 100
+
+
+track_hef_shape_factor_annual_volume_error.unit = '%'
+
+
 time_hef_run_until.setup = setup
 time_hef_run_until.teardown = teardown
 
@@ -70,3 +106,12 @@ time_hef_run_until_and_store.teardown = teardown
 
 time_hef_run_until_and_store_with_nc.setup = setup
 time_hef_run_until_and_store_with_nc.teardown = teardown
+
+time_hef_run_until_shape_factor_step.setup = setup
+time_hef_run_until_shape_factor_step.teardown = teardown
+
+time_hef_run_until_shape_factor_annual.setup = setup
+time_hef_run_until_shape_factor_annual.teardown = teardown
+
+track_hef_shape_factor_annual_volume_error.setup = setup
+track_hef_shape_factor_annual_volume_error.teardown = teardown
@@ -214,10 +214,18 @@ class full_workflow:
                             y0=1990, nyears=100,
                             output_filesuffix='_pd')
 
+        # Same run with the single precision ice dynamics
+        cfg.PARAMS['float_dtype'] = 'float32'
+        execute_entity_task(tasks.run_constant_climate, gdirs,
+                            y0=1990, nyears=100,
+                            output_filesuffix='_pd_float32')
+        cfg.PARAMS['float_dtype'] = 'float64'
+
         # Compile output
         utils.compile_glacier_statistics(gdirs)
         utils.compile_run_output(gdirs, filesuffix='_tstar')
         utils.compile_run_output(gdirs, filesuffix='_pd')
+        utils.compile_run_output(gdirs, filesuffix='_pd_float32')
         utils.compile_climate_input(gdirs)
 
         return gdirs
@@ -240,6 +248,30 @@ class full_workflow:
         ds = xr.open_dataset(path)
         return float(ds.volume.sum(dim='rgi_id').isel(time=-1)) * 1e-9
 
+    def _float32_diff(self, var):
+        # Maximum relative difference (%) to the float64 run over time and
+        # glaciers. See params.cfg for the expected tolerances.
+        self.cfg_init()
+        out = []
+        for suffix in ['_pd', '_pd_float32']:
+            path = os.path.join(cfg.PATHS['working_dir'],
+                                'run_output{}.nc'.format(suffix))
+            with xr.open_dataset(path) as ds:
+                out.append(ds[var].load())
+        ref, f32 = out
+        diff = np.abs(f32 - ref) / ref.where(ref > 0)
+        return float(diff.max()) * 100
+
+    def track_1990_run_float32_volume_diff(self, gdirs):
+        return self._float32_diff('volume')
+
+    track_1990_run_float32_volume_diff.unit = '%'
+
+    def track_1990_run_float32_area_diff(self, gdirs):
+        return self._float32_diff('area')
+
+    track_1990_run_float32_area_diff.unit = '%'
+
     def track_avg_temp_full_period(self, gdirs):
         self.cfg_init()
         path = os.path.join(cfg.PATHS['working_dir'], 'climate_input.nc')
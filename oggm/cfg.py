@@ -349,6 +349,16 @@ def initialize(file=None, logging_level='INFO'):
     # Flowline model
     k = 'use_shape_factor_for_fluxbasedmodel'
     PARAMS[k] = cp[k]
+    PARAMS['shape_factor_update'] = cp['shape_factor_update']
+    PARAMS['float_dtype'] = cp['float_dtype']
+    PARAMS['batch_size'] = cp.as_int('batch_size')
+    PARAMS['run_checkpoint_interval'] = cp.as_int('run_checkpoint_interval')
+    PARAMS['stream_model_output'] = cp.as_bool('stream_model_output')
+    PARAMS['run_output_chunk_size'] = cp.as_int('run_output_chunk_size')
+    PARAMS['collect_run_stats'] = cp.as_bool('collect_run_stats')
+    k = 'store_diagnostic_variables'
+    PARAMS[k] = cp.as_list(k)
+    PARAMS['store_model_geometry'] = cp.as_bool('store_model_geometry')
 
     # Make sure we have a proper cache dir
     from oggm.utils import download_oggm_files, get_demo_file
@@ -367,7 +377,11 @@ def initialize(file=None, logging_level='INFO'):
            'auto_skip_task', 'correct_for_neg_flux', 'filter_for_neg_flux',
            'rgi_version',
            'use_shape_factor_for_inversion', 'use_rgi_area',
-           'use_shape_factor_for_fluxbasedmodel', 'baseline_climate']
+           'use_shape_factor_for_fluxbasedmodel', 'baseline_climate',
+           'batch_size', 'run_checkpoint_interval', 'stream_model_output',
+           'run_output_chunk_size', 'collect_run_stats',
+           'shape_factor_update', 'float_dtype',
+           'store_diagnostic_variables', 'store_model_geometry']
     for k in ltr:
         cp.pop(k, None)
 
@@ -7,26 +7,32 @@ import logging
 import warnings
 import copy
 from collections import OrderedDict
-from time import gmtime, strftime
+from functools import partial
+from operator import attrgetter
+from time import gmtime, strftime, perf_counter
+from bisect import bisect_left
 
 # External libs
 import numpy as np
+import pandas as pd
 import shapely.geometry as shpg
 import xarray as xr
+from scipy.linalg import solve_banded
 
 # Locals
 from oggm import __version__
 import oggm.cfg as cfg
 from oggm import utils
-from oggm import entity_task
+from oggm import entity_task, global_task
 from oggm.core.massbalance import (MultipleFlowlineMassBalance,
                                    ConstantMassBalance,
                                    PastMassBalance,
                                    RandomMassBalance)
 from oggm.core.centerlines import Centerline, line_order
+from oggm.exceptions import InvalidParamsError
 
 # Constants
-from oggm.cfg import SEC_IN_DAY, SEC_IN_YEAR, SEC_IN_HOUR
+from oggm.cfg import SEC_IN_DAY, SEC_IN_YEAR, SEC_IN_HOUR, SEC_IN_MONTH
 from oggm.cfg import G, GAUSSIAN_KERNEL
 
 # Module logger
@@ -36,6 +42,10 @@ log = logging.getLogger(__name__)
 class Flowline(Centerline):
     """The is the input flowline for the model."""
 
+    # Setting one of these invalidates the cached geometry as well
+    _geometry_attrs = {'bed_h', 'dx', 'map_dx', 'dx_meter', '_widths',
+                       'bed_shape', '_lambdas', '_w0_m'}
+
     def __init__(self, line=None, dx=1, map_dx=None,
                  surface_h=None, bed_h=None, rgi_id=None):
         """ Instanciate.
@@ -54,6 +64,10 @@ class Flowline(Centerline):
         super(Flowline, self).__init__(line, dx, surface_h)
 
         self._thick = (surface_h - bed_h).clip(0.)
+        # Derived geometry is cached until the next thickness (or geometry)
+        # update
+        self._thick_version = 0
+        self._cache = {}
         self.map_dx = map_dx
         self.dx_meter = map_dx * self.dx
         self.bed_h = bed_h
@@ -72,10 +86,49 @@ class Flowline(Centerline):
     @thick.setter
     def thick(self, value):
         self._thick = value.clip(0)
+        self._thick_version += 1
+
+    def __setattr__(self, name, value):
+        super(Flowline, self).__setattr__(name, value)
+        if name in self._geometry_attrs:
+            self.__dict__['_thick_version'] = self.__dict__.get(
+                '_thick_version', 0) + 1
+
+    def _cached(self, key, func):
+        """Returns func(), computed only once per thickness update.
+
+        The cached arrays are shared by all callers and are read-only.
+        Likewise, the thickness and the geometry should not be changed in
+        place but set again (e.g. through the `thick`, `section` or
+        `surface_h` setters) so that the cache is invalidated.
+        """
+        try:
+            version, out = self._cache[key]
+            if version == self._thick_version:
+                return out
+        except KeyError:
+            pass
+        out = func()
+        if isinstance(out, np.ndarray):
+            out.setflags(write=False)
+        self._cache[key] = (self._thick_version, out)
+        return out
+
+    def __getstate__(self):
+        # No need to pickle the cache
+        state = self.__dict__.copy()
+        state['_cache'] = {}
+        return state
+
+    def __setstate__(self, state):
+        # Flowlines pickled before the cache was introduced
+        state.setdefault('_cache', {})
+        state.setdefault('_thick_version', 0)
+        self.__dict__.update(state)
 
     @Centerline.surface_h.getter
     def surface_h(self):
-        return self._thick + self.bed_h
+        return self._cached('surface_h', lambda: self._thick + self.bed_h)
 
     @surface_h.setter
     def surface_h(self, value):
@@ -97,7 +150,8 @@ class Flowline(Centerline):
 
     @property
     def area_m2(self):
-        return np.sum(self.widths_m * self.dx_meter)
+        return self._cached('area_m2',
+                            lambda: np.sum(self.widths_m * self.dx_meter))
 
     @property
     def area_km2(self):
@@ -150,10 +204,16 @@ class ParabolicBedFlowline(Flowline):
     @property
     def widths_m(self):
         """Compute the widths out of H and shape"""
+        return self._cached('widths_m', self._compute_widths_m)
+
+    def _compute_widths_m(self):
         return np.sqrt(4*self.thick/self.bed_shape)
 
     @property
     def section(self):
+        return self._cached('section', self._compute_section)
+
+    def _compute_section(self):
         return 2./3. * self.widths_m * self.thick
 
     @section.setter
@@ -193,7 +253,7 @@ class RectangularBedFlowline(Flowline):
 
     @property
     def section(self):
-        return self.widths_m * self.thick
+        return self._cached('section', lambda: self.widths_m * self.thick)
 
     @section.setter
     def section(self, val):
@@ -201,6 +261,9 @@ class RectangularBedFlowline(Flowline):
 
     @property
     def area_m2(self):
+        return self._cached('area_m2', self._compute_area_m2)
+
+    def _compute_area_m2(self):
         widths = np.where(self.thick > 0., self.widths_m, 0.)
         return np.sum(widths * self.dx_meter)
 
@@ -240,10 +303,16 @@ class TrapezoidalBedFlowline(Flowline):
     @property
     def widths_m(self):
         """Compute the widths out of H and shape"""
+        return self._cached('widths_m', self._compute_widths_m)
+
+    def _compute_widths_m(self):
         return self._w0_m + self._lambdas * self.thick
 
     @property
     def section(self):
+        return self._cached('section', self._compute_section)
+
+    def _compute_section(self):
         return (self.widths_m + self._w0_m) / 2 * self.thick
 
     @section.setter
@@ -257,6 +326,9 @@ class TrapezoidalBedFlowline(Flowline):
 
     @property
     def area_m2(self):
+        return self._cached('area_m2', self._compute_area_m2)
+
+    def _compute_area_m2(self):
         widths = np.where(self.thick > 0., self.widths_m, 0.)
         return np.sum(widths * self.dx_meter)
 
@@ -337,20 +409,27 @@ class MixedBedFlowline(Flowline):
     @property
     def widths_m(self):
         """Compute the widths out of H and shape"""
-        out = np.sqrt(4*self.thick/self.bed_shape)
+        return self._cached('widths_m', self._compute_widths_m)
+
+    def _compute_widths_m(self):
+        thick = self.thick
+        out = np.sqrt(4*thick/self.bed_shape)
         if self._do_trapeze:
-            out[self._ptrap] = (self._w0_m[self._ptrap] +
-                                self._lambdas[self._ptrap] *
-                                self.thick[self._ptrap])
+            pt = self._ptrap
+            out[pt] = self._w0_m[pt] + self._lambdas[pt] * thick[pt]
         return out
 
     @property
     def section(self):
-        out = 2./3. * self.widths_m * self.thick
+        return self._cached('section', self._compute_section)
+
+    def _compute_section(self):
+        thick = self.thick
+        widths_m = self.widths_m
+        out = 2./3. * widths_m * thick
         if self._do_trapeze:
-            out[self._ptrap] = ((self.widths_m[self._ptrap] +
-                                 self._w0_m[self._ptrap]) / 2 *
-                                self.thick[self._ptrap])
+            pt = self._ptrap
+            out[pt] = (widths_m[pt] + self._w0_m[pt]) / 2 * thick[pt]
         return out
 
     @section.setter
@@ -367,6 +446,9 @@ class MixedBedFlowline(Flowline):
 
     @property
     def area_m2(self):
+        return self._cached('area_m2', self._compute_area_m2)
+
+    def _compute_area_m2(self):
         widths = np.where(self.thick > 0., self.widths_m, 0.)
         return np.sum(widths * self.dx_meter)
 
@@ -380,12 +462,556 @@ class MixedBedFlowline(Flowline):
         ds['lambdas'] = (['x'],  self._lambdas)
 
 
+_DIAG_COORDS_DESC = {'hydro_year': 'Hydrological year',
+                     'hydro_month': 'Hydrological month',
+                     'calendar_year': 'Calendar year',
+                     'calendar_month': 'Calendar month'}
+
+
+def _output_attrs():
+    """Global attributes of the model output files."""
+    return OrderedDict([('description', 'OGGM model output'),
+                        ('oggm_version', __version__),
+                        ('calendar', '365-day no leap'),
+                        ('creation_date', strftime("%Y-%m-%d %H:%M:%S",
+                                                   gmtime()))])
+
+
+# Upper bounds of the time step histogram bins (the last bin is open)
+DT_HIST_BINS = [SEC_IN_HOUR, SEC_IN_DAY, 5*SEC_IN_DAY, 10*SEC_IN_DAY,
+                SEC_IN_MONTH, SEC_IN_YEAR]
+
+
+class _RunStats(object):
+    """Cheap counters of the numerical work done during a model run.
+
+    They are collected by :py:class:`FlowlineModel` if asked for
+    (``cfg.PARAMS['collect_run_stats']``) and written as global attributes
+    of the model diagnostics file (see :py:meth:`to_attrs`).
+    """
+
+    def __init__(self):
+        self.n_steps = 0
+        self.n_clipped_steps = 0
+        self.dt_hist = [0] * (len(DT_HIST_BINS) + 1)
+        self.n_mb_calls = 0
+        self.wall_time_flux = 0.
+        self.wall_time_mb = 0.
+        self.n_rollbacks = 0
+        self.n_rejected_steps = 0
+        self.schemes = []
+
+    def add_step(self, dt, clipped, wall_time):
+        """Count one step of length dt (wall_time excludes the MB calls)."""
+        self.n_steps += 1
+        self.n_clipped_steps += bool(clipped)
+        self.dt_hist[bisect_left(DT_HIST_BINS, dt)] += 1
+        self.wall_time_flux += wall_time
+
+    def add_mb_call(self, wall_time):
+        self.n_mb_calls += 1
+        self.wall_time_mb += wall_time
+
+    def add_scheme(self, scheme):
+        if scheme not in self.schemes:
+            self.schemes.append(scheme)
+
+    def to_attrs(self):
+        """The counters as netCDF attributes."""
+        return OrderedDict([
+            ('stats_n_steps', self.n_steps),
+            ('stats_n_clipped_steps', self.n_clipped_steps),
+            ('stats_dt_hist', np.array(self.dt_hist)),
+            ('stats_dt_hist_bins', np.array(DT_HIST_BINS)),
+            ('stats_n_mb_calls', self.n_mb_calls),
+            ('stats_wall_time_flux', self.wall_time_flux),
+            ('stats_wall_time_mb', self.wall_time_mb),
+            ('stats_n_rollbacks', self.n_rollbacks),
+            ('stats_n_rejected_steps', self.n_rejected_steps),
+            ('stats_time_stepping', ','.join(self.schemes))])
+
+
+class DiagnosticCollector(object):
+    """A diagnostic variable stored by ``run_until_and_store``.
+
+    The collector is called with the model and the (floating) year at each
+    store time and returns the value of the variable. Give a list of
+    collectors (or of names of the built-in ones, see
+    ``cfg.PARAMS['store_diagnostic_variables']``) to
+    :py:meth:`FlowlineModel.run_until_and_store` to choose what is stored.
+
+    Examples
+    --------
+    >>> max_thick = DiagnosticCollector(
+    ...     'max_thick_m', lambda model: max(fl.thick.max() for fl in
+    ...                                      model.fls),
+    ...     description='Maximum ice thickness', unit='m')
+    """
+
+    def __init__(self, name, func, description='', unit=''):
+        """Instanciate.
+
+        Parameters
+        ----------
+        name : str
+            the name of the variable in the diagnostics dataset
+        func : callable
+            a function of the model returning the value of the variable
+        description : str
+            the description attribute of the variable
+        unit : str
+            the unit attribute of the variable
+        """
+        self.name = name
+        self.func = func
+        self.attrs = OrderedDict(description=description, unit=unit)
+
+    def applies_to(self, model):
+        """Whether the variable makes sense for this model."""
+        return True
+
+    def start(self, model):
+        """Called at the beginning of each run (e.g. to reset a cache)."""
+        pass
+
+    def __call__(self, model, yr):
+        return self.func(model)
+
+
+class _ElaCollector(DiagnosticCollector):
+    """The ELA only changes with the MB year: computed once per year."""
+
+    def __init__(self):
+        super(_ElaCollector, self).__init__(
+            'ela_m', None,
+            description='Annual Equilibrium Line Altitude  (ELA)',
+            unit='m a.s.l')
+        self._ela = (None, None)
+
+    def start(self, model):
+        self._ela = (None, None)
+
+    def __call__(self, model, yr):
+        mb_yr = np.floor(yr)
+        if self._ela[0] != mb_yr:
+            self._ela = (mb_yr, model.mb_model.get_ela(year=mb_yr))
+        return self._ela[1]
+
+
+class _CalvingCollector(DiagnosticCollector):
+    """The accumulated calving, for tidewater glaciers only."""
+
+    def __init__(self):
+        super(_CalvingCollector, self).__init__(
+            'calving_m3', attrgetter('calving_m3_since_y0'),
+            description='Total accumulated calving flux', unit='m 3')
+
+    def applies_to(self, model):
+        return model.is_tidewater
+
+
+def _builtin_collector(name):
+    """A new instance of a built-in diagnostics collector."""
+    if name == 'volume_m3':
+        return DiagnosticCollector(name, attrgetter('volume_m3'),
+                                   description='Total glacier volume',
+                                   unit='m 3')
+    if name == 'area_m2':
+        return DiagnosticCollector(name, attrgetter('area_m2'),
+                                   description='Total glacier area',
+                                   unit='m 2')
+    if name == 'length_m':
+        return DiagnosticCollector(name, attrgetter('length_m'),
+                                   description='Glacier length', unit='m')
+    if name == 'ela_m':
+        return _ElaCollector()
+    if name == 'calving_m3':
+        return _CalvingCollector()
+    raise InvalidParamsError('Diagnostic variable not understood: '
+                             '{}'.format(name))
+
+
+def _get_collectors(diagnostics, model):
+    """The collectors of a run (names are replaced by built-in ones)."""
+    if diagnostics is None:
+        diagnostics = cfg.PARAMS['store_diagnostic_variables']
+    out = []
+    for c in diagnostics:
+        # Each run has its own collectors (they might have a state)
+        c = _builtin_collector(c) if isinstance(c, str) else copy.copy(c)
+        if c.applies_to(model):
+            c.start(model)
+            out.append(c)
+    return out
+
+
+class _RunStore(object):
+    """Collects the output of a model run at the requested store times.
+
+    This is the bookkeeping part of
+    :py:meth:`FlowlineModel.run_until_and_store`, kept separate so that other
+    drivers (e.g. :py:class:`BatchFluxBasedModel`) can store the output of
+    several models advanced together.
+    """
+
+    def __init__(self, model, y1, run_path=None, diag_path=None,
+                 store_monthly_step=False, diagnostics=None,
+                 store_geometry=None):
+
+        if store_geometry is None:
+            store_geometry = cfg.PARAMS['store_model_geometry']
+        if run_path is not None and not store_geometry:
+            raise InvalidParamsError('run_path needs store_geometry')
+        self.model = model
+        self.run_path = run_path
+        self.diag_path = diag_path
+        self.store_geometry = store_geometry
+        self.collectors = _get_collectors(diagnostics, model)
+
+        # time
+        yearly_time = np.arange(np.floor(model.yr), np.floor(y1)+1)
+
+        if store_monthly_step:
+            monthly_time = utils.monthly_timeseries(model.yr, y1)
+        else:
+            monthly_time = np.arange(np.floor(model.yr), np.floor(y1)+1)
+        yrs, months = utils.floatyear_to_date(monthly_time)
+        cyrs, cmonths = utils.hydrodate_to_calendardate(yrs, months)
+        self.yearly_time = yearly_time
+        self.monthly_time = monthly_time
+        self.months = months
+        self.diag_coords = OrderedDict(hydro_year=yrs, hydro_month=months,
+                                       calendar_year=cyrs,
+                                       calendar_month=cmonths)
+
+        # init output
+        if run_path is not None:
+            model.to_netcdf(run_path)
+        self._j = 0
+        self._i = 0
+        self._init_output()
+
+    def _init_output(self):
+        """Allocate the output arrays for the whole run."""
+
+        ny = len(self.yearly_time)
+        nm = len(self.monthly_time)
+        fls = self.model.fls if self.store_geometry else []
+        self.sects = [(np.zeros((ny, fl.nx)) * np.NaN) for fl in fls]
+        self.widths = [(np.zeros((ny, fl.nx)) * np.NaN) for fl in fls]
+        diag_ds = xr.Dataset()
+
+        # Global attributes
+        diag_ds.attrs = _output_attrs()
+
+        # Coordinates
+        diag_ds.coords['time'] = ('time', self.monthly_time)
+        diag_ds['time'].attrs['description'] = 'Floating hydrological year'
+        for k, v in self.diag_coords.items():
+            diag_ds.coords[k] = ('time', v)
+            diag_ds[k].attrs['description'] = _DIAG_COORDS_DESC[k]
+
+        # Variables and attributes
+        for k, attrs in self._diag_vars().items():
+            diag_ds[k] = ('time', np.zeros(nm) * np.NaN)
+            diag_ds[k].attrs.update(attrs)
+        self.diag_ds = diag_ds
+
+    def _diag_vars(self):
+        """The diagnostic variables stored for this model and their attrs."""
+        return OrderedDict((c.name, c.attrs) for c in self.collectors)
+
+    def _diag_values(self, yr):
+        """The current value of the diagnostic variables."""
+        return OrderedDict((c.name, c(self.model, yr))
+                           for c in self.collectors)
+
+    def state(self):
+        """Position of the run output (for rollbacks)."""
+        return self._j, self._i
+
+    def restore(self, state):
+        """Go back to a position returned by state().
+
+        The output stored after this position is discarded.
+        """
+        self._j, self._i = state
+        for s, w in zip(self.sects, self.widths):
+            s[self._j:] = np.NaN
+            w[self._j:] = np.NaN
+        for k in self.diag_ds.data_vars:
+            self.diag_ds[k].data[self._i:] = np.NaN
+
+    def store(self, i, yr, mo):
+        """Store the current model state at index ``i`` of the time axis."""
+
+        # Model run
+        if mo == 1 and self.store_geometry:
+            for s, w, fl in zip(self.sects, self.widths, self.model.fls):
+                s[self._j, :] = fl.section
+                w[self._j, :] = fl.widths_m
+            self._j += 1
+        # Diagnostics
+        for k, v in self._diag_values(yr).items():
+            self.diag_ds[k].data[i] = v
+        self._i = i + 1
+
+    def flush(self):
+        """Write the output stored so far to disk (nothing to do here)."""
+        pass
+
+    def finalize(self):
+        """Make the datasets out of the stored data and write them."""
+
+        yearly_time = self.yearly_time
+        run_path = self.run_path
+        diag_path = self.diag_path
+        diag_ds = self.diag_ds
+
+        # to datasets
+        run_ds = []
+        for (s, w) in zip(self.sects, self.widths):
+            ds = xr.Dataset()
+            ds.attrs = _output_attrs()
+            ds.coords['time'] = yearly_time
+            ds['time'].attrs['description'] = 'Floating hydrological year'
+            varcoords = OrderedDict(time=('time', yearly_time),
+                                    year=('time', yearly_time))
+            ds['ts_section'] = xr.DataArray(s, dims=('time', 'x'),
+                                            coords=varcoords)
+            ds['ts_width_m'] = xr.DataArray(w, dims=('time', 'x'),
+                                            coords=varcoords)
+            run_ds.append(ds)
+
+        # write output?
+        if run_path is not None:
+            encode = {'ts_section': {'zlib': True, 'complevel': 5},
+                      'ts_width_m': {'zlib': True, 'complevel': 5},
+                      }
+            for i, ds in enumerate(run_ds):
+                ds.to_netcdf(run_path, 'a', group='fl_{}'.format(i),
+                             encoding=encode)
+        if self.model.stats is not None:
+            diag_ds.attrs.update(self.model.stats.to_attrs())
+        if diag_path is not None:
+            diag_ds.to_netcdf(diag_path)
+
+        return run_ds if self.store_geometry else None, diag_ds
+
+
+class _StreamingRunStore(_RunStore):
+    """Same as _RunStore, but writes the output to disk during the run.
+
+    The records are appended to the files in chunks of ``chunk_size`` time
+    steps along an unlimited time dimension: the memory needed does not
+    depend on the length of the run, and the output written so far is
+    still available if the run fails. The files can be read as usual.
+
+    Nothing is kept in memory: :py:meth:`finalize` returns ``(None, None)``.
+    """
+
+    def __init__(self, model, y1, run_path=None, diag_path=None,
+                 store_monthly_step=False, diagnostics=None,
+                 store_geometry=None, chunk_size=None):
+
+        if chunk_size is None:
+            chunk_size = cfg.PARAMS['run_output_chunk_size']
+        self.chunk_size = chunk_size
+        super(_StreamingRunStore, self).__init__(
+            model, y1, run_path=run_path, diag_path=diag_path,
+            store_monthly_step=store_monthly_step, diagnostics=diagnostics,
+            store_geometry=store_geometry)
+
+    def _init_output(self):
+        """Create the file variables and the (small) write buffers."""
+
+        nc = self.chunk_size
+        fls = self.model.fls
+        self._diag_names = list(self._diag_vars().keys())
+
+        # Buffers: row k is the record j0 + k of the file
+        self.sects = [np.zeros((nc, fl.nx)) * np.NaN for fl in fls]
+        self.widths = [np.zeros((nc, fl.nx)) * np.NaN for fl in fls]
+        self.diag_buf = np.zeros((nc, len(self._diag_names))) * np.NaN
+        self._j0 = 0
+        self._i0 = 0
+
+        if self.run_path is not None:
+            with utils.ncDataset(self.run_path, 'a') as nc_:
+                for i, fl in enumerate(fls):
+                    grp = nc_.groups['fl_{}'.format(i)]
+                    grp.setncatts(_output_attrs())
+                    grp.createDimension('time', None)
+                    v = grp.createVariable('time', 'f8', ('time',))
+                    v.description = 'Floating hydrological year'
+                    grp.createVariable('year', 'f8', ('time',))
+                    for vn in ['ts_section', 'ts_width_m']:
+                        v = grp.createVariable(vn, 'f8', ('time', 'x'),
+                                               zlib=True, complevel=5,
+                                               chunksizes=(nc, fl.nx),
+                                               fill_value=np.NaN)
+                        v.coordinates = 'year'
+
+        if self.diag_path is not None:
+            with utils.ncDataset(self.diag_path, 'w',
+                                 format='NETCDF4') as nc_:
+                nc_.setncatts(_output_attrs())
+                nc_.createDimension('time', None)
+                v = nc_.createVariable('time', 'f8', ('time',))
+                v.description = 'Floating hydrological year'
+                for k, val in self.diag_coords.items():
+                    v = nc_.createVariable(k, val.dtype, ('time',))
+                    v.description = _DIAG_COORDS_DESC[k]
+                for k, attrs in self._diag_vars().items():
+                    v = nc_.createVariable(k, 'f8', ('time',),
+                                           chunksizes=(nc,),
+                                           fill_value=np.NaN)
+                    v.setncatts(attrs)
+                    v.coordinates = ' '.join(self.diag_coords.keys())
+
+    def restore(self, state):
+        """Go back to a position returned by state().
+
+        The output stored after this position is discarded, also the
+        records already written to disk (they are set to NaN).
+        """
+        j, i = state
+        if j < self._j0 and self.run_path is not None:
+            with utils.ncDataset(self.run_path, 'a') as nc_:
+                for k in range(len(self.sects)):
+                    grp = nc_.groups['fl_{}'.format(k)]
+                    grp['ts_section'][j:self._j0, :] = np.NaN
+                    grp['ts_width_m'][j:self._j0, :] = np.NaN
+        if i < self._i0 and self.diag_path is not None:
+            with utils.ncDataset(self.diag_path, 'a') as nc_:
+                for name in self._diag_names:
+                    nc_[name][i:self._i0] = np.NaN
+        self._j, self._i = state
+        self._j0 = min(self._j0, j)
+        self._i0 = min(self._i0, i)
+
+    def store(self, i, yr, mo):
+        """Store the current model state at index ``i`` of the time axis."""
+
+        # Model run
+        if mo == 1 and self.run_path is not None:
+            if self._j - self._j0 == self.chunk_size:
+                self._flush_run()
+            k = self._j - self._j0
+            for s, w, fl in zip(self.sects, self.widths, self.model.fls):
+                s[k, :] = fl.section
+                w[k, :] = fl.widths_m
+        if mo == 1:
+            self._j += 1
+
+        # Diagnostics
+        if self.diag_path is not None:
+            if i - self._i0 == self.chunk_size:
+                self._flush_diag()
+            self.diag_buf[i - self._i0, :] = list(self._diag_values(yr)
+                                                  .values())
+        self._i = i + 1
+
+    def _flush_run(self):
+        n = self._j - self._j0
+        if self.run_path is None or n <= 0:
+            return
+        sl = slice(self._j0, self._j)
+        with utils.ncDataset(self.run_path, 'a') as nc_:
+            for i, (s, w) in enumerate(zip(self.sects, self.widths)):
+                grp = nc_.groups['fl_{}'.format(i)]
+                grp['time'][sl] = self.yearly_time[sl]
+                grp['year'][sl] = self.yearly_time[sl]
+                grp['ts_section'][sl, :] = s[:n]
+                grp['ts_width_m'][sl, :] = w[:n]
+        self._j0 = self._j
+
+    def _flush_diag(self):
+        n = self._i - self._i0
+        if self.diag_path is None or n <= 0:
+            return
+        sl = slice(self._i0, self._i)
+        with utils.ncDataset(self.diag_path, 'a') as nc_:
+            nc_['time'][sl] = self.monthly_time[sl]
+            for k, v in self.diag_coords.items():
+                nc_[k][sl] = v[sl]
+            for k, name in enumerate(self._diag_names):
+                nc_[name][sl] = self.diag_buf[:n, k]
+        self._i0 = self._i
+
+    def flush(self):
+        """Write the output stored so far to disk."""
+        self._flush_run()
+        self._flush_diag()
+        if self.diag_path is not None and self.model.stats is not None:
+            with utils.ncDataset(self.diag_path, 'a') as nc_:
+                nc_.setncatts(self.model.stats.to_attrs())
+
+    def finalize(self):
+        """Write the remaining output."""
+        self.flush()
+        return None, None
+
+
+def _share_geometry(flowlines):
+    """Copies of the flowlines which share the geometry with the originals.
+
+    Only the ice thickness belongs to the copies. Much cheaper than
+    ``copy.deepcopy``, but the bed, widths, etc. of the original flowlines
+    must not be changed in place afterwards.
+    """
+
+    new = [copy.copy(fl) for fl in flowlines]
+    idx = {id(fl): i for i, fl in enumerate(flowlines)}
+    for fl in new:
+        fl._thick = fl._thick.copy()
+        fl._cache = {}
+        if fl.flows_to is not None and id(fl.flows_to) in idx:
+            fl.flows_to = new[idx[id(fl.flows_to)]]
+        fl.inflows = [new[idx[id(f)]] if id(f) in idx else f
+                      for f in fl.inflows]
+    return new
+
+
+def _tributary_coupling(flowlines):
+    """Where and how the flowlines flow into each other.
+
+    Returns, for each flowline, the index of the flowline it flows into,
+    the range of the grid points receiving its ice and the Gaussian kernel
+    distributing the ice over them ((None, None, None, None) for the
+    flowlines which don't flow into another one).
+    """
+
+    out = []
+    for fl in flowlines:
+        if fl.flows_to is None:
+            out.append((None, None, None, None))
+            continue
+        idl = flowlines.index(fl.flows_to)
+        ide = fl.flows_to_indice
+        if fl.flows_to.nx >= 9:
+            gk = GAUSSIAN_KERNEL[9]
+            id0 = ide-4
+            id1 = ide+5
+        elif fl.flows_to.nx >= 7:
+            gk = GAUSSIAN_KERNEL[7]
+            id0 = ide-3
+            id1 = ide+4
+        elif fl.flows_to.nx >= 5:
+            gk = GAUSSIAN_KERNEL[5]
+            id0 = ide-2
+            id1 = ide+3
+        out.append((idl, id0, id1, gk))
+    return out
+
+
 class FlowlineModel(object):
     """Interface to the actual model"""
 
     def __init__(self, flowlines, mb_model=None, y0=0., glen_a=None,
                  fs=None, inplace=False, is_tidewater=False,
-                 mb_elev_feedback='annual', check_for_boundaries=True):
+                 mb_elev_feedback='annual', check_for_boundaries=True,
+                 collect_stats=None):
         """Create a new flowline model from the flowlines and a MB model.
 
         Parameters
@@ -410,12 +1036,28 @@ class FlowlineModel(object):
             'never', 'always', 'annual', or 'monthly': how often the
             mass-balance should be recomputed from the mass balance model.
             'Never' is equivalent to 'annual' but without elevation feedback
-            at all (the heights are taken from the first call).
+            at all (the heights are taken from the first call). With
+            'never', and with 'annual' for the flowlines which surface did
+            not change during a year, the MB of all years until the end of
+            the run is computed at once.
         check_for_boundaries : bool
             whether the model should raise an error when the glacier exceeds
             the domain boundaries.
+        collect_stats : bool
+            whether to count the steps, MB calls, etc. during the run (in
+            ``self.stats``, written to the model diagnostics). The default
+            is to use ``cfg.PARAMS['collect_run_stats']``.
         """
 
+        if collect_stats is None:
+            collect_stats = cfg.PARAMS['collect_run_stats']
+        self.stats = _RunStats() if collect_stats else None
+
+        # Precision of the numerical kernel and of the MB it gets
+        self.dtype = np.dtype(cfg.PARAMS['float_dtype'])
+        if self.dtype not in [np.float32, np.float64]:
+            raise ValueError('float_dtype should be float32 or float64')
+
         self.is_tidewater = is_tidewater
 
         # Mass balance
@@ -441,6 +1083,9 @@ class FlowlineModel(object):
         self.t = None
         self.reset_y0(y0)
 
+        # End of the current run, until which the MB can be precomputed
+        self._mb_y1 = None
+
         self.fls = None
         self._trib = None
         self.reset_flowlines(flowlines, inplace=inplace)
@@ -462,9 +1107,24 @@ class FlowlineModel(object):
                 raise ValueError('mb_elev_feedback not understood')
         self._mb_model = value
         self._mb_call = _mb_call
+        self._mb_current_heights = dict()
+        self._reset_mb_cache()
+
+    def _reset_mb_cache(self):
+        """Forget the MB computed so far."""
         self._mb_current_date = None
         self._mb_current_out = dict()
-        self._mb_current_heights = dict()
+        self._reset_mb_tables()
+
+    def _reset_mb_tables(self):
+        """Forget the MB precomputed for the years to come.
+
+        Called at the start of each run, so that the changes made to the MB
+        model in between (e.g. to its temperature bias) are taken into
+        account from the next MB date on. The MB of the current date is
+        kept.
+        """
+        self._mb_tables = dict()
 
     def reset_y0(self, y0):
         """Reset the initial model time"""
@@ -485,27 +1145,7 @@ class FlowlineModel(object):
         self.fls = flowlines
 
         # list of tributary coordinates and stuff
-        trib_ind = []
-        for fl in self.fls:
-            if fl.flows_to is None:
-                trib_ind.append((None, None, None, None))
-                continue
-            idl = self.fls.index(fl.flows_to)
-            ide = fl.flows_to_indice
-            if fl.flows_to.nx >= 9:
-                gk = GAUSSIAN_KERNEL[9]
-                id0 = ide-4
-                id1 = ide+5
-            elif fl.flows_to.nx >= 7:
-                gk = GAUSSIAN_KERNEL[7]
-                id0 = ide-3
-                id1 = ide+4
-            elif fl.flows_to.nx >= 5:
-                gk = GAUSSIAN_KERNEL[5]
-                id0 = ide-2
-                id1 = ide+3
-            trib_ind.append((idl, id0, id1, gk))
-        self._trib = trib_ind
+        self._trib = _tributary_coupling(self.fls)
 
     @property
     def yr(self):
@@ -539,7 +1179,7 @@ class FlowlineModel(object):
 
         # Do we even have to optimise?
         if self.mb_elev_feedback == 'always':
-            return self._mb_call(heights, year, fl_id=fl_id)
+            return self._call_mb(heights, year, fl_id)
 
         # Ok, user asked for it
         if fl_id is None:
@@ -548,8 +1188,9 @@ class FlowlineModel(object):
         if self.mb_elev_feedback == 'never':
             # The very first call we take the heights
             if fl_id not in self._mb_current_heights:
-                # We need to reset just this tributary
-                self._mb_current_heights[fl_id] = heights
+                # We need to reset just this tributary. Copy: the model might
+                # pass us one of its work arrays
+                self._mb_current_heights[fl_id] = heights.copy()
             # All calls we replace
             heights = self._mb_current_heights[fl_id]
 
@@ -558,20 +1199,71 @@ class FlowlineModel(object):
             # ignore month changes
             date = (date[0], date[0])
 
-        if self._mb_current_date == date:
-            if fl_id not in self._mb_current_out:
-                # We need to reset just this tributary
-                self._mb_current_out[fl_id] = self._mb_call(heights, year,
-                                                            fl_id=fl_id)
-        else:
+        if self._mb_current_date != date:
             # We need to reset all
             self._mb_current_date = date
             self._mb_current_out = dict()
-            self._mb_current_out[fl_id] = self._mb_call(heights, year,
-                                                        fl_id=fl_id)
+
+        if fl_id not in self._mb_current_out:
+            # We need to reset just this tributary
+            if self.mb_elev_feedback in ['annual', 'never']:
+                out = self._get_mb_from_table(heights, year, fl_id)
+            else:
+                out = self._call_mb(heights, year, fl_id)
+            self._mb_current_out[fl_id] = out
 
         return self._mb_current_out[fl_id]
 
+    def _get_mb_from_table(self, heights, year, fl_id):
+        """Annual MB of a flowline which surface might not change.
+
+        The MB of all years until the end of the run is computed at once
+        for the flowlines which surface is frozen (always with
+        ``mb_elev_feedback='never'``, and for the flowlines which surface
+        did not change since the previous year otherwise).
+        """
+
+        y = utils.floatyear_to_date(year)[0]
+        table_h, table_y0, table = self._mb_tables.get(fl_id,
+                                                       (None, 0, ()))
+        frozen = self.mb_elev_feedback == 'never' or (
+            table_h is not None and np.array_equal(table_h, heights))
+        if frozen and table_y0 <= y < table_y0 + len(table):
+            return table[y - table_y0]
+
+        ny = 1
+        if frozen and self._mb_y1 is not None:
+            # Not too many years at once to keep the memory in check
+            ny = min(int(np.ceil(self._mb_y1)) - y, 100)
+            if self.mb_elev_feedback == 'annual':
+                # The surface might change again: longer tables only if
+                # the previous one was used until the end
+                ny = min(ny, 2 * len(table))
+        if ny > 1:
+            table = self._call_mb(heights, np.arange(y, y + ny), fl_id,
+                                  series=True)
+        else:
+            table = self._call_mb(heights, year, fl_id)[np.newaxis]
+        self._mb_tables[fl_id] = (heights.copy(), y, table)
+        return table[0]
+
+    def _call_mb(self, heights, year, fl_id, series=False):
+        """Call the MB model (and count the call if asked to).
+
+        With ``series=True``, ``year`` is an array of years and the MB is
+        given for all of them (annual MB only).
+        """
+        mb_call = self._mb_call
+        if series:
+            mb_call = self.mb_model.get_annual_mb_series
+        if self.stats is None:
+            out = mb_call(heights, year, fl_id=fl_id)
+        else:
+            t0 = perf_counter()
+            out = mb_call(heights, year, fl_id=fl_id)
+            self.stats.add_mb_call(perf_counter() - t0)
+        return np.asarray(out, dtype=self.dtype)
+
     def to_netcdf(self, path):
         """Creates a netcdf group file storing the state of the model."""
 
@@ -605,8 +1297,19 @@ class FlowlineModel(object):
     def run_until(self, y1):
 
         t = (y1-self.y0) * SEC_IN_YEAR
-        while self.t < t:
-            self.step(t-self.t)
+        in_run = self._mb_y1 is not None
+        if not in_run:
+            self._reset_mb_tables()
+            self._mb_y1 = y1
+        try:
+            while self.t < t:
+                if self.stats is None:
+                    self.step(t-self.t)
+                else:
+                    self._step_and_count(t-self.t)
+        finally:
+            if not in_run:
+                self._mb_y1 = None
 
         # Check for domain bounds
         if self.check_for_boundaries:
@@ -618,8 +1321,67 @@ class FlowlineModel(object):
             if np.any(~np.isfinite(fl.thick)):
                 raise FloatingPointError('NaN in numerical solution.')
 
+    def _step_and_count(self, dt):
+        """Same as step(), but adds the step to self.stats."""
+        stats = self.stats
+        t0 = perf_counter()
+        t_bef = self.t
+        mb_bef = stats.wall_time_mb
+        self.step(dt)
+        wall = perf_counter() - t0 - (stats.wall_time_mb - mb_bef)
+        stats.add_step(self.t - t_bef, getattr(self, 'dt_warning', False),
+                       wall)
+
+    def get_state(self):
+        """A snapshot of the model state, to come back to it later.
+
+        Only the state which changes during a run is copied (the ice
+        thickness of all flowlines in one array, the model time, the
+        accumulated calving and the heights of the ``mb_elev_feedback='never'``
+        option), not the geometry. Use it with :py:meth:`set_state`, on this
+        model or on another model of the same glacier (e.g. one made with
+        :py:meth:`copy`).
+        """
+        return {'y0': self.y0, 't': self.t,
+                'thick': np.concatenate([fl.thick for fl in self.fls]),
+                'calving_m3': getattr(self, 'calving_m3_since_y0', None),
+                'mb_heights': dict(self._mb_current_heights)}
+
+    def set_state(self, state):
+        """Go back to a snapshot returned by :py:meth:`get_state`.
+
+        The mass-balance is computed again at the next step (the MB model
+        might have been changed in between).
+        """
+        self.y0 = state['y0']
+        self.t = state['t']
+        offsets = np.cumsum([fl.nx for fl in self.fls])[:-1]
+        for fl, thick in zip(self.fls, np.split(state['thick'], offsets)):
+            fl.thick = thick
+        if state['calving_m3'] is not None:
+            self.calving_m3_since_y0 = state['calving_m3']
+        self._mb_current_heights = dict(state['mb_heights'])
+        self._reset_mb_cache()
+
+    def copy(self):
+        """A new model of the same glacier, for e.g. ensemble runs.
+
+        The copy shares the flowline geometry (bed, widths, line...) and
+        the mass-balance model with this model: only the state (see
+        :py:meth:`get_state`) is copied, which is much cheaper than a
+        ``copy.deepcopy``. The geometry of the flowlines must therefore not
+        be changed in place afterwards.
+        """
+        new = copy.copy(self)
+        new.fls = _share_geometry(self.fls)
+        new.stats = None if self.stats is None else _RunStats()
+        new.set_state(self.get_state())
+        return new
+
     def run_until_and_store(self, y1, run_path=None, diag_path=None,
-                            store_monthly_step=False):
+                            store_monthly_step=False, fallback_steps=None,
+                            checkpoint_interval=10, stream_output=False,
+                            diagnostics=None, store_geometry=None):
         """Runs the model and returns intermediate steps in xarray datasets.
 
         The function returns two datasets:
@@ -634,116 +1396,105 @@ class FlowlineModel(object):
 
         You can store the dataset to disk in netcdf files by providing the
         run_path and diag_path arguments.
+
+        With ``fallback_steps``, the model keeps an in-memory checkpoint of
+        its state every ``checkpoint_interval`` years. If the run fails
+        (RuntimeError or FloatingPointError), it is rolled back to the last
+        checkpoint and the failing interval is run again with the next
+        time stepping scheme of the list (see
+        :py:meth:`FluxBasedModel.set_time_stepping`). Once the model went
+        past the point of failure, the initial scheme is used again.
+        The error is raised if the last scheme of the list fails as well.
+        This is only available for the models with several time stepping
+        schemes (:py:class:`FluxBasedModel` and its subclasses).
+
+        With ``stream_output``, the output is written to the files during
+        the run (in chunks of ``cfg.PARAMS['run_output_chunk_size']`` time
+        steps) instead of being kept in memory: this is useful for very
+        long runs. The output written so far is kept if the run fails.
+        Nothing is returned in this case.
+
+        The diagnostic variables are computed by ``diagnostics``, a list of
+        :py:class:`DiagnosticCollector` or of names of the built-in ones
+        (the default is ``cfg.PARAMS['store_diagnostic_variables']``). With
+        ``store_geometry=False`` (the default is
+        ``cfg.PARAMS['store_model_geometry']``), the glacier geometry is not
+        stored at all and None is returned instead of the model run
+        dataset: this is much cheaper if only the diagnostics are needed.
         """
 
-        # time
-        yearly_time = np.arange(np.floor(self.yr), np.floor(y1)+1)
+        if fallback_steps and not hasattr(self, 'set_time_stepping'):
+            raise InvalidParamsError('fallback_steps is not available for '
+                                     '{}'.format(type(self).__name__))
 
-        if store_monthly_step:
-            monthly_time = utils.monthly_timeseries(self.yr, y1)
+        if stream_output:
+            store = _StreamingRunStore(self, y1, run_path=run_path,
+                                       diag_path=diag_path,
+                                       store_monthly_step=store_monthly_step,
+                                       diagnostics=diagnostics,
+                                       store_geometry=store_geometry)
         else:
-            monthly_time = np.arange(np.floor(self.yr), np.floor(y1)+1)
-        yrs, months = utils.floatyear_to_date(monthly_time)
-        cyrs, cmonths = utils.hydrodate_to_calendardate(yrs, months)
-
-        # init output
-        if run_path is not None:
-            self.to_netcdf(run_path)
-        ny = len(yearly_time)
-        nm = len(monthly_time)
-        sects = [(np.zeros((ny, fl.nx)) * np.NaN) for fl in self.fls]
-        widths = [(np.zeros((ny, fl.nx)) * np.NaN) for fl in self.fls]
-        diag_ds = xr.Dataset()
-
-        # Global attributes
-        diag_ds.attrs['description'] = 'OGGM model output'
-        diag_ds.attrs['oggm_version'] = __version__
-        diag_ds.attrs['calendar'] = '365-day no leap'
-        diag_ds.attrs['creation_date'] = strftime("%Y-%m-%d %H:%M:%S",
-                                                  gmtime())
-
-        # Coordinates
-        diag_ds.coords['time'] = ('time', monthly_time)
-        diag_ds.coords['hydro_year'] = ('time', yrs)
-        diag_ds.coords['hydro_month'] = ('time', months)
-        diag_ds.coords['calendar_year'] = ('time', cyrs)
-        diag_ds.coords['calendar_month'] = ('time', cmonths)
-
-        diag_ds['time'].attrs['description'] = 'Floating hydrological year'
-        diag_ds['hydro_year'].attrs['description'] = 'Hydrological year'
-        diag_ds['hydro_month'].attrs['description'] = 'Hydrological month'
-        diag_ds['calendar_year'].attrs['description'] = 'Calendar year'
-        diag_ds['calendar_month'].attrs['description'] = 'Calendar month'
-
-        # Variables and attributes
-        diag_ds['volume_m3'] = ('time', np.zeros(nm) * np.NaN)
-        diag_ds['volume_m3'].attrs['description'] = 'Total glacier volume'
-        diag_ds['volume_m3'].attrs['unit'] = 'm 3'
-        diag_ds['area_m2'] = ('time', np.zeros(nm) * np.NaN)
-        diag_ds['area_m2'].attrs['description'] = 'Total glacier area'
-        diag_ds['area_m2'].attrs['unit'] = 'm 2'
-        diag_ds['length_m'] = ('time', np.zeros(nm) * np.NaN)
-        diag_ds['length_m'].attrs['description'] = 'Glacier length'
-        diag_ds['length_m'].attrs['unit'] = 'm 3'
-        diag_ds['ela_m'] = ('time', np.zeros(nm) * np.NaN)
-        diag_ds['ela_m'].attrs['description'] = ('Annual Equilibrium Line '
-                                                 'Altitude  (ELA)')
-        diag_ds['ela_m'].attrs['unit'] = 'm a.s.l'
-        if self.is_tidewater:
-            diag_ds['calving_m3'] = ('time', np.zeros(nm) * np.NaN)
-            diag_ds['calving_m3'].attrs['description'] = ('Total accumulated '
-                                                          'calving flux')
-            diag_ds['calving_m3'].attrs['unit'] = 'm 3'
-
-        # Run
-        j = 0
-        for i, (yr, mo) in enumerate(zip(monthly_time, months)):
-            self.run_until(yr)
-            # Model run
-            if mo == 1:
-                for s, w, fl in zip(sects, widths, self.fls):
-                    s[j, :] = fl.section
-                    w[j, :] = fl.widths_m
-                j += 1
-            # Diagnostics
-            diag_ds['volume_m3'].data[i] = self.volume_m3
-            diag_ds['area_m2'].data[i] = self.area_m2
-            diag_ds['length_m'].data[i] = self.length_m
-            diag_ds['ela_m'].data[i] = self.mb_model.get_ela(year=yr)
-            if self.is_tidewater:
-                diag_ds['calving_m3'].data[i] = self.calving_m3_since_y0
-
-        # to datasets
-        run_ds = []
-        for (s, w) in zip(sects, widths):
-            ds = xr.Dataset()
-            ds.attrs['description'] = 'OGGM model output'
-            ds.attrs['oggm_version'] = __version__
-            ds.attrs['calendar'] = '365-day no leap'
-            ds.attrs['creation_date'] = strftime("%Y-%m-%d %H:%M:%S",
-                                                 gmtime())
-            ds.coords['time'] = yearly_time
-            ds['time'].attrs['description'] = 'Floating hydrological year'
-            varcoords = OrderedDict(time=('time', yearly_time),
-                                    year=('time', yearly_time))
-            ds['ts_section'] = xr.DataArray(s, dims=('time', 'x'),
-                                            coords=varcoords)
-            ds['ts_width_m'] = xr.DataArray(w, dims=('time', 'x'),
-                                            coords=varcoords)
-            run_ds.append(ds)
-
-        # write output?
-        if run_path is not None:
-            encode = {'ts_section': {'zlib': True, 'complevel': 5},
-                      'ts_width_m': {'zlib': True, 'complevel': 5},
-                      }
-            for i, ds in enumerate(run_ds):
-                ds.to_netcdf(run_path, 'a', group='fl_{}'.format(i),
-                             encoding=encode)
-        if diag_path is not None:
-            diag_ds.to_netcdf(diag_path)
-
-        return run_ds, diag_ds
+            store = _RunStore(self, y1, run_path=run_path,
+                              diag_path=diag_path,
+                              store_monthly_step=store_monthly_step,
+                              diagnostics=diagnostics,
+                              store_geometry=store_geometry)
+        self._reset_mb_tables()
+        self._mb_y1 = y1
+        try:
+            self._run_and_store(store, fallback_steps=fallback_steps,
+                                checkpoint_interval=checkpoint_interval)
+        except BaseException:
+            # Keep what we have so far
+            store.flush()
+            raise
+        finally:
+            self._mb_y1 = None
+        return store.finalize()
+
+    def _run_and_store(self, store, fallback_steps=None,
+                       checkpoint_interval=10):
+        """The time loop of run_until_and_store."""
+
+        times = list(zip(store.monthly_time, store.months))
+        if not fallback_steps:
+            for i, (yr, mo) in enumerate(times):
+                self.run_until(yr)
+                store.store(i, yr, mo)
+            return
+
+        fast_steps = self.time_stepping
+        level = 0  # index of the current scheme (0 is the initial one)
+        i_fail = 0
+        checkpoint = None
+        i = 0
+        while i < len(times):
+            yr, mo = times[i]
+            if checkpoint is None or yr > checkpoint[0] + checkpoint_interval:
+                checkpoint = (self.yr, i, store.state(), self.get_state())
+            try:
+                self.run_until(yr)
+            except (RuntimeError, FloatingPointError) as err:
+                if level == len(fallback_steps):
+                    raise
+                level += 1
+                i_fail = max(i, i_fail)
+                if self.stats is not None:
+                    self.stats.n_rollbacks += 1
+                log.info('Model failed at year %.2f (%s). Rolling back to '
+                         'year %.2f with %s time stepping.', yr, err,
+                         checkpoint[0], fallback_steps[level-1])
+                _, i, store_state, state = checkpoint
+                store.restore(store_state)
+                self.set_state(state)
+                self.set_time_stepping(fallback_steps[level-1])
+                continue
+            store.store(i, yr, mo)
+            i += 1
+            if level > 0 and i > i_fail:
+                # We made it: back to the fast scheme
+                level = 0
+                self.set_time_stepping(fast_steps)
 
     def run_until_equilibrium(self, rate=0.001, ystep=5, max_ite=200):
         """ Runs the model until an equilibrium state is reached.
@@ -777,12 +1528,30 @@ class FluxBasedModel(FlowlineModel):
     def __init__(self, flowlines, mb_model=None, y0=0., glen_a=None,
                  fs=0., inplace=False, fixed_dt=None, cfl_number=0.05,
                  min_dt=1*SEC_IN_HOUR, max_dt=10*SEC_IN_DAY,
-                 time_stepping='user',
+                 time_stepping='user', subcycling=False, adaptive_tol=0.1,
                  **kwargs):
         """ Instanciate.
 
         Parameters
         ----------
+        time_stepping : str
+            'user' (use cfl_number, min_dt and max_dt as given), one of the
+            explicit schemes with preset numerical parameters ('ambitious',
+            'default', 'conservative', 'ultra-conservative'), 'implicit':
+            semi-implicit scheme without CFL condition, where the time step
+            is only limited by max_dt (one month per default) or
+            'adaptive': explicit scheme where the time step is chosen by
+            an error estimate instead of the CFL condition (see
+            adaptive_tol)
+        subcycling : bool
+            advance each flowline with its own stable time step within a
+            coupling step given by the main flowline (explicit CFL schemes
+            only). Steep tributaries then don't force small steps on the
+            whole glacier.
+        adaptive_tol : float
+            with the 'adaptive' time stepping: the largest error on the ice
+            thickness (m) allowed at each step. The steps with a larger
+            error estimate are done again with a shorter time step.
 
         Properties
         ----------
@@ -793,33 +1562,12 @@ class FluxBasedModel(FlowlineModel):
                                              inplace=inplace,
                                              **kwargs)
 
-        if time_stepping == 'ambitious':
-            cfl_number = 0.1
-            min_dt = 1*SEC_IN_DAY
-            max_dt = 15*SEC_IN_DAY
-        elif time_stepping == 'default':
-            cfl_number = 0.05
-            min_dt = 1*SEC_IN_HOUR
-            max_dt = 10*SEC_IN_DAY
-        elif time_stepping == 'conservative':
-            cfl_number = 0.01
-            min_dt = SEC_IN_HOUR
-            max_dt = 5*SEC_IN_DAY
-        elif time_stepping == 'ultra-conservative':
-            cfl_number = 0.01
-            min_dt = SEC_IN_HOUR / 10
-            max_dt = 5*SEC_IN_DAY
-        else:
-            if time_stepping != 'user':
-                raise ValueError('time_stepping not understood.')
-
         self.dt_warning = False
-        if fixed_dt is not None:
-            min_dt = fixed_dt
-            max_dt = fixed_dt
-        self.min_dt = min_dt
-        self.max_dt = max_dt
-        self.cfl_number = cfl_number
+        self._user_numerics = (cfl_number, min_dt, max_dt)
+        self._fixed_dt = fixed_dt
+        self.subcycling = subcycling
+        self.adaptive_tol = adaptive_tol
+        self.set_time_stepping(time_stepping)
         self.calving_m3_since_y0 = 0.  # total calving since time y0
 
         # Do we want to use shape factors?
@@ -832,8 +1580,36 @@ class FluxBasedModel(FlowlineModel):
             self.sf_func = utils.shape_factor_adhikari
         elif use_sf == 'Huss':
             self.sf_func = utils.shape_factor_huss
+        # The shape factors change slowly: how often do we update them?
+        self.sf_update = cfg.PARAMS['shape_factor_update']
+        self.sf_update_rtol = cfg.PARAMS['shape_factor_update_rtol']
+        if self.sf_update not in ['step', 'annual']:
+            raise ValueError('shape_factor_update not understood')
+
+    def reset_flowlines(self, flowlines, inplace=False):
+        """Same as :py:meth:`FlowlineModel.reset_flowlines` (with new work
+        arrays).
+        """
+        super(FluxBasedModel, self).reset_flowlines(flowlines,
+                                                    inplace=inplace)
+        self._init_work_arrays()
 
-        # Optim
+    def _reset_mb_tables(self):
+        """Same as :py:meth:`FlowlineModel._reset_mb_tables` (the rates of
+        the adaptive scheme depend on the MB too).
+        """
+        super(FluxBasedModel, self)._reset_mb_tables()
+        self._rates_key = None
+
+    def _init_work_arrays(self):
+        """Allocate the arrays used by step() (not shared between models)."""
+
+        # Optim: work arrays reused at each step. The flowlines flowing
+        # into another one (or into the water) have one more grid point
+        # at the end. The section, its update and the ice received from the
+        # tributaries are kept in float64 whatever the precision of the
+        # kernel.
+        dtype = self.dtype
         self._stags = []
         for fl, trib in zip(self.fls, self._trib):
             nx = fl.nx
@@ -841,150 +1617,901 @@ class FluxBasedModel(FlowlineModel):
                 nx = fl.nx + 1
             elif self.is_tidewater:
                 nx = fl.nx + 1
-            a = np.zeros(nx+1)
-            b = np.zeros(nx+1)
-            c = np.zeros(nx+1)
-            d = np.ones(nx+1)  # shape factor default is 1
+            a = np.zeros(nx+1, dtype=dtype)
+            b = np.zeros(nx+1, dtype=dtype)
+            c = np.zeros(nx+1, dtype=dtype)
+            d = np.ones(nx+1, dtype=dtype)  # shape factor default is 1
             e = np.zeros(nx-1)
             f = np.zeros(nx)
-            self._stags.append((a, b, c, d, e, f))
+            # Extended surface_h, thick and section (grid points)
+            g = np.zeros(nx, dtype=dtype)
+            h = np.zeros(nx, dtype=dtype)
+            i = np.zeros(nx)
+            # Velocity, flux and a temporary array (staggered points)
+            j = np.zeros(nx+1, dtype=dtype)
+            k = np.zeros(nx+1, dtype=dtype)
+            l = np.zeros(nx+1, dtype=dtype)
+            # Widths, mass-balance and new section (flowline grid points)
+            m = np.zeros(fl.nx)
+            n = np.zeros(fl.nx)
+            o = np.zeros(fl.nx)
+            self._stags.append((a, b, c, d, e, f, g, h, i, j, k, l, m, n, o))
+
+        # Offsets of the flowlines in the implicit system
+        self._pt_off = np.append(0, np.cumsum([fl.nx for fl in self.fls]))
+
+        # Active window of each flowline: (size, mass-balance, flowline and
+        # flowline version it was computed for)
+        self._windows = [[None, None, None, None] for fl in self.fls]
+
+        # Shape factors of each flowline: (flowline, MB year and thickness
+        # they were computed for, shape factors)
+        self._sf_cache = [[None, None, None, None] for fl in self.fls]
+
+        # Subcycling: last stable time step of each flowline, and ice
+        # received from the tributaries during the last coupling step (part
+        # of the state)
+        self._sub_dts = [np.inf] * len(self.fls)
+        self._inflows = [np.zeros(fl.nx) for fl in self.fls]
+
+        # Adaptive scheme: sections at the beginning of the step, rates of
+        # change of the sections at the current state and at the end of the
+        # step, calving rate, state the rates were computed for and next
+        # time step
+        self._sections0 = [np.zeros(fl.nx) for fl in self.fls]
+        self._rates = [np.zeros(fl.nx) for fl in self.fls]
+        self._new_rates = [np.zeros(fl.nx) for fl in self.fls]
+        self._calving_rate = 0.
+        self._rates_key = None
+        self._next_dt = None
+
+    def copy(self):
+        """Same as :py:meth:`FlowlineModel.copy` (with own work arrays)."""
+        new = super(FluxBasedModel, self).copy()
+        inflows = new._inflows
+        new._init_work_arrays()
+        new._inflows = inflows
+        return new
+
+    def get_state(self):
+        """Same as :py:meth:`FlowlineModel.get_state` (with the ice on
+        its way to the trunks when subcycling).
+        """
+        state = super(FluxBasedModel, self).get_state()
+        state['inflows'] = np.concatenate(self._inflows)
+        return state
+
+    def set_state(self, state):
+        """Same as :py:meth:`FlowlineModel.set_state`."""
+        super(FluxBasedModel, self).set_state(state)
+        offsets = np.cumsum([fl.nx for fl in self.fls])[:-1]
+        self._inflows = np.split(state['inflows'].copy(), offsets)
+        # The shape factors and the rates belong to the old state
+        self._sf_cache = [[None, None, None, None] for fl in self.fls]
+        self._rates_key = None
+        self._next_dt = None
+
+    def _shape_factor(self, i, fl):
+        """The shape factors of the flowline i.
+
+        Per default (``cfg.PARAMS['shape_factor_update']``) they are
+        computed once per MB year and when the thickness changed by more
+        than ``cfg.PARAMS['shape_factor_update_rtol']`` since then.
+        """
+
+        if self.sf_update == 'step':
+            return self.sf_func(fl.widths_m, fl.thick, fl.is_rectangular)
+
+        fl_prev, year, thick_ref, sf = self._sf_cache[i]
+        yr = np.floor(self.yr)
+        update = fl is not fl_prev or yr != year
+        if not update and self.sf_update_rtol > 0:
+            dh = np.sum(np.abs(fl.thick - thick_ref))
+            update = dh > self.sf_update_rtol * max(np.sum(thick_ref), 1.)
+        if update:
+            sf = self.sf_func(fl.widths_m, fl.thick, fl.is_rectangular)
+            self._sf_cache[i] = [fl, yr, fl.thick, sf]
+        return sf
+
+    def set_time_stepping(self, time_stepping):
+        """Switch to another time stepping scheme (see __init__)."""
+
+        cfl_number, min_dt, max_dt = self._user_numerics
+        if time_stepping == 'ambitious':
+            cfl_number = 0.1
+            min_dt = 1*SEC_IN_DAY
+            max_dt = 15*SEC_IN_DAY
+        elif time_stepping == 'default':
+            cfl_number = 0.05
+            min_dt = 1*SEC_IN_HOUR
+            max_dt = 10*SEC_IN_DAY
+        elif time_stepping == 'conservative':
+            cfl_number = 0.01
+            min_dt = SEC_IN_HOUR
+            max_dt = 5*SEC_IN_DAY
+        elif time_stepping == 'ultra-conservative':
+            cfl_number = 0.01
+            min_dt = SEC_IN_HOUR / 10
+            max_dt = 5*SEC_IN_DAY
+        elif time_stepping == 'implicit':
+            # No CFL condition: the step is only limited by max_dt
+            min_dt = SEC_IN_DAY
+            max_dt = SEC_IN_MONTH
+        elif time_stepping == 'adaptive':
+            # The CFL condition only gives the first time step
+            cfl_number = 0.05
+            min_dt = SEC_IN_HOUR / 10
+            max_dt = SEC_IN_MONTH
+        else:
+            if time_stepping != 'user':
+                raise ValueError('time_stepping not understood.')
+        if self.subcycling and time_stepping in ['implicit', 'adaptive']:
+            raise InvalidParamsError('subcycling is not available with the '
+                                     '{} time stepping.'.format(time_stepping))
+
+        if self._fixed_dt is not None:
+            min_dt = self._fixed_dt
+            max_dt = self._fixed_dt
+        self.time_stepping = time_stepping
+        self.implicit = time_stepping == 'implicit'
+        self.adaptive = time_stepping == 'adaptive'
+        self._rates_key = None
+        self._next_dt = None
+        if self.stats is not None:
+            self.stats.add_scheme(time_stepping)
+        self.min_dt = min_dt
+        self.max_dt = max_dt
+        self.cfl_number = cfl_number
 
     def step(self, dt):
         """Advance one step."""
 
+        if self.implicit:
+            # The step is not limited by a CFL condition
+            return self._step_implicit(min(dt, self.max_dt))
+
         # This is to guarantee a precise arrival on a specific date if asked
         min_dt = dt if dt < self.min_dt else self.min_dt
 
+        if self.adaptive:
+            return self._step_adaptive(dt, min_dt)
+
+        if self.subcycling:
+            return self._step_subcycled(dt, min_dt)
+
         # Loop over tributaries to determine the flux rate
-        flxs = []
-        aflxs = []
+        fluxes = []
+        # Points of the trunks receiving ice from a tributary
+        min_win = [0] * len(self.fls)
+        for i in range(len(self.fls)):
+            flux = self._flowline_flux(i, self.yr, min_win)
+            fluxes.append(flux)
+            # CFL condition
+            if flux is not None and flux[-1] < dt:
+                dt = flux[-1]
+
+        # Time step
+        self.dt_warning = dt < min_dt
+        dt = np.clip(dt, min_dt, self.max_dt)
 
-        for fl, trib, (slope_stag, thick_stag, section_stag, sf_stag,
-                       znxm1, znx) in zip(self.fls, self._trib, self._stags):
+        # A second loop for the mass exchange
+        for i, (flux, trib) in enumerate(zip(fluxes, self._trib)):
+            if flux is None:
+                continue
+            outflow = self._flowline_update(i, dt, *flux[:4])
+            # Add the last flux to the tributary
+            # this is ok because the lines are sorted in order
+            if outflow > 0:
+                fluxes[trib[0]][1][trib[1]:trib[2]] += outflow * trib[3]
+
+        # Next step
+        self.t += dt
+        return dt
+
+    def _step_subcycled(self, dt, min_dt):
+        """Advance one coupling step, each flowline with its own time step.
+
+        The main flowline is advanced first and its stable time step is the
+        coupling step, unless another flowline was almost as stable at the
+        previous step (then the coupling step is the smallest of the two:
+        one step is cheaper than two sub-steps). The other flowlines follow
+        (trunks before their tributaries) with as many stable sub-steps as
+        needed to reach the end of the coupling step. The ice flowing out
+        of a tributary during a coupling step enters its trunk at a constant
+        rate during the next one.
+        """
+
+        dt = min(max(dt, min_dt), self.max_dt)
+        self.dt_warning = False
+        main = len(self.fls) - 1
+        min_win = [0] * len(self.fls)
+        for i in range(main, -1, -1):
+            trib = self._trib[i]
+            inflow = self._inflows[i]
+            receives = inflow.any()
+            if receives:
+                # The window has to include the points receiving the ice
+                min_win[i] = np.flatnonzero(inflow)[-1] + 2
+            t = 0.
+            while True:
+                flux = self._flowline_flux(i, self.yr + t / SEC_IN_YEAR,
+                                           min_win)
+                if flux is None:
+                    # This flowline won't change during this coupling step
+                    self._sub_dts[i] = np.inf
+                    break
+                flx_stag, aflx, _mb, outflow, sub_dt = flux
+                if sub_dt < min_dt:
+                    self.dt_warning = True
+                    sub_dt = min_dt
+                elif sub_dt > self.max_dt:
+                    sub_dt = self.max_dt
+                self._sub_dts[i] = sub_dt
+                if i == main:
+                    dt = min(dt, sub_dt)
+                    dt = min([dt] + [d for d in self._sub_dts if d > dt / 2])
+                if t == 0 and receives:
+                    inflow /= dt
+                # Equal sub-steps until the end of the coupling step
+                if sub_dt < dt - t:
+                    sub_dt = (dt - t) / np.ceil((dt - t) / sub_dt)
+                else:
+                    sub_dt = dt - t
+                if receives:
+                    aflx += inflow
+                outflow = self._flowline_update(i, sub_dt, flx_stag, aflx,
+                                                _mb, outflow)
+                if outflow > 0:
+                    self._inflows[trib[0]][trib[1]:trib[2]] += (outflow *
+                                                                trib[3] *
+                                                                sub_dt)
+                t += sub_dt
+                if t >= dt * (1 - 1e-12):
+                    break
+            if receives:
+                inflow[:] = 0
+
+        # Next step
+        self.t += dt
+        return dt
+
+    def _step_adaptive(self, dt, min_dt):
+        """Explicit step with a time step controlled by an error estimate.
+
+        The sections are advanced with the rates of change of the current
+        state (Euler). The error of the step is estimated with the rates at
+        the end of the step, as the difference to Heun's (second order)
+        solution. If it is larger than ``adaptive_tol`` (in ice thickness)
+        the step is done again with a shorter time step. Either way, the
+        next time step is adapted to the error. The rates at the end of the
+        step are those of the next step, so that an accepted step costs one
+        flux computation. Numerical instabilities show up as large errors:
+        the time step stays close to the largest stable one.
+        """
+
+        key = self._state_key()
+        if key != self._rates_key:
+            self._calving_rate, cfl_dt = self._section_rates(self._rates)
+            if self._next_dt is None:
+                self._next_dt = cfl_dt
+
+        t0 = self.t
+        for fl, section in zip(self.fls, self._sections0):
+            np.copyto(section, fl.section)
+
+        next_dt = min(self._next_dt, self.max_dt)
+        dt = max(min(dt, next_dt), min_dt)
+        tol = self.adaptive_tol
+        rejected = False
+        while True:
+            for i, fl in enumerate(self.fls):
+                new_section = self._stags[i][14]
+                np.multiply(self._rates[i], dt, out=new_section)
+                new_section += self._sections0[i]
+                fl.section = new_section.clip(0, out=new_section)
+            self.t = t0 + dt
+            calving_rate, _ = self._section_rates(self._new_rates)
+
+            # Error estimate (ice thickness, NaN if the step blew up)
+            err = 0.
+            for fl, r0, r1 in zip(self.fls, self._rates, self._new_rates):
+                dr = np.abs(r1 - r0) / np.maximum(fl.widths_m, 10.)
+                err = np.maximum(err, 0.5 * dt * np.max(dr))
+            if not np.isfinite(err):
+                fac = 0.2
+            elif err > 0:
+                fac = min(max(0.9 * np.sqrt(tol / err), 0.2), 5.)
+            else:
+                fac = 5.
+            ok = err <= tol
+            if ok or dt <= min_dt:
+                break
+            if self.stats is not None:
+                self.stats.n_rejected_steps += 1
+            rejected = True
+            dt = max(dt * fac, min_dt)
+
+        self.dt_warning = not ok
+        self.calving_m3_since_y0 += self._calving_rate * dt
+        if dt < next_dt and not rejected:
+            # Shorter step to arrive on a specific date: not the error's
+            # fault
+            next_dt = max(next_dt, dt * fac)
+        else:
+            next_dt = dt * fac
+        self._next_dt = next_dt
+        self._rates, self._new_rates = self._new_rates, self._rates
+        self._calving_rate = calving_rate
+        self._rates_key = self._state_key()
+        return dt
+
+    def _state_key(self):
+        """What the rates of the adaptive scheme were computed for."""
+        return (self.t, self._mb_model,
+                [(fl, fl._thick_version) for fl in self.fls])
+
+    def _section_rates(self, rates):
+        """Rates of change of the sections for the current geometry.
+
+        Fills ``rates`` (one array per flowline, m2 s-1) and returns the
+        calving rate (m3 s-1) and the time step allowed by the CFL
+        condition.
+        """
+
+        min_win = [0] * len(self.fls)
+        fluxes = [self._flowline_flux(i, self.yr, min_win)
+                  for i in range(len(self.fls))]
+        calving_rate = 0.
+        cfl_dt = self.max_dt
+        for i, (flux, trib, rate) in enumerate(zip(fluxes, self._trib,
+                                                   rates)):
+            if flux is None:
+                rate[:] = 0
+                continue
+            flx_stag, aflx, _mb, outflow, max_dt = flux
+            cfl_dt = min(cfl_dt, max_dt)
+
+            # Same as _flowline_update, per second
+            fl = self.fls[i]
+            widths = self._stags[i][12]
+            np.copyto(widths, fl.widths_m)
+            widths[(_mb > 0.) & (widths == 0)] = 10.
+            np.multiply(_mb, widths, out=rate)
+            ne = len(flx_stag) - 1
+            rate[:ne] += flx_stag[0:-1]
+            rate[:ne] -= flx_stag[1:]
+            rate += aflx
+
+            # The tributaries are before their trunk
+            if outflow and trib[0] is not None:
+                fluxes[trib[0]][1][trib[1]:trib[2]] += (flx_stag[-1].clip(0) *
+                                                        trib[3])
+            elif outflow and self.is_tidewater:
+                calving_rate += flx_stag[-2].clip(0) * fl.dx_meter
+        return calving_rate, cfl_dt
+
+    def _flowline_flux(self, i, yr, min_win):
+        """Flux rates of flowline i for its current geometry.
+
+        Returns None if the flowline cannot change (no ice, no accumulation
+        and no tributary flowing into it). Otherwise, returns the flux rates
+        at the staggered points, the array receiving the flux rates of the
+        tributaries, the mass-balance, whether ice flows out of the flowline
+        and the maximum time step allowed by the CFL condition.
+        """
+
+        fl = self.fls[i]
+        trib = self._trib[i]
+        (slope_stag, thick_stag, section_stag, sf_stag, znxm1, znx,
+         surface_h, thick, section, u_stag, flx_stag, tmp_stag,
+         _, _, _) = self._stags[i]
+
+        nx = fl.nx
+        dx = fl.dx_meter
+
+        # Current state (no need to add the last point for simple lines)
+        thick[:nx] = fl.thick
+        np.add(thick[:nx], fl.bed_h, out=surface_h[:nx])
+        section[:nx] = fl.section
+
+        # Mass balance
+        _mb = self.get_mb(surface_h[:nx], yr, fl_id=i)
+
+        # Empty flowlines stay empty
+        if (min_win[i] == 0 and not thick[:nx].any() and
+                not (_mb > 0).any()):
+            return None
+
+        # Reset
+        znxm1[:] = 0
+        znx[:] = 0
+
+        # Active window (the trunks also need the points receiving ice
+        # from the tributaries)
+        ne = min(max(self._active_window(i, thick[:nx], _mb), min_win[i]),
+                 nx)
+        self._windows[i][:2] = ne, _mb
+        windowed = ne < nx
+
+        # If it is a tributary, we use the branch it flows into to compute
+        # the slope of the last grid points
+        is_trib = trib[0] is not None
+        if windowed:
+            # No outflow: the work arrays are cut to the window
+            slope_stag, thick_stag, section_stag, u_stag, flx_stag, \
+                tmp_stag = [a[:ne+1] for a in (slope_stag, thick_stag,
+                                               section_stag, u_stag,
+                                               flx_stag, tmp_stag)]
+            surface_h, thick, section = [a[:ne] for a in (surface_h,
+                                                          thick,
+                                                          section)]
+            if self.sf_func is not None:
+                sf_stag = sf_stag[:ne+1]
+        elif is_trib:
+            fl_to = self.fls[trib[0]]
+            ide = fl.flows_to_indice
+            surface_h[-1] = fl_to.thick[ide] + fl_to.bed_h[ide]
+            thick[-1] = thick[-2]
+            section[-1] = section[-2]
+            # The trunk has to compute the points receiving the ice
+            min_win[trib[0]] = max(min_win[trib[0]], trib[2] + 1)
+        elif self.is_tidewater:
+            # For tidewater glacier, we trick and set the outgoing thick
+            # to zero (for numerical stability and this should quite OK
+            # represent what happens at the calving tongue)
+            surface_h[-1] = surface_h[-2] - thick[-2]
+            thick[-1] = 0
+            section[-1] = 0
+
+        # Staggered gradient
+        slope_stag[0] = 0
+        np.subtract(surface_h[0:-1], surface_h[1:], out=slope_stag[1:-1])
+        slope_stag[1:-1] /= dx
+        slope_stag[-1] = slope_stag[-2]
+
+        # Convert to angle?
+        # slope_stag = np.sin(np.arctan(slope_stag))
+
+        # Staggered thick
+        np.add(thick[0:-1], thick[1:], out=thick_stag[1:-1])
+        thick_stag[1:-1] /= 2.
+        thick_stag[0] = thick[0]
+        thick_stag[-1] = thick[-1]
+
+        if self.sf_func is not None:
+            sf = self._shape_factor(i, fl)
+            if windowed:
+                sf = sf[:ne]
+            elif is_trib or self.is_tidewater:
+                # for water termination or inflowing tributary, the sf
+                # makes no sense
+                sf = np.append(sf, 1.)
+            np.add(sf[0:-1], sf[1:], out=sf_stag[1:-1])
+            sf_stag[1:-1] /= 2.
+            sf_stag[0] = sf[0]
+            sf_stag[-1] = sf[-1]
+
+        # Staggered velocity (Deformation + Sliding)
+        # _fd = 2/(N+2) * self.glen_a
+        # u_stag = (thick_stag**(N+1)) * self._fd * rhogh * sf_stag**N +
+        #          (thick_stag**(N-1)) * self.fs * rhogh
+        # with rhogh = (rho*G*slope_stag)**N, computed in place
+        N = self.glen_n
+        rhogh = tmp_stag
+        np.multiply(slope_stag, self.rho*G, out=rhogh)
+        rhogh **= N
+        np.copyto(u_stag, thick_stag)
+        u_stag **= N+1
+        u_stag *= self._fd
+        u_stag *= rhogh
+        if self.sf_func is not None:
+            np.copyto(flx_stag, sf_stag)
+            flx_stag **= N
+            u_stag *= flx_stag
+        np.copyto(flx_stag, thick_stag)
+        flx_stag **= N-1
+        flx_stag *= self.fs
+        flx_stag *= rhogh
+        u_stag += flx_stag
+
+        # Staggered section
+        np.add(section[0:-1], section[1:], out=section_stag[1:-1])
+        section_stag[1:-1] /= 2.
+        section_stag[0] = section[0]
+        section_stag[-1] = section[-1]
+
+        # Staggered flux rate
+        np.multiply(u_stag, section_stag, out=flx_stag)
+        flx_stag /= dx
+
+        # The results
+        if is_trib or self.is_tidewater:
+            aflx = znxm1
+            if not windowed:
+                flx_stag = flx_stag[:-1]
+                u_stag = u_stag[:-1]
+        else:
+            aflx = znx
 
+        # CFL condition
+        maxu = np.max(np.abs(u_stag, out=tmp_stag[:len(u_stag)]))
+        if maxu > 0.:
+            max_dt = self.cfl_number * dx / float(maxu)
+        else:
+            max_dt = self.max_dt
+
+        return flx_stag, aflx, _mb, not windowed, max_dt
+
+    def _flowline_update(self, i, dt, flx_stag, aflx, _mb, outflow):
+        """Update the section of flowline i with the results of
+        _flowline_flux and return the flux rate flowing into its trunk.
+        """
+
+        fl = self.fls[i]
+        trib = self._trib[i]
+        stags = self._stags[i]
+
+        nx = fl.nx
+        dx = fl.dx_meter
+        section = stags[8][:nx]
+        widths, mb, new_section = stags[12:15]
+
+        # Mass balance
+        np.copyto(widths, fl.widths_m)
+        # Allow parabolic beds to grow
+        widths[(_mb > 0.) & (widths == 0)] = 10.
+        np.multiply(_mb, dt, out=mb)
+        mb *= widths
+
+        # Update section with flowing and mass balance
+        # new_section = (section + (flx_stag[0:-1] - flx_stag[1:])*dt +
+        #                aflx*dt + mb)
+        # (no flux after the active window)
+        ne = len(flx_stag) - 1
+        np.subtract(flx_stag[0:-1], flx_stag[1:], out=new_section[:ne])
+        new_section[ne:] = 0
+        new_section *= dt
+        new_section += section
+        aflx *= dt
+        new_section += aflx
+        new_section += mb
+
+        # Keep positive values only and store
+        fl.section = new_section.clip(0, out=new_section)
+        self._windows[i][2:] = fl, fl._thick_version
+
+        # The last flux goes to the tributary
+        # (there is no outflow if the ice is far from the end)
+        if outflow and trib[0] is not None:
+            return flx_stag[-1].clip(0)
+        elif outflow and self.is_tidewater:
+            # -2 because the last flux is zero per construction
+            # TODO: not sure if this is the way to go yet,
+            # but mass conservation is OK
+            self.calving_m3_since_y0 += flx_stag[-2].clip(0)*dt*dx
+        return 0.
+
+    def _active_window(self, i, thick, mb):
+        """Number of grid points of flowline i to compute during the step.
+
+        Ice only moves by one grid point per step, so nothing happens
+        after the point following the last one with ice or with a positive
+        mass-balance. The window is computed again if the mass-balance or
+        the flowline changed in between (restarts, rollbacks...). Otherwise
+        it only grows by one point when the glacier advances.
+        """
+        fl = self.fls[i]
+        ne, mb_prev, fl_prev, version = self._windows[i]
+        if (mb is mb_prev and fl is fl_prev and
+                fl._thick_version == version):
+            if ne < fl.nx and thick[ne-1] > 0:
+                ne += 1
+            return ne
+        active = (thick > 0) | (mb > 0)
+        if not active.any():
+            return 2
+        return min(fl.nx - np.argmax(active[::-1]) + 1, fl.nx)
+
+    def _implicit_coefficients(self, dt):
+        """Flux coefficients of the current geometry for the implicit step.
+
+        The ice volume flowing between two grid points during dt is
+        C * (s_up - s_down), with the same staggered discretization as the
+        explicit scheme. Returns a list of (C, surface_h of the extended
+        point or None, flux into the trunk is positive) per flowline.
+        """
+
+        N = self.glen_n
+        rhog = self.rho*G
+        out = []
+        for i, (fl, trib) in enumerate(zip(self.fls, self._trib)):
+
+            dx = fl.dx_meter
             surface_h = fl.surface_h
             thick = fl.thick
             section = fl.section
-            dx = fl.dx_meter
 
-            # Reset
-            znxm1[:] = 0
-            znx[:] = 0
-
-            # If it is a tributary, we use the branch it flows into to compute
-            # the slope of the last grid points
-            is_trib = trib[0] is not None
-            if is_trib:
-                fl_to = self.fls[trib[0]]
-                ide = fl.flows_to_indice
-                surface_h = np.append(surface_h, fl_to.surface_h[ide])
+            # Extended domain, as in the explicit scheme
+            s_ext = None
+            if trib[0] is not None:
+                s_ext = self.fls[trib[0]].surface_h[fl.flows_to_indice]
                 thick = np.append(thick, thick[-1])
                 section = np.append(section, section[-1])
             elif self.is_tidewater:
-                # For tidewater glacier, we trick and set the outgoing thick
-                # to zero (for numerical stability and this should quite OK
-                # represent what happens at the calving tongue)
-                surface_h = np.append(surface_h, surface_h[-1] - thick[-1])
-                thick = np.append(thick, 0)
-                section = np.append(section, 0)
-
-            # Staggered gradient
-            slope_stag[0] = 0
+                s_ext = fl.bed_h[-1]
+                thick = np.append(thick, 0.)
+                section = np.append(section, 0.)
+            if s_ext is not None:
+                surface_h = np.append(surface_h, s_ext)
+
+            # Staggered variables
+            nst = len(surface_h) + 1
+            slope_stag = np.zeros(nst)
             slope_stag[1:-1] = (surface_h[0:-1] - surface_h[1:]) / dx
             slope_stag[-1] = slope_stag[-2]
-
-            # Convert to angle?
-            # slope_stag = np.sin(np.arctan(slope_stag))
-
-            # Staggered thick
+            thick_stag = np.zeros(nst)
             thick_stag[1:-1] = (thick[0:-1] + thick[1:]) / 2.
             thick_stag[[0, -1]] = thick[[0, -1]]
-
+            section_stag = np.zeros(nst)
+            section_stag[1:-1] = (section[0:-1] + section[1:]) / 2.
+            section_stag[[0, -1]] = section[[0, -1]]
+            sf_stag = 1.
             if self.sf_func is not None:
-                # TODO: maybe compute new shape factors only every year?
-                sf = self.sf_func(fl.widths_m, fl.thick, fl.is_rectangular)
-                if is_trib or self.is_tidewater:
-                    # for water termination or inflowing tributary, the sf
-                    # makes no sense
+                sf = self._shape_factor(i, fl)
+                if s_ext is not None:
                     sf = np.append(sf, 1.)
+                sf_stag = np.ones(nst)
                 sf_stag[1:-1] = (sf[0:-1] + sf[1:]) / 2.
                 sf_stag[[0, -1]] = sf[[0, -1]]
 
-            # Staggered velocity (Deformation + Sliding)
-            # _fd = 2/(N+2) * self.glen_a
-            N = self.glen_n
-            rhogh = (self.rho*G*slope_stag)**N
-            u_stag = (thick_stag**(N+1)) * self._fd * rhogh * sf_stag**N + \
-                     (thick_stag**(N-1)) * self.fs * rhogh
+            # Linearized flux: u * section / dx = C / dt * (s_up - s_down)
+            c_stag = (self._fd * thick_stag**(N+1) * sf_stag**N +
+                      self.fs * thick_stag**(N-1))
+            c_stag *= rhog**N * np.abs(slope_stag)**(N-1)
+            c_stag *= section_stag * dt / dx**2
+            if s_ext is not None:
+                c_stag = c_stag[:-1]
+            out.append((c_stag, s_ext, slope_stag[fl.nx] > 0))
+        return out
 
-            # Staggered section
-            section_stag[1:-1] = (section[0:-1] + section[1:]) / 2.
-            section_stag[[0, -1]] = section[[0, -1]]
+    def _implicit_solve(self, coefs, widths, surface_h, mbs):
+        """Solves the implicit system for the new surface elevation.
 
-            # Staggered flux rate
-            flx_stag = u_stag * section_stag / dx
+        The system is tridiagonal for each flowline, plus the tributary
+        coupling terms. These only concern a few columns of the matrix and
+        are accounted for with the Woodbury identity, so that the system is
+        always solved with a banded solver.
+        """
 
-            # Store the results
-            if is_trib:
-                flxs.append(flx_stag[:-1])
-                aflxs.append(znxm1)
-                u_stag = u_stag[:-1]
-            elif self.is_tidewater:
-                flxs.append(flx_stag[:-1])
-                aflxs.append(znxm1)
-                u_stag = u_stag[:-1]
-            else:
-                flxs.append(flx_stag)
-                aflxs.append(znx)
+        npt = self._pt_off[-1]
+        # Banded matrix (upper, diagonal and lower) and right hand side:
+        # d(section) = widths * d(surface_h). Ice free points get a nominal
+        # width so that the system stays regular
+        ab = np.zeros((3, npt))
+        diag = ab[1]
+        diag[:] = np.where(widths > 0, widths, 10.)
+        rhs = diag * surface_h + mbs
+        # Tributary coupling terms (row, col, value), out of the band
+        rows = []
+        cols = []
+        vals = []
+
+        for i, (fl, trib, (c_stag, s_ext, pos)) in enumerate(
+                zip(self.fls, self._trib, coefs)):
 
-            # CFL condition
-            maxu = np.max(np.abs(u_stag))
-            if maxu > 0.:
-                _dt = self.cfl_number * dx / maxu
-            else:
-                _dt = self.max_dt
-            if _dt < dt:
-                dt = _dt
+            nx = fl.nx
+            idx = np.arange(self._pt_off[i], self._pt_off[i+1])
 
-        # Time step
-        self.dt_warning = dt < min_dt
-        dt = np.clip(dt, min_dt, self.max_dt)
+            # Fluxes between the grid points of the flowline
+            c = c_stag[1:nx]
+            diag[idx[:-1]] += c
+            diag[idx[1:]] += c
+            ab[0, idx[1:]] -= c  # (k, k+1) is stored in ab[0, k+1]
+            ab[2, idx[:-1]] -= c  # (k+1, k) is stored in ab[2, k]
 
-        # A second loop for the mass exchange
-        for i, (fl, flx_stag, aflx, trib) in enumerate(zip(self.fls, flxs,
-                                                           aflxs, self._trib)):
+            # Flux out of the last grid point
+            c = c_stag[nx]
+            if trib[0] is not None:
+                j = self._pt_off[trib[0]] + fl.flows_to_indice
+                diag[idx[-1]] += c
+                rows.append([idx[-1]])
+                cols.append([j])
+                vals.append([-c])
+                # Only positive fluxes go into the tributary
+                if pos:
+                    ids = self._pt_off[trib[0]] + np.arange(trib[1], trib[2])
+                    rows.extend([ids, ids])
+                    cols.extend([ids * 0 + idx[-1], ids * 0 + j])
+                    vals.extend([-c * trib[3], c * trib[3]])
+            elif self.is_tidewater:
+                diag[idx[-1]] += c
+                rhs[idx[-1]] += c * s_ext
+            else:
+                diag[idx[-1]] -= c
+                ab[2, idx[-2]] += c
+
+        if not rows:
+            return solve_banded((1, 1), ab, rhs)
+
+        # A = B + U V^T, with B banded, U the coupling columns and V the
+        # matrix selecting them
+        rows = np.concatenate(rows)
+        cols, ic = np.unique(np.concatenate(cols), return_inverse=True)
+        u = np.zeros((npt, len(cols)))
+        np.add.at(u, (rows, ic), np.concatenate(vals))
+        yz = solve_banded((1, 1), ab, np.column_stack([rhs, u]))
+        y, z = yz[:, 0], yz[:, 1:]
+        cap = np.eye(len(cols)) + z[cols]
+        return y - z.dot(np.linalg.solve(cap, y[cols]))
+
+    def _step_implicit(self, dt):
+        """Advance one semi-implicit step.
+
+        The flux coefficients are computed from the current geometry and the
+        surface elevation at the end of the step is solved for implicitly
+        (predictor). The coefficients are then computed again from the
+        geometry at mid-step and the system solved a second time
+        (corrector), which avoids the odd-even oscillations of the lagged
+        scheme at long time steps. The sections are updated with the fluxes
+        of the new surface, so that mass is conserved.
+        """
 
-            dx = fl.dx_meter
+        self.dt_warning = False
 
-            # Mass balance
-            widths = fl.widths_m
+        # Mass balance (computed on the current surface)
+        widths = []
+        mbs = []
+        for i, fl in enumerate(self.fls):
+            w = fl.widths_m.copy()
             mb = self.get_mb(fl.surface_h, self.yr, fl_id=i)
             # Allow parabolic beds to grow
-            widths = np.where((mb > 0.) & (widths == 0), 10., widths)
-            mb = dt * mb * widths
+            w[(mb > 0.) & (w == 0)] = 10.
+            widths.append(w)
+            mbs.append(mb * dt * w)
+        widths = np.concatenate(widths)
+        surface_h = np.concatenate([fl.surface_h for fl in self.fls])
+        mbs_all = np.concatenate(mbs)
+
+        # Predictor
+        coefs = self._implicit_coefficients(dt)
+        new_h = self._implicit_solve(coefs, widths, surface_h, mbs_all)
+
+        # Corrector, with the coefficients of the mid-step geometry
+        thicks = [fl.thick for fl in self.fls]
+        mid_h = (surface_h + new_h) / 2
+        for fl, i0, i1 in zip(self.fls, self._pt_off[:-1], self._pt_off[1:]):
+            fl.surface_h = mid_h[i0:i1]
+        coefs = self._implicit_coefficients(dt)
+        for fl, thick in zip(self.fls, thicks):
+            fl.thick = thick
+        new_h = self._implicit_solve(coefs, widths, surface_h, mbs_all)
+
+        # Mass exchange with the fluxes of the new surface
+        aflxs = [np.zeros(fl.nx) for fl in self.fls]
+        new_sections = []
+        for i, (fl, trib, mb, (c_stag, s_ext, pos)) in enumerate(
+                zip(self.fls, self._trib, mbs, coefs)):
 
-            # Update section with flowing and mass balance
-            new_section = (fl.section + (flx_stag[0:-1] - flx_stag[1:])*dt +
-                           aflx*dt + mb)
-
-            # Keep positive values only and store
-            fl.section = new_section.clip(0)
+            nx = fl.nx
+            s = new_h[self._pt_off[i]:self._pt_off[i+1]]
 
-            # Add the last flux to the tributary
-            # this is ok because the lines are sorted in order
+            # Flux volumes over dt (staggered)
+            flx = np.zeros(nx + 1)
+            flx[1:nx] = c_stag[1:nx] * (s[0:-1] - s[1:])
             if trib[0] is not None:
-                aflxs[trib[0]][trib[1]:trib[2]] += (flx_stag[-1].clip(0) *
-                                                    trib[3])
+                flx[nx] = c_stag[nx] * (s[-1] - new_h[self._pt_off[trib[0]] +
+                                                      fl.flows_to_indice])
+                if pos:
+                    aflxs[trib[0]][trib[1]:trib[2]] += flx[nx] * trib[3]
             elif self.is_tidewater:
-                # -2 because the last flux is zero per construction
-                # TODO: not sure if this is the way to go yet,
-                # but mass conservation is OK
-                self.calving_m3_since_y0 += flx_stag[-2].clip(0)*dt*dx
+                flx[nx] = c_stag[nx] * (s[-1] - s_ext)
+                self.calving_m3_since_y0 += flx[nx].clip(0) * fl.dx_meter
+            else:
+                flx[nx] = c_stag[nx] * (s[-2] - s[-1])
+
+            new_sections.append(fl.section + flx[0:-1] - flx[1:] + mb)
+
+        # Keep positive values only and store
+        for fl, new_section, aflx in zip(self.fls, new_sections, aflxs):
+            fl.section = (new_section + aflx).clip(0)
 
         # Next step
         self.t += dt
         return dt
 
+    def solve_steady_state(self, tol=1e-5, max_ite=1000, max_dh=20.,
+                           dt0=SEC_IN_MONTH, max_dt=1e4*SEC_IN_YEAR):
+        """Finds the equilibrium geometry of the glacier directly.
+
+        Pseudo-transient continuation: the glacier is advanced with
+        semi-implicit steps (see ``time_stepping='implicit'``) whose length
+        grows as the rate of volume change decreases (switched evolution
+        relaxation), until this rate is smaller than ``tol``. Steps which
+        change the geometry too much are done again with a shorter step.
+        This is much faster than :py:meth:`run_until_equilibrium`, and
+        the model time is left unchanged.
+
+        Be careful: This only works for CONSTANT (not time-dependant)
+        mass-balance models.
+
+        Parameters
+        ----------
+        tol : float
+            convergence criterion: the relative rate of volume change
+            (units: yr-1)
+        max_ite : int
+            maximum number of pseudo time steps
+        max_dh : float
+            steps changing the ice thickness by more than this are done
+            again with a shorter step (units: m)
+        dt0 : float
+            length of the first pseudo time step (units: s)
+        max_dt : float
+            maximum length of the pseudo time steps (units: s)
+
+        Returns
+        -------
+        the number of pseudo time steps needed
+
+        Raises
+        ------
+        RuntimeError if no equilibrium was found (the model is then back
+        to its initial state)
+        """
+
+        start = self.get_state()
+        dt = dt0
+        res_prev = None
+        vol_prev = self.volume_m3
+        for ite in range(1, max_ite+1):
+            prev = self.get_state()
+            self._step_implicit(dt)
+            thick = np.concatenate([fl.thick for fl in self.fls])
+            dh = np.max(np.abs(thick - prev['thick']))
+            if not np.isfinite(dh) or dh > max_dh:
+                # The coefficients are those of the old geometry: the step
+                # is not accurate enough. Try again with a shorter one
+                self.set_state(prev)
+                dt /= 2
+                res_prev = None
+                continue
+            vol = self.volume_m3
+            res = np.abs(vol - vol_prev) / max(vol, 1.) * SEC_IN_YEAR / dt
+            vol_prev = vol
+            if res < tol:
+                # Back to the initial time, with the new geometry
+                start['thick'] = thick
+                self.set_state(start)
+                return ite
+            if res_prev is not None:
+                dt *= np.clip(1.5 * res_prev / res, 0.5, 2.)
+            dt = min(dt, max_dt)
+            res_prev = res
+
+        self.set_state(start)
+        raise RuntimeError('Did not find equilibrium.')
+
+    def run_until_equilibrium(self, rate=0.001, ystep=5, max_ite=200,
+                              steady_state_solver=False):
+        """Runs the model until an equilibrium state is reached.
+
+        Same as :py:meth:`FlowlineModel.run_until_equilibrium`. With
+        ``steady_state_solver``, the glacier is first brought close to
+        equilibrium with :py:meth:`solve_steady_state`: the time stepping
+        then only needs a few steps to confirm (and refine) the
+        equilibrium. If the solver fails, this is the usual time stepping.
+        """
+
+        if steady_state_solver:
+            try:
+                self.solve_steady_state()
+            except RuntimeError:
+                log.info('Steady state solver failed. Running the model '
+                         'until equilibrium instead.')
+        super(FluxBasedModel, self).run_until_equilibrium(rate=rate,
+                                                          ystep=ystep,
+                                                          max_ite=max_ite)
+
 
 class MassConservationChecker(FluxBasedModel):
     """This checks if the FluzBasedmodel is conserving mass."""
@@ -1048,7 +2575,7 @@ class KarthausModel(FlowlineModel):
         super(KarthausModel, self).__init__(flowlines, mb_model=mb_model,
                                             y0=y0, glen_a=glen_a, fs=fs,
                                             inplace=inplace)
-        self.dt_warning = False,
+        self.dt_warning = False
         if fixed_dt is not None:
             min_dt = fixed_dt
             max_dt = fixed_dt
@@ -1136,7 +2663,7 @@ class MUSCLSuperBeeModel(FlowlineModel):
         super(MUSCLSuperBeeModel, self).__init__(flowlines, mb_model=mb_model,
                                                  y0=y0, glen_a=glen_a, fs=fs,
                                                  inplace=inplace)
-        self.dt_warning = False,
+        self.dt_warning = False
         if fixed_dt is not None:
             min_dt = fixed_dt
             max_dt = fixed_dt
@@ -1277,8 +2804,695 @@ class MUSCLSuperBeeModel(FlowlineModel):
         self.t += dt
 
 
+class BatchFluxBasedModel(object):
+    """Advances many :py:class:`FluxBasedModel` glaciers in lockstep.
+
+    The flowlines of all glaciers are packed into one concatenated (ragged)
+    array with offset indices, so that the staggered slopes, velocities,
+    fluxes and the CFL time step are computed for all glaciers in single
+    numpy operations instead of one Python loop per glacier and flowline.
+    Each glacier keeps its own time step and model time ``t``, i.e. the
+    results are the same as when running each model on its own.
+
+    The member models are updated (flowlines, ``t``, calving) each time
+    the batch returns from :py:meth:`run_until`.
+
+    Attributes
+    ----------
+    models : list
+        the member FluxBasedModel instances
+    errors : list
+        for each member, the exception which stopped it (None if all ok)
+    """
+
+    def __init__(self, models):
+        """Instanciate.
+
+        Parameters
+        ----------
+        models : list of FluxBasedModel
+            the models to advance together. They are used as "templates":
+            their flowlines, mass-balance models and numerical parameters
+            are the ones used for the batch run.
+        """
+
+        self.models = list(models)
+        if len(self.models) == 0:
+            raise ValueError('Need at least one model.')
+        for m in self.models:
+            if type(m).step is not FluxBasedModel.step:
+                raise ValueError('BatchFluxBasedModel only works with '
+                                 'FluxBasedModel instances.')
+            if m.implicit or m.adaptive:
+                raise ValueError('BatchFluxBasedModel does not support the '
+                                 '{} time stepping.'.format(m.time_stepping))
+            if m.subcycling:
+                raise ValueError('BatchFluxBasedModel does not support '
+                                 'subcycling.')
+        self.glen_n = self.models[0].glen_n
+        if np.any([m.glen_n != self.glen_n for m in self.models]):
+            raise ValueError('All models need to have the same glen_n.')
+        self.dtype = self.models[0].dtype
+        if np.any([m.dtype != self.dtype for m in self.models]):
+            raise ValueError('All models need to have the same dtype.')
+
+        self.sf_func = self.models[0].sf_func
+        self._sf_update = self.models[0].sf_update
+        self._sf_update_rtol = self.models[0].sf_update_rtol
+        self._sf_cache = (None, None, None)
+        ng = len(self.models)
+        self.errors = [None] * ng
+
+        # Per glacier
+        self.t = np.array([m.t for m in self.models], dtype=np.float64)
+        self.y0 = np.array([m.y0 for m in self.models], dtype=np.float64)
+        self.calving = np.array([m.calving_m3_since_y0 for m in self.models])
+        self.min_dt = np.array([m.min_dt for m in self.models], dtype=float)
+        self.max_dt = np.array([m.max_dt for m in self.models], dtype=float)
+        self.dt_warning = np.zeros(ng, dtype=bool)
+        self._failed = np.zeros(ng, dtype=bool)
+        self._is_tidewater = np.array([m.is_tidewater for m in self.models])
+        self._mb_keys = [None] * ng
+        self._stats_g = [g for g, m in enumerate(self.models)
+                         if m.stats is not None]
+
+        # Per flowline
+        fls = []
+        fl_glacier = []
+        fl_id = []
+        fl_cfl = []
+        fl_dx = []
+        for g, m in enumerate(self.models):
+            for i, fl in enumerate(m.fls):
+                fls.append(fl)
+                fl_glacier.append(g)
+                fl_id.append(i)
+                fl_cfl.append(m.cfl_number)
+                fl_dx.append(fl.dx_meter)
+        self._fls = fls
+        self._fl_glacier = np.array(fl_glacier)
+        self._fl_id = fl_id
+        self._fl_cfl_dx = np.array(fl_cfl) * np.array(fl_dx)
+        fl_nx = np.array([fl.nx for fl in fls])
+        self._fl_nx = fl_nx
+        # points offsets
+        self._fl_off = np.append(0, np.cumsum(fl_nx))
+        # staggered offsets (nx + 1 staggered points per flowline)
+        self._st_off = np.append(0, np.cumsum(fl_nx + 1))
+        # flowline offsets per glacier
+        n_fls = np.array([len(m.fls) for m in self.models])
+        self._g_fl_off = np.append(0, np.cumsum(n_fls))
+        self._g_pt_off = self._fl_off[self._g_fl_off]
+        npt = self._fl_off[-1]
+        nst = self._st_off[-1]
+
+        # Packed geometry
+        self.bed_h = np.concatenate([fl.bed_h for fl in fls])
+        self.thick = np.concatenate([fl.thick for fl in fls])
+        self._is_trap = np.zeros(npt, dtype=bool)
+        self._is_rect = np.zeros(npt, dtype=bool)
+        self._bed_shape = np.zeros(npt) * np.NaN
+        self._w0_m = np.zeros(npt) * np.NaN
+        self._lambdas = np.zeros(npt) * np.NaN
+        for fl, i0, i1 in zip(fls, self._fl_off[:-1], self._fl_off[1:]):
+            sl = slice(i0, i1)
+            if isinstance(fl, MixedBedFlowline):
+                self._is_trap[sl] = fl.is_trapezoid
+                self._bed_shape[sl] = fl.bed_shape
+                self._w0_m[sl] = fl._w0_m
+                self._lambdas[sl] = fl._lambdas
+            elif isinstance(fl, ParabolicBedFlowline):
+                self._bed_shape[sl] = fl.bed_shape
+            elif isinstance(fl, TrapezoidalBedFlowline):
+                self._is_trap[sl] = True
+                self._w0_m[sl] = fl._w0_m
+                self._lambdas[sl] = fl._lambdas
+            elif isinstance(fl, RectangularBedFlowline):
+                self._is_trap[sl] = True
+                self._w0_m[sl] = fl.widths_m
+                self._lambdas[sl] = 0.
+            else:
+                raise ValueError('Flowline type not understood: '
+                                 '{}'.format(type(fl).__name__))
+            if fl.is_rectangular is not None:
+                self._is_rect[sl] = fl.is_rectangular
+        self._sqrt_bed = np.sqrt(self._bed_shape)
+        self._ptrap = np.where(self._is_trap)[0]
+        self._prec = np.where(self._is_trap & (self._lambdas == 0))[0]
+        self._do_trapeze = len(self._ptrap) > 0
+
+        # Per point and per staggered point constants
+        self._pt_glacier = np.repeat(self._fl_glacier, fl_nx)
+        st_glacier = np.repeat(self._fl_glacier, fl_nx + 1)
+        rho = np.array([m.rho for m in self.models])
+        dtype = self.dtype
+        self._rhog_st = (rho * G)[st_glacier].astype(dtype)
+        self._fd_st = np.array([m._fd for m in self.models],
+                               dtype=dtype)[st_glacier]
+        self._fs_st = np.array([m.fs for m in self.models],
+                               dtype=dtype)[st_glacier]
+        self._dx_st = np.repeat(np.array(fl_dx, dtype=dtype), fl_nx + 1)
+        self._st_glacier = st_glacier
+
+        # Staggered indices. Each flowline has nx+1 staggered points: the
+        # first one (upstream boundary), nx-1 interior ones and the last
+        # one, which depends on how the flowline ends.
+        st_first = self._st_off[:-1]
+        st_last = self._st_off[1:] - 1
+        pt_first = self._fl_off[:-1]
+        pt_last = self._fl_off[1:] - 1
+        is_int = np.ones(nst, dtype=bool)
+        is_int[st_first] = False
+        is_int[st_last] = False
+        self._st_int = np.where(is_int)[0]
+        st_fl = np.repeat(np.arange(len(fls)), fl_nx + 1)
+        self._st_int_l = self._st_int - st_fl[self._st_int] - 1
+        self._st_int_r = self._st_int_l + 1
+        self._st_first = st_first
+        self._pt_first = pt_first
+
+        # How do the lines end?
+        trib_src = []
+        trib_dst = []
+        trib_w = []
+        ftype = np.zeros(len(fls), dtype=int)  # 0: simple, 1: trib, 2: water
+        trib_target = np.zeros(len(fls), dtype=int)
+        f = 0
+        for g, m in enumerate(self.models):
+            for fl, trib in zip(m.fls, m._trib):
+                if trib[0] is not None:
+                    ftype[f] = 1
+                    to = self._g_fl_off[g] + trib[0]
+                    to_off = self._fl_off[to]
+                    trib_target[f] = to_off + fl.flows_to_indice
+                    trib_src.extend([st_last[f]] * len(trib[3]))
+                    trib_dst.extend(np.arange(to_off + trib[1],
+                                              to_off + trib[2]))
+                    trib_w.extend(trib[3])
+                elif m.is_tidewater:
+                    ftype[f] = 2
+                f += 1
+        self._end_plain = (st_last[ftype == 0], pt_last[ftype == 0])
+        self._end_trib = (st_last[ftype == 1], pt_last[ftype == 1],
+                          trib_target[ftype == 1])
+        self._end_water = (st_last[ftype == 2], pt_last[ftype == 2])
+        self._trib_src = np.array(trib_src, dtype=int)
+        self._trib_dst = np.array(trib_dst, dtype=int)
+        self._trib_w = np.array(trib_w, dtype=float)
+        self._st_last = st_last
+
+        # Flux divergence: left and right staggered point of each point
+        self._pt_st_l = np.arange(npt) + np.repeat(np.arange(len(fls)), fl_nx)
+        self._pt_st_r = self._pt_st_l + 1
+
+        # Tidewater calving: flux between the two last points
+        self._calving_st = st_last[ftype == 2] - 1
+        self._calving_g = self._fl_glacier[ftype == 2]
+        self._calving_dx = np.array(fl_dx)[ftype == 2]
+
+        # Mass-balance
+        self._mb = np.zeros(npt, dtype=dtype)
+
+    @property
+    def yr(self):
+        """The model time of each glacier (floating year)."""
+        return self.y0 + self.t / SEC_IN_YEAR
+
+    @property
+    def surface_h(self):
+        return self.thick + self.bed_h
+
+    @property
+    def widths_m(self):
+        out = np.sqrt(4*self.thick/self._bed_shape)
+        if self._do_trapeze:
+            pt = self._ptrap
+            out[pt] = self._w0_m[pt] + self._lambdas[pt] * self.thick[pt]
+        return out
+
+    def _section_from(self, widths_m):
+        thick = self.thick
+        out = 2./3. * widths_m * thick
+        if self._do_trapeze:
+            pt = self._ptrap
+            out[pt] = (widths_m[pt] + self._w0_m[pt]) / 2 * thick[pt]
+        return out
+
+    @property
+    def section(self):
+        return self._section_from(self.widths_m)
+
+    def _thick_from(self, section):
+        out = (0.75 * section * self._sqrt_bed)**(2./3.)
+        if self._do_trapeze:
+            pt = self._ptrap
+            b = 2 * self._w0_m[pt]
+            a = 2 * self._lambdas[pt]
+            with np.errstate(divide='ignore', invalid='ignore'):
+                out[pt] = (np.sqrt(b ** 2 + 4 * a * section[pt]) - b) / a
+            pr = self._prec
+            out[pr] = section[pr] / self._w0_m[pr]
+        return out.clip(0)
+
+    @section.setter
+    def section(self, val):
+        self.thick = self._thick_from(val)
+
+    def _update_mb(self, surface_h, active):
+        """Update the packed mass-balance where the MB date changed."""
+
+        yrs = self.yr
+        for g, model in enumerate(self.models):
+            if self._failed[g] or not active[g]:
+                continue
+            y, m = utils.floatyear_to_date(float(yrs[g]))
+            fb = model.mb_elev_feedback
+            if fb in ['annual', 'never']:
+                key = y
+            elif fb == 'monthly':
+                key = (y, m)
+            else:
+                key = None
+            if key is not None and key == self._mb_keys[g]:
+                continue
+            self._mb_keys[g] = key
+            f0, f1 = self._g_fl_off[g], self._g_fl_off[g+1]
+            try:
+                for f in range(f0, f1):
+                    sl = slice(self._fl_off[f], self._fl_off[f+1])
+                    self._mb[sl] = model.get_mb(surface_h[sl], yrs[g],
+                                                fl_id=self._fl_id[f])
+            except Exception as err:
+                self._fail(g, err)
+
+    def step(self, dt):
+        """Advance all glaciers by one step.
+
+        Parameters
+        ----------
+        dt : ndarray
+            the maximum time step for each glacier (0 for no step)
+
+        Returns
+        -------
+        the actual time step taken by each glacier
+        """
+
+        # This is to guarantee a precise arrival on a specific date if asked
+        min_dt = np.where(dt < self.min_dt, dt, self.min_dt)
+
+        thick = self.thick
+        surface_h = self.surface_h
+        widths_m = self.widths_m
+        section = self._section_from(widths_m)
+
+        # Mass balance (this might let some glaciers fail)
+        self._update_mb(surface_h, dt > 0.)
+
+        # The kernel works in the precision of the models (the section is
+        # updated in float64)
+        dtype = self.dtype
+        thick_k, surface_h_k, section_k = [a.astype(dtype, copy=False) for a
+                                           in (thick, surface_h, section)]
+
+        N = self.glen_n
+        nst = self._st_off[-1]
+        slope_stag = np.zeros(nst, dtype=dtype)
+        thick_stag = np.zeros(nst, dtype=dtype)
+        section_stag = np.zeros(nst, dtype=dtype)
+
+        # Interior staggered points
+        sti, stl, str_ = self._st_int, self._st_int_l, self._st_int_r
+        slope_stag[sti] = (surface_h_k[stl] - surface_h_k[str_]) / \
+            self._dx_st[sti]
+        thick_stag[sti] = (thick_k[stl] + thick_k[str_]) / 2.
+        section_stag[sti] = (section_k[stl] + section_k[str_]) / 2.
+
+        # Upstream boundary
+        st, pt = self._st_first, self._pt_first
+        slope_stag[st] = 0
+        thick_stag[st] = thick_k[pt]
+        section_stag[st] = section_k[pt]
+
+        # Downstream ends
+        st, pt = self._end_plain
+        slope_stag[st] = slope_stag[st - 1]
+        thick_stag[st] = thick_k[pt]
+        section_stag[st] = section_k[pt]
+        # Tributaries: the slope is computed with the branch they flow into
+        st, pt, to = self._end_trib
+        slope_stag[st] = (surface_h_k[pt] - surface_h_k[to]) / self._dx_st[st]
+        thick_stag[st] = (thick_k[pt] + thick_k[pt]) / 2.
+        section_stag[st] = (section_k[pt] + section_k[pt]) / 2.
+        # Water terminating: outgoing thick is set to zero
+        st, pt = self._end_water
+        slope_stag[st] = (surface_h_k[pt] -
+                          (surface_h_k[pt] - thick_k[pt])) / self._dx_st[st]
+        thick_stag[st] = (thick_k[pt] + 0) / 2.
+        section_stag[st] = (section_k[pt] + 0) / 2.
+
+        sf_stag = 1.
+        if self.sf_func is not None:
+            sf = self._shape_factor(widths_m, thick)
+            sf_stag = np.ones(nst, dtype=dtype)
+            sf_stag[sti] = (sf[stl] + sf[str_]) / 2.
+            sf_stag[self._st_first] = sf[self._pt_first]
+            st, pt = self._end_plain
+            sf_stag[st] = sf[pt]
+            for st, pt in (self._end_trib[:2], self._end_water):
+                sf_stag[st] = (sf[pt] + 1.) / 2.
+
+        # Staggered velocity (Deformation + Sliding)
+        rhogh = (self._rhog_st * slope_stag)**N
+        u_stag = (thick_stag**(N+1)) * self._fd_st * rhogh * sf_stag**N + \
+                 (thick_stag**(N-1)) * self._fs_st * rhogh
+
+        # Staggered flux rate
+        flx_stag = u_stag * section_stag / self._dx_st
+
+        # CFL condition, per flowline and then per glacier
+        maxu = np.maximum.reduceat(np.abs(u_stag), self._st_off[:-1])
+        with np.errstate(divide='ignore', invalid='ignore'):
+            _dt = np.where(maxu > 0., self._fl_cfl_dx / maxu,
+                           self.max_dt[self._fl_glacier])
+        _dt = np.fmin.reduceat(_dt, self._g_fl_off[:-1])
+        dt = np.fmin(dt, _dt)
+
+        # Time step
+        self.dt_warning = dt < min_dt
+        dt = np.clip(dt, min_dt, self.max_dt)
+        dt[self._failed] = 0.
+
+        # Mass balance
+        mb = self._mb
+        dt_pt = dt[self._pt_glacier]
+        # Allow parabolic beds to grow
+        widths = np.where((mb > 0.) & (widths_m == 0), 10., widths_m)
+        mb = dt_pt * mb * widths
+
+        # Tributaries inflow
+        aflx = np.zeros(len(thick))
+        np.add.at(aflx, self._trib_dst,
+                  flx_stag[self._trib_src].clip(0) * self._trib_w)
+
+        # Update section with flowing and mass balance
+        new_section = (section + (flx_stag[self._pt_st_l] -
+                                  flx_stag[self._pt_st_r]) * dt_pt +
+                       aflx * dt_pt + mb)
+
+        # Keep positive values only and store. Glaciers which did not move
+        # are left untouched (the section to thickness conversion is not
+        # exactly reversible)
+        new_thick = self._thick_from(new_section.clip(0))
+        self.thick = np.where(dt_pt > 0., new_thick, thick)
+
+        # Calving
+        if len(self._calving_g) > 0:
+            g = self._calving_g
+            self.calving[g] += (flx_stag[self._calving_st].clip(0) * dt[g] *
+                                self._calving_dx)
+
+        # Next step
+        self.t += dt
+        return dt
+
+    def _shape_factor(self, widths_m, thick):
+        """The packed shape factors (see FluxBasedModel._shape_factor).
+
+        They are computed again for all glaciers as soon as one of them
+        enters a new MB year.
+        """
+
+        if self._sf_update == 'step':
+            return self.sf_func(widths_m, thick, self._is_rect)
+
+        years, thick_ref, sf = self._sf_cache
+        yrs = np.floor(self.yr)
+        update = sf is None or np.any(yrs != years)
+        if not update and self._sf_update_rtol > 0:
+            dh = np.sum(np.abs(thick - thick_ref))
+            update = dh > self._sf_update_rtol * max(np.sum(thick_ref), 1.)
+        if update:
+            sf = self.sf_func(widths_m, thick, self._is_rect)
+            self._sf_cache = (yrs, thick, sf)
+        return sf
+
+    def _step_and_count(self, dt):
+        """Same as step(), but adds the step to the stats of the models.
+
+        The wall time of the step (without the MB calls) is shared evenly
+        between the glaciers which moved.
+        """
+        stats = [self.models[g].stats for g in self._stats_g]
+        t0 = perf_counter()
+        mb_bef = sum(s.wall_time_mb for s in stats)
+        dt = self.step(dt)
+        wall = perf_counter() - t0 - (sum(s.wall_time_mb for s in stats) -
+                                      mb_bef)
+        wall = wall / max(np.count_nonzero(dt), 1)
+        for g, s in zip(self._stats_g, stats):
+            if dt[g] > 0:
+                s.add_step(dt[g], self.dt_warning[g], wall)
+        return dt
+
+    def _sync_models(self):
+        """Write the packed state back to the member models."""
+        for g, model in enumerate(self.models):
+            f0, f1 = self._g_fl_off[g], self._g_fl_off[g+1]
+            for f in range(f0, f1):
+                sl = slice(self._fl_off[f], self._fl_off[f+1])
+                self._fls[f].thick = self.thick[sl]
+            model.t = self.t[g]
+            model.dt_warning = self.dt_warning[g]
+            model.calving_m3_since_y0 = self.calving[g]
+
+    def run_until(self, y1):
+        """Run all (valid) glaciers until the year y1.
+
+        Glaciers which fail (NaNs in the solution or glacier exceeding
+        the domain boundaries) are marked as failed and not run any further:
+        the exception is stored in ``self.errors``.
+        """
+
+        t = (y1 - self.y0) * SEC_IN_YEAR
+        in_run = self.models[0]._mb_y1 is not None
+        if not in_run:
+            self._reset_mb_tables()
+            self._set_mb_y1(y1)
+        try:
+            while True:
+                active = (self.t < t) & ~self._failed
+                if not np.any(active):
+                    break
+                if self._stats_g:
+                    self._step_and_count(np.where(active, t - self.t, 0.))
+                else:
+                    self.step(np.where(active, t - self.t, 0.))
+        finally:
+            if not in_run:
+                self._set_mb_y1(None)
+
+        self._sync_models()
+
+        for g, model in enumerate(self.models):
+            if self._failed[g]:
+                continue
+            # Check for domain bounds
+            if model.check_for_boundaries:
+                if model.fls[-1].thick[-1] > 10:
+                    err = RuntimeError('Glacier exceeds domain boundaries.')
+                    self._fail(g, err)
+                    continue
+            # Check for NaNs
+            for fl in model.fls:
+                if np.any(~np.isfinite(fl.thick)):
+                    self._fail(g, FloatingPointError('NaN in numerical '
+                                                     'solution.'))
+                    break
+
+    def _fail(self, g, err):
+        self._failed[g] = True
+        self.errors[g] = err
+
+    def _reset_mb_tables(self):
+        """Forget the MB precomputed by the models (see
+        :py:meth:`FlowlineModel._reset_mb_tables`).
+        """
+        for model in self.models:
+            model._reset_mb_tables()
+
+    def _set_mb_y1(self, y1):
+        """Until when the models can precompute their MB."""
+        for model in self.models:
+            model._mb_y1 = y1
+
+    def run_until_and_store(self, y1, run_paths=None, diag_paths=None,
+                            store_monthly_step=False, stream_output=False,
+                            diagnostics=None, store_geometry=None):
+        """Runs the glaciers and stores the output of each of them.
+
+        Same as :py:meth:`FlowlineModel.run_until_and_store`, but for
+        all the member models at once. All models must start at the same
+        time.
+
+        Parameters
+        ----------
+        y1 : float
+            the end year of the run
+        run_paths : list of str, optional
+            where to write the model run files (one per model)
+        diag_paths : list of str, optional
+            where to write the model diagnostics files (one per model)
+        store_monthly_step : bool
+            whether to store the diagnostic data at a monthly time step or
+            not (default is yearly)
+        stream_output : bool
+            write the output to the files during the run (see
+            :py:meth:`FlowlineModel.run_until_and_store`)
+        diagnostics : list, optional
+            the diagnostic variables to store (see
+            :py:meth:`FlowlineModel.run_until_and_store`)
+        store_geometry : bool, optional
+            whether to store the glacier geometry (see
+            :py:meth:`FlowlineModel.run_until_and_store`)
+
+        Returns
+        -------
+        a list of (run_ds, diag_ds) tuples, one per model (None if the
+        model failed)
+        """
+
+        yr = self.yr
+        if not np.all(yr == yr[0]):
+            raise ValueError('All models must start at the same time.')
+
+        ng = len(self.models)
+        if run_paths is None:
+            run_paths = [None] * ng
+        if diag_paths is None:
+            diag_paths = [None] * ng
+
+        cls = _StreamingRunStore if stream_output else _RunStore
+        stores = [cls(m, y1, run_path=rp, diag_path=dp,
+                      store_monthly_step=store_monthly_step,
+                      diagnostics=diagnostics, store_geometry=store_geometry)
+                  for m, rp, dp in zip(self.models, run_paths, diag_paths)]
+
+        s0 = stores[0]
+        self._reset_mb_tables()
+        self._set_mb_y1(y1)
+        try:
+            for i, (yr, mo) in enumerate(zip(s0.monthly_time, s0.months)):
+                self.run_until(yr)
+                for g, store in enumerate(stores):
+                    if not self._failed[g]:
+                        store.store(i, yr, mo)
+        finally:
+            self._set_mb_y1(None)
+
+        out = []
+        for g, store in enumerate(stores):
+            out.append(None if self._failed[g] else store.finalize())
+        return out
+
+
+class EnsembleFluxBasedModel(BatchFluxBasedModel):
+    """Advances an ensemble of runs of one glacier in lockstep.
+
+    The members are copies of the same :py:class:`FluxBasedModel` (they
+    share the flowline geometry, see :py:meth:`FlowlineModel.copy`), each
+    with its own mass-balance model (e.g. another random seed or
+    temperature bias). The ice dynamics of all members are computed
+    together by the :py:class:`BatchFluxBasedModel` machinery, and the
+    diagnostics are stored along a ``member`` dimension.
+    """
+
+    def __init__(self, model, mb_models):
+        """Instanciate.
+
+        Parameters
+        ----------
+        model : FluxBasedModel
+            the model (glacier geometry, initial state and numerical
+            parameters) to start all members from
+        mb_models : list of MassBalanceModel
+            the mass-balance model of each member
+        """
+        members = []
+        for mb in mb_models:
+            member = model.copy()
+            member.mb_model = mb
+            members.append(member)
+        super(EnsembleFluxBasedModel, self).__init__(members)
+
+    @property
+    def volume_m3(self):
+        return np.array([m.volume_m3 for m in self.models])
+
+    @property
+    def area_m2(self):
+        return np.array([m.area_m2 for m in self.models])
+
+    @property
+    def length_m(self):
+        return np.array([m.length_m for m in self.models])
+
+    def run_until_and_store(self, y1, run_paths=None, diag_path=None,
+                            store_monthly_step=False, diagnostics=None):
+        """Runs the members and stores their diagnostics in one dataset.
+
+        Parameters
+        ----------
+        y1 : float
+            the end year of the run
+        run_paths : list of str, optional
+            where to write the model run files (one per member)
+        diag_path : str, optional
+            where to write the model diagnostics (all members)
+        store_monthly_step : bool
+            whether to store the diagnostic data at a monthly time step or
+            not (default is yearly)
+        diagnostics : list, optional
+            the diagnostic variables to store (see
+            :py:meth:`FlowlineModel.run_until_and_store`)
+
+        Returns
+        -------
+        the model diagnostics dataset, with a ``member`` dimension. The
+        diagnostics of the members which failed are NaN. The geometry is
+        only stored if run_paths are given.
+        """
+
+        out = super(EnsembleFluxBasedModel, self).run_until_and_store(
+            y1, run_paths=run_paths, store_monthly_step=store_monthly_step,
+            diagnostics=diagnostics, store_geometry=run_paths is not None)
+
+        ok = [r for r in out if r is not None]
+        if not ok:
+            raise RuntimeError('All ensemble members failed.')
+        empty = ok[0][1] * np.NaN
+        diag_ds = xr.concat([empty if r is None else r[1] for r in out],
+                            dim='member', data_vars='all',
+                            coords='minimal')
+        diag_ds = diag_ds.transpose('time', 'member')
+        diag_ds.coords['member'] = ('member', np.arange(len(out)))
+        diag_ds['member'].attrs['description'] = 'Ensemble member'
+        # The run stats are per member
+        diag_ds.attrs = OrderedDict((k, v) for k, v in ok[0][1].attrs.items()
+                                    if not k.startswith('stats_'))
+        if diag_path is not None:
+            diag_ds.to_netcdf(diag_path)
+        return diag_ds
+
+
 class FileModel(object):
-    """Duck FlowlineModel which actually reads the stuff out of a nc file."""
+    """Duck FlowlineModel which actually reads the stuff out of a nc file.
+
+    The time series of all flowlines are read into memory once: going to a
+    given year (:py:meth:`run_until`) is a simple array lookup, and the
+    volume, area and length time series (:py:meth:`diagnostics_ts`) are
+    computed in bulk.
+    """
 
     def __init__(self, path):
         """ Instanciate.
@@ -1299,6 +3513,16 @@ class FileModel(object):
             dss.append(ds)
         self.last_yr = ds.year.values[-1]
         self.dss = dss
+
+        # (time, x) arrays of each flowline
+        self._sections = [ds.ts_section.values for ds in dss]
+        self._widths = [ds.ts_width_m.values for ds in dss]
+        self._time = dss[0].time.values
+        # For a regular time axis the index is computed directly
+        self._dt = None
+        dt = np.diff(self._time)
+        if len(dt) > 0 and np.allclose(dt, dt[0]) and dt[0] > 0:
+            self._dt = dt[0]
         self.reset_y0()
 
     def __enter__(self):
@@ -1312,7 +3536,7 @@ class FileModel(object):
         """Reset the initial model time"""
 
         if y0 is None:
-            y0 = self.dss[0].time[0]
+            y0 = self._time[0]
         self.y0 = y0
         self.yr = y0
 
@@ -1336,31 +3560,52 @@ class FileModel(object):
     def length_m(self):
         return self.fls[-1].length_m
 
-    def run_until(self, year=None, month=None):
-        """Mimics the model's behavior.
+    def _time_index(self, yr):
+        """Index of the year yr in the time axis (KeyError if not there)."""
 
-        Is quite slow, I must say.
-        """
+        time = self._time
+        if self._dt is not None:
+            i = int(np.round((yr - time[0]) / self._dt))
+        else:
+            i = int(np.searchsorted(time, yr - 1e-6))
+        if i < 0 or i >= len(time) or not np.isclose(time[i], yr, rtol=0,
+                                                     atol=1e-6):
+            raise KeyError('Year {} is not in the model run.'.format(yr))
+        return i
+
+    def run_until(self, year=None, month=None):
+        """Mimics the model's behavior."""
 
         if month is not None:
-            for fl, ds in zip(self.fls, self.dss):
-                sel = ds.ts_section.isel(time=(ds.year == year) &
-                                              (ds.month == month))
-                fl.section = sel.values
-        else:
-            for fl, ds in zip(self.fls, self.dss):
-                sel = ds.ts_section.sel(time=year)
-                fl.section = sel.values
-        self.yr = sel.time.values
+            year = utils.date_to_floatyear(year, month)
+        i = self._time_index(year)
+        for fl, sections in zip(self.fls, self._sections):
+            fl.section = sections[i]
+        self.yr = self._time[i]
+
+    def _ts(self, data):
+        return pd.Series(data, index=pd.Index(self._time, name='time'))
+
+    def diagnostics_ts(self):
+        """The volume, area and length time series of the run.
+
+        Returns
+        -------
+        a pandas DataFrame with the ``volume_m3``, ``area_m2`` and
+        ``length_m`` columns
+        """
+        return pd.DataFrame({'volume_m3': self.volume_m3_ts(),
+                             'area_m2': self.area_m2_ts(),
+                             'length_m': self.length_m_ts()})
 
     def area_m2_ts(self, rollmin=0):
         """rollmin is the number of years you want to smooth onto"""
-        sel = 0
-        for fl, ds in zip(self.fls, self.dss):
-            widths = ds.ts_width_m.copy()
-            widths[:] = np.where(ds.ts_section > 0., ds.ts_width_m, 0.)
-            sel += widths.sum(dim='x') * fl.dx_meter
-        sel = sel.to_series()
+        area = 0
+        for fl, sections, widths in zip(self.fls, self._sections,
+                                        self._widths):
+            widths = np.where(sections > 0., widths, 0.)
+            area = area + np.nansum(widths, axis=1) * fl.dx_meter
+        sel = self._ts(area)
         if rollmin != 0:
             sel = sel.rolling(rollmin).min()
             sel.iloc[0:rollmin] = sel.iloc[rollmin]
@@ -1370,10 +3615,10 @@ class FileModel(object):
         return self.area_m2_ts(**kwargs) * 1e-6
 
     def volume_m3_ts(self):
-        sel = 0
-        for fl, ds in zip(self.fls, self.dss):
-            sel += ds.ts_section.sum(dim='x') * fl.dx_meter
-        return sel.to_series()
+        vol = 0
+        for fl, sections in zip(self.fls, self._sections):
+            vol = vol + np.nansum(sections, axis=1) * fl.dx_meter
+        return self._ts(vol)
 
     def volume_km3_ts(self):
         return self.volume_m3_ts() * 1e-9
@@ -1381,11 +3626,8 @@ class FileModel(object):
     def length_m_ts(self, rollmin=0):
         """rollmin is the number of years you want to smooth onto"""
         fl = self.fls[-1]
-        ds = self.dss[-1]
-        sel = ds.ts_section.copy()
-        sel[:] = ds.ts_section != 0.
-        sel = sel.sum(dim='x') * fl.dx_meter
-        sel = sel.to_series()
+        length = np.count_nonzero(self._sections[-1], axis=1) * fl.dx_meter
+        sel = self._ts(length.astype(np.float64))
         if rollmin != 0:
             sel = sel.rolling(rollmin).min()
             sel.iloc[0:rollmin] = sel.iloc[rollmin]
@@ -1541,11 +3783,13 @@ def init_present_time_glacier(gdir):
 def robust_model_run(gdir, output_filesuffix=None, mb_model=None,
                      ys=None, ye=None, zero_initial_glacier=False,
                      init_model_fls=None, store_monthly_step=False,
-                     **kwargs):
+                     steady_state=False, **kwargs):
     """Trial-error-and-retry algorithm to run the flowline model.
 
      Runs a model simulation with the default time stepping scheme and,
-     if failing, tries a more conservative one.
+     if failing, rolls back to the last checkpoint (every
+     ``cfg.PARAMS['run_checkpoint_interval']`` years) and runs the failing
+     interval again with a more conservative one.
      This is a rather clumsy way to deal with numerical instabilities:
      for most glaciers the default numerical parameters work fine, but for some
      glaciers numerical instabilities might arise and lead to overfloating
@@ -1561,46 +3805,102 @@ def robust_model_run(gdir, output_filesuffix=None, mb_model=None,
      - it is inelegant
 
      Possibly a method based on mass-conservation checks would be more robust.
+
+     A ``time_stepping`` scheme can be given as keyword argument: the run
+     is done with this one and, if failing, falls back to the more
+     conservative explicit schemes. With the 'adaptive' scheme, the time
+     step is adapted to the glacier at each step and this should rarely be
+     necessary.
+
+     With ``steady_state``, the glacier is first brought to equilibrium
+     (see :py:meth:`FluxBasedModel.run_until_equilibrium`) and the run
+     starts from there. This only makes sense with a constant mass-balance.
      """
 
     kwargs.setdefault('fs', cfg.PARAMS['fs'])
     kwargs.setdefault('glen_a', cfg.PARAMS['glen_a'])
 
+    steps = ['default', 'conservative', 'ultra-conservative']
+    time_stepping = kwargs.pop('time_stepping', 'default')
+    if time_stepping in steps:
+        steps = steps[steps.index(time_stepping):]
+    else:
+        steps = [time_stepping] + steps
+
     run_path = gdir.get_filepath('model_run', filesuffix=output_filesuffix,
                                  delete=True)
     diag_path = gdir.get_filepath('model_diagnostics',
                                   filesuffix=output_filesuffix,
                                   delete=True)
-
-    steps = ['default', 'conservative', 'ultra-conservative']
-    for step in steps:
-        log.info('(%s) trying %s time stepping scheme.', gdir.rgi_id, step)
-        if init_model_fls is None:
-            fls = gdir.read_pickle('model_flowlines')
-        else:
-            fls = copy.deepcopy(init_model_fls)
-        if zero_initial_glacier:
-            for fl in fls:
-                fl.thick = fl.thick * 0.
-        model = FluxBasedModel(fls, mb_model=mb_model, y0=ys,
-                               inplace=True,
-                               time_stepping=step,
-                               is_tidewater=gdir.is_tidewater,
-                               **kwargs)
-        try:
-            model.run_until_and_store(ye, run_path=run_path,
-                                      diag_path=diag_path,
-                                      store_monthly_step=store_monthly_step)
-        except (RuntimeError, FloatingPointError):
-            if step == 'ultra-conservative':
-                raise
-            continue
-        # If we get here we good
-        log.info('(%s) %s time stepping was successful!', gdir.rgi_id, step)
-        break
+    if not cfg.PARAMS['store_model_geometry']:
+        run_path = None
+
+    if init_model_fls is None:
+        fls = gdir.read_pickle('model_flowlines')
+    else:
+        fls = _share_geometry(init_model_fls)
+    if zero_initial_glacier:
+        for fl in fls:
+            fl.thick = fl.thick * 0.
+    model = FluxBasedModel(fls, mb_model=mb_model, y0=ys,
+                           inplace=True,
+                           time_stepping=steps[0],
+                           is_tidewater=gdir.is_tidewater,
+                           **kwargs)
+    if steady_state:
+        model.run_until_equilibrium(steady_state_solver=True)
+        log.info('(%s) starting from the equilibrium glacier.', gdir.rgi_id)
+        model.reset_y0(ys)
+        model.calving_m3_since_y0 = 0.
+    log.info('(%s) running with %s time stepping scheme.', gdir.rgi_id,
+             steps[0])
+    interval = cfg.PARAMS['run_checkpoint_interval']
+    model.run_until_and_store(ye, run_path=run_path,
+                              diag_path=diag_path,
+                              store_monthly_step=store_monthly_step,
+                              fallback_steps=steps[1:],
+                              checkpoint_interval=interval,
+                              stream_output=cfg.PARAMS['stream_model_output'])
     return model
 
 
+def _random_climate_mb(gdir, y0=None, halfsize=15, bias=None, seed=None,
+                       temperature_bias=None,
+                       climate_filename='climate_monthly',
+                       climate_input_filesuffix='', unique_samples=False):
+    """The mass-balance model used by run_random_climate."""
+
+    mb = MultipleFlowlineMassBalance(gdir, mb_model_class=RandomMassBalance,
+                                     y0=y0, halfsize=halfsize,
+                                     bias=bias, seed=seed,
+                                     filename=climate_filename,
+                                     input_filesuffix=climate_input_filesuffix,
+                                     unique_samples=unique_samples)
+
+    if temperature_bias is not None:
+        mb.temp_bias = temperature_bias
+    return mb
+
+
+def _past_climate_mb(gdir, climate_filename='climate_monthly',
+                     climate_input_filesuffix=''):
+    """The mass-balance model used by run_from_climate_data."""
+    return MultipleFlowlineMassBalance(
+        gdir, mb_model_class=PastMassBalance, filename=climate_filename,
+        input_filesuffix=climate_input_filesuffix)
+
+
+def _fls_from_previous_run(gdir, filesuffix, init_model_yr=None):
+    """The flowlines of a previous model run at the year init_model_yr."""
+
+    fp = gdir.get_filepath('model_run', filesuffix=filesuffix)
+    with FileModel(fp) as fmod:
+        if init_model_yr is None:
+            init_model_yr = fmod.last_yr
+        fmod.run_until(init_model_yr)
+        return fmod.fls
+
+
 @entity_task(log)
 def run_random_climate(gdir, nyears=1000, y0=None, halfsize=15,
                        bias=None, seed=None, temperature_bias=None,
@@ -1657,15 +3957,11 @@ def run_random_climate(gdir, nyears=1000, y0=None, halfsize=15,
         kwargs to pass to the FluxBasedModel instance
     """
 
-    mb = MultipleFlowlineMassBalance(gdir, mb_model_class=RandomMassBalance,
-                                     y0=y0, halfsize=halfsize,
-                                     bias=bias, seed=seed,
-                                     filename=climate_filename,
-                                     input_filesuffix=climate_input_filesuffix,
-                                     unique_samples=unique_samples)
-
-    if temperature_bias is not None:
-        mb.temp_bias = temperature_bias
+    mb = _random_climate_mb(gdir, y0=y0, halfsize=halfsize, bias=bias,
+                            seed=seed, temperature_bias=temperature_bias,
+                            climate_filename=climate_filename,
+                            climate_input_filesuffix=climate_input_filesuffix,
+                            unique_samples=unique_samples)
 
     return robust_model_run(gdir, output_filesuffix=output_filesuffix,
                             mb_model=mb, ys=0, ye=nyears,
@@ -1675,6 +3971,101 @@ def run_random_climate(gdir, nyears=1000, y0=None, halfsize=15,
                             **kwargs)
 
 
+@entity_task(log)
+def run_random_climate_ensemble(gdir, nyears=1000, y0=None, halfsize=15,
+                                bias=None, seeds=None,
+                                temperature_biases=None,
+                                store_monthly_step=False,
+                                climate_filename='climate_monthly',
+                                climate_input_filesuffix='',
+                                output_filesuffix='', init_model_fls=None,
+                                zero_initial_glacier=False,
+                                unique_samples=False,
+                                **kwargs):
+    """Runs an ensemble of random mass-balance runs for one glacier.
+
+    Same as :py:func:`run_random_climate`, but for several members with
+    different random seeds and/or temperature biases. All members are
+    advanced together by an :py:class:`EnsembleFluxBasedModel`, which is
+    much faster than running them one after another.
+
+    The diagnostics of all members are written to the ``model_diagnostics``
+    file, along a ``member`` dimension (NaN for the members which failed).
+    No ``model_run`` file is written.
+
+    Only the explicit time stepping schemes without subcycling are
+    available, and the members which fail are not run again with a more
+    conservative scheme (see :py:func:`robust_model_run`): use
+    :py:func:`run_random_climate` if you need these.
+
+    Parameters
+    ----------
+    seeds : list of int
+        the seed for the random generator of each member
+    temperature_biases : list of float
+        the temperature bias of each member (must be of the same length as
+        ``seeds`` if both are given)
+
+    See :py:func:`run_random_climate` for the other parameters.
+
+    Returns
+    -------
+    the EnsembleFluxBasedModel instance
+    """
+
+    if seeds is None and temperature_biases is None:
+        raise ValueError('Need seeds or temperature_biases.')
+    if seeds is None:
+        seeds = [None] * len(temperature_biases)
+    if temperature_biases is None:
+        temperature_biases = [None] * len(seeds)
+    if len(seeds) != len(temperature_biases):
+        raise ValueError('seeds and temperature_biases should have the '
+                         'same length.')
+    time_stepping = kwargs.get('time_stepping', 'default')
+    if time_stepping in ['implicit', 'adaptive']:
+        raise InvalidParamsError('run_random_climate_ensemble does not '
+                                 'support the {} time stepping.'
+                                 .format(time_stepping))
+    if kwargs.get('subcycling', False):
+        raise InvalidParamsError('run_random_climate_ensemble does not '
+                                 'support subcycling.')
+
+    kwargs.setdefault('fs', cfg.PARAMS['fs'])
+    kwargs.setdefault('glen_a', cfg.PARAMS['glen_a'])
+
+    if init_model_fls is None:
+        fls = gdir.read_pickle('model_flowlines')
+    else:
+        fls = _share_geometry(init_model_fls)
+    if zero_initial_glacier:
+        for fl in fls:
+            fl.thick = fl.thick * 0.
+    model = FluxBasedModel(fls, y0=0, inplace=True,
+                           is_tidewater=gdir.is_tidewater, **kwargs)
+
+    mbs = []
+    for seed, temperature_bias in zip(seeds, temperature_biases):
+        mbs.append(_random_climate_mb(
+            gdir, y0=y0, halfsize=halfsize, bias=bias, seed=seed,
+            temperature_bias=temperature_bias,
+            climate_filename=climate_filename,
+            climate_input_filesuffix=climate_input_filesuffix,
+            unique_samples=unique_samples))
+
+    ens = EnsembleFluxBasedModel(model, mbs)
+    diag_path = gdir.get_filepath('model_diagnostics',
+                                  filesuffix=output_filesuffix,
+                                  delete=True)
+    ens.run_until_and_store(nyears, diag_path=diag_path,
+                            store_monthly_step=store_monthly_step)
+    for i, err in enumerate(ens.errors):
+        if err is not None:
+            log.warning('(%s) ensemble member %d failed: %s', gdir.rgi_id,
+                        i, err)
+    return ens
+
+
 @entity_task(log)
 def run_constant_climate(gdir, nyears=1000, y0=None, halfsize=15,
                          bias=None, temperature_bias=None,
@@ -1684,6 +4075,7 @@ def run_constant_climate(gdir, nyears=1000, y0=None, halfsize=15,
                          climate_input_filesuffix='',
                          init_model_fls=None,
                          zero_initial_glacier=False,
+                         steady_state=False,
                          **kwargs):
     """Runs the constant mass-balance model for a given number of years.
 
@@ -1719,6 +4111,11 @@ def run_constant_climate(gdir, nyears=1000, y0=None, halfsize=15,
     init_model_fls : []
         list of flowlines to use to initialise the model (the default is the
         present_time_glacier file from the glacier directory)
+    steady_state : bool
+        if true, the equilibrium glacier is computed directly with the
+        steady state solver (see
+        :py:meth:`FluxBasedModel.solve_steady_state`) and the run starts
+        from there. Use nyears=0 to store the equilibrium glacier only
     kwargs : dict
         kwargs to pass to the FluxBasedModel instance
     """
@@ -1736,6 +4133,7 @@ def run_constant_climate(gdir, nyears=1000, y0=None, halfsize=15,
                             store_monthly_step=store_monthly_step,
                             init_model_fls=init_model_fls,
                             zero_initial_glacier=zero_initial_glacier,
+                            steady_state=steady_state,
                             **kwargs)
 
 
@@ -1787,16 +4185,11 @@ def run_from_climate_data(gdir, ys=None, ye=None,
         ye = cfg.PARAMS['ye']
 
     if init_model_filesuffix is not None:
-        fp = gdir.get_filepath('model_run', filesuffix=init_model_filesuffix)
-        with FileModel(fp) as fmod:
-            if init_model_yr is None:
-                init_model_yr = fmod.last_yr
-            fmod.run_until(init_model_yr)
-            init_model_fls = fmod.fls
-
-    mb = MultipleFlowlineMassBalance(gdir, mb_model_class=PastMassBalance,
-                                     filename=climate_filename,
-                                     input_filesuffix=climate_input_filesuffix)
+        init_model_fls = _fls_from_previous_run(gdir, init_model_filesuffix,
+                                                init_model_yr=init_model_yr)
+
+    mb = _past_climate_mb(gdir, climate_filename=climate_filename,
+                          climate_input_filesuffix=climate_input_filesuffix)
 
     return robust_model_run(gdir, output_filesuffix=output_filesuffix,
                             mb_model=mb, ys=ys, ye=ye,
@@ -1804,3 +4197,214 @@ def run_from_climate_data(gdir, ys=None, ye=None,
                             init_model_fls=init_model_fls,
                             zero_initial_glacier=zero_initial_glacier,
                             **kwargs)
+
+
+def _batch_chunk_run(gdirs, task=None, mb_func=None, mb_kwargs=None,
+                     start=None, ye=None, output_filesuffix='',
+                     store_monthly_step=False, zero_initial_glacier=False,
+                     task_kwargs=None, **kwargs):
+    """Runs one chunk of glaciers with a BatchFluxBasedModel.
+
+    Glaciers which fail in the batch are run again with the regular
+    (entity) task, which has its own retry strategy.
+    """
+
+    kwargs.setdefault('fs', cfg.PARAMS['fs'])
+    kwargs.setdefault('glen_a', cfg.PARAMS['glen_a'])
+    task_name = task.__name__ + output_filesuffix
+
+    models = []
+    run_paths = []
+    diag_paths = []
+    todo = []
+    fallback = []
+    for gdir in gdirs:
+        try:
+            mb = mb_func(gdir, **mb_kwargs)
+            ys, fls = start(gdir)
+            if zero_initial_glacier:
+                for fl in fls:
+                    fl.thick = fl.thick * 0.
+            model = FluxBasedModel(fls, mb_model=mb, y0=ys,
+                                   inplace=True,
+                                   is_tidewater=gdir.is_tidewater,
+                                   **kwargs)
+        except Exception:
+            # The task will deal with this (and log the error)
+            fallback.append(gdir)
+            continue
+        if model.implicit:
+            # The batch model only knows the explicit scheme
+            fallback.append(gdir)
+            continue
+        models.append(model)
+        todo.append(gdir)
+        run_path = gdir.get_filepath('model_run',
+                                     filesuffix=output_filesuffix,
+                                     delete=True)
+        if not cfg.PARAMS['store_model_geometry']:
+            run_path = None
+        run_paths.append(run_path)
+        diag_paths.append(gdir.get_filepath('model_diagnostics',
+                                            filesuffix=output_filesuffix,
+                                            delete=True))
+
+    out = {}
+    if models:
+        batch = BatchFluxBasedModel(models)
+        stream = cfg.PARAMS['stream_model_output']
+        res = batch.run_until_and_store(ye, run_paths=run_paths,
+                                        diag_paths=diag_paths,
+                                        store_monthly_step=store_monthly_step,
+                                        stream_output=stream)
+        for gdir, model, r in zip(todo, models, res):
+            if r is None:
+                fallback.append(gdir)
+                continue
+            log.info('(%s) %s ran in batch mode.', gdir.rgi_id, task_name)
+            gdir.log(task_name)
+            out[gdir.rgi_id] = model
+
+    for gdir in fallback:
+        out[gdir.rgi_id] = task(gdir, reset=True,
+                                output_filesuffix=output_filesuffix,
+                                store_monthly_step=store_monthly_step,
+                                zero_initial_glacier=zero_initial_glacier,
+                                **task_kwargs, **kwargs)
+    return [out[gdir.rgi_id] for gdir in gdirs]
+
+
+def _batch_model_run(gdirs, batch_size=None, **kwargs):
+    """Split the glaciers in chunks and run them with _batch_chunk_run."""
+
+    if batch_size is None:
+        batch_size = cfg.PARAMS['batch_size']
+    gdirs = list(gdirs)
+    chunks = [gdirs[i:i+batch_size]
+              for i in range(0, len(gdirs), batch_size)]
+    func = partial(_batch_chunk_run, **kwargs)
+    if cfg.PARAMS['use_multiprocessing'] and len(chunks) > 1:
+        from oggm.workflow import init_mp_pool
+        mppool = init_mp_pool(cfg.CONFIG_MODIFIED)
+        out = mppool.map(func, chunks, chunksize=1)
+    else:
+        out = [func(chunk) for chunk in chunks]
+    return [model for chunk in out for model in chunk]
+
+
+class _StartFromFile(object):
+    """Picklable helper returning the initial year and flowlines."""
+
+    def __init__(self, ys, init_model_filesuffix=None, init_model_yr=None):
+        self.ys = ys
+        self.init_model_filesuffix = init_model_filesuffix
+        self.init_model_yr = init_model_yr
+
+    def __call__(self, gdir):
+        if self.init_model_filesuffix is not None:
+            fls = _fls_from_previous_run(gdir, self.init_model_filesuffix,
+                                         init_model_yr=self.init_model_yr)
+        else:
+            fls = gdir.read_pickle('model_flowlines')
+        return self.ys, fls
+
+
+@global_task
+def run_random_climate_batch(gdirs, nyears=1000, y0=None, halfsize=15,
+                             bias=None, seed=None, temperature_bias=None,
+                             store_monthly_step=False,
+                             climate_filename='climate_monthly',
+                             climate_input_filesuffix='',
+                             output_filesuffix='',
+                             zero_initial_glacier=False,
+                             unique_samples=False, batch_size=None,
+                             **kwargs):
+    """Same as :py:func:`run_random_climate`, but many glaciers at once.
+
+    The glaciers are split in chunks of ``batch_size`` glaciers which are
+    advanced together by a :py:class:`BatchFluxBasedModel` (chunks are
+    dispatched to the multiprocessing pool if asked for). Glaciers failing
+    in the batch are run again with :py:func:`run_random_climate`.
+
+    Parameters
+    ----------
+    gdirs : list of :py:class:`oggm.GlacierDirectory` objects
+        the glacier directories to process
+    batch_size : int
+        the number of glaciers per chunk (default: cfg.PARAMS['batch_size'])
+
+    See :py:func:`run_random_climate` for the other parameters.
+
+    Returns
+    -------
+    the list of (per glacier) model instances
+    """
+
+    mb_kwargs = dict(y0=y0, halfsize=halfsize, bias=bias, seed=seed,
+                     temperature_bias=temperature_bias,
+                     climate_filename=climate_filename,
+                     climate_input_filesuffix=climate_input_filesuffix,
+                     unique_samples=unique_samples)
+    task_kwargs = dict(nyears=nyears, **mb_kwargs)
+    return _batch_model_run(gdirs, batch_size=batch_size,
+                            task=run_random_climate,
+                            mb_func=_random_climate_mb, mb_kwargs=mb_kwargs,
+                            start=_StartFromFile(0), ye=nyears,
+                            output_filesuffix=output_filesuffix,
+                            store_monthly_step=store_monthly_step,
+                            zero_initial_glacier=zero_initial_glacier,
+                            task_kwargs=task_kwargs, **kwargs)
+
+
+@global_task
+def run_from_climate_data_batch(gdirs, ys=None, ye=None,
+                                store_monthly_step=False,
+                                climate_filename='climate_monthly',
+                                climate_input_filesuffix='',
+                                output_filesuffix='',
+                                init_model_filesuffix=None,
+                                init_model_yr=None,
+                                zero_initial_glacier=False,
+                                batch_size=None,
+                                **kwargs):
+    """Same as :py:func:`run_from_climate_data`, but many glaciers at once.
+
+    The glaciers are split in chunks of ``batch_size`` glaciers which are
+    advanced together by a :py:class:`BatchFluxBasedModel` (chunks are
+    dispatched to the multiprocessing pool if asked for). Glaciers failing
+    in the batch are run again with :py:func:`run_from_climate_data`.
+
+    Parameters
+    ----------
+    gdirs : list of :py:class:`oggm.GlacierDirectory` objects
+        the glacier directories to process
+    batch_size : int
+        the number of glaciers per chunk (default: cfg.PARAMS['batch_size'])
+
+    See :py:func:`run_from_climate_data` for the other parameters.
+
+    Returns
+    -------
+    the list of (per glacier) model instances
+    """
+
+    if ys is None:
+        ys = cfg.PARAMS['ys']
+    if ye is None:
+        ye = cfg.PARAMS['ye']
+
+    mb_kwargs = dict(climate_filename=climate_filename,
+                     climate_input_filesuffix=climate_input_filesuffix)
+    task_kwargs = dict(ys=ys, ye=ye,
+                       init_model_filesuffix=init_model_filesuffix,
+                       init_model_yr=init_model_yr, **mb_kwargs)
+    start = _StartFromFile(ys, init_model_filesuffix=init_model_filesuffix,
+                           init_model_yr=init_model_yr)
+    return _batch_model_run(gdirs, batch_size=batch_size,
+                            task=run_from_climate_data,
+                            mb_func=_past_climate_mb, mb_kwargs=mb_kwargs,
+                            start=start, ye=ye,
+                            output_filesuffix=output_filesuffix,
+                            store_monthly_step=store_monthly_step,
+                            zero_initial_glacier=zero_initial_glacier,
+                            task_kwargs=task_kwargs, **kwargs)
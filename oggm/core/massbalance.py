@@ -1,14 +1,14 @@
 """Mass-balance models"""
 # Built ins
+import warnings
+from functools import partial
 # External libs
 import numpy as np
 import netCDF4
-from scipy.interpolate import interp1d
-from scipy import optimize as optimization
 # Locals
 import oggm.cfg as cfg
 from oggm.cfg import SEC_IN_YEAR, SEC_IN_MONTH
-from oggm.utils import (SuperclassMeta, lazy_property, floatyear_to_date,
+from oggm.utils import (SuperclassMeta, floatyear_to_date,
                         date_to_floatyear, monthly_timeseries, ncDataset,
                         tolist)
 
@@ -81,6 +81,38 @@ class MassBalanceModel(object, metaclass=SuperclassMeta):
         """
         raise NotImplementedError()
 
+    def get_annual_mb_series(self, heights, years, fl_id=None):
+        """Like `self.get_annual_mb()`, but for several years at once.
+
+        The default implementation loops over the years: models which can
+        do better should override it.
+
+        Units: [m s-1], or meters of ice per second
+
+        Parameters
+        ----------
+        heights: ndarray
+            the atitudes at which the mass-balance will be computed: the
+            same for all years (1D) or one row per year (2D)
+        years: ndarray
+            the years (in the "hydrological floating year" convention)
+        fl_id: float, optional
+            the index of the flowline in the fls array (might be ignored
+            by some MB models)
+
+        Returns
+        -------
+        the mass-balance (shape: (len(years), number of heights),
+        units: [m s-1])
+        """
+        heights = np.asarray(heights)
+        if heights.ndim == 1:
+            return np.stack([self.get_annual_mb(heights, year=yr,
+                                                fl_id=fl_id)
+                             for yr in years])
+        return np.stack([self.get_annual_mb(h, year=yr, fl_id=fl_id)
+                         for h, yr in zip(heights, years)])
+
     def get_specific_mb(self, heights=None, widths=None, fls=None,
                         year=None):
         """Specific mb for this year and a specific glacier geometry.
@@ -98,63 +130,99 @@ class MassBalanceModel(object, metaclass=SuperclassMeta):
         fls: list of flowline instances
             Another way to get heights and widths - overrides them if
             provided.
-        year: float, optional
+        year: float or array of floats, optional
             the time (in the "hydrological floating year" convention)
 
         Returns
         -------
-        the specific mass-balance (units: mm w.e. yr-1)
+        the specific mass-balance (units: mm w.e. yr-1). An array if
+        several years are given.
         """
 
-        if len(np.atleast_1d(year)) > 1:
-            out = [self.get_specific_mb(heights=heights, widths=widths,
-                                        fls=fls, year=yr)
-                   for yr in year]
-            return np.asarray(out)
+        # All years at once (see get_annual_mb_series)
+        several = len(np.atleast_1d(year)) > 1
 
         if fls is not None:
             mbs = []
             widths = []
             for i, fl in enumerate(fls):
-                widths = np.append(widths, fl.widths)
-                mbs = np.append(mbs, self.get_annual_mb(fl.surface_h,
-                                                        year=year, fl_id=i))
+                # Weighted by the area of the grid points
+                widths.append(fl.widths * fl.dx)
+                if several:
+                    mbs.append(self.get_annual_mb_series(fl.surface_h, year,
+                                                         fl_id=i))
+                else:
+                    mbs.append(self.get_annual_mb(fl.surface_h, year=year,
+                                                  fl_id=i))
+            mbs = np.concatenate(mbs, axis=-1)
+            widths = np.concatenate(widths)
+        elif several:
+            mbs = self.get_annual_mb_series(heights, year)
         else:
             mbs = self.get_annual_mb(heights, year=year)
 
-        return np.average(mbs, weights=widths) * SEC_IN_YEAR * self.rho
+        return (np.average(mbs, weights=widths, axis=-1) * SEC_IN_YEAR *
+                self.rho)
 
     def get_ela(self, year=None):
         """Compute the equilibrium line altitude for this year
 
         Parameters
         ----------
-        year: float, optional
+        year: float or array of floats, optional
             the time (in the "hydrological floating year" convention)
 
         Returns
         -------
-        the equilibrium line altitude (ELA, units: m)
+        the equilibrium line altitude (ELA, units: m), NaN if there is no
+        ELA within ``valid_bounds``. An array if several years are given.
         """
 
-        if len(np.atleast_1d(year)) > 1:
-            return np.asarray([self.get_ela(year=yr) for yr in year])
-
         if self.valid_bounds is None:
             raise ValueError('attribute `valid_bounds` needs to be '
                              'set for the ELA computation.')
 
-        # Check for invalid ELAs
-        b0, b1 = self.valid_bounds
-        if (np.any(~np.isfinite(self.get_annual_mb([b0, b1], year=year))) or
-                (self.get_annual_mb([b0], year=year)[0] > 0) or
-                (self.get_annual_mb([b1], year=year)[0] < 0)):
-            return np.NaN
-
-        def to_minimize(x):
-            o = self.get_annual_mb([x], year=year)[0] * SEC_IN_YEAR * self.rho
-            return o
-        return optimization.brentq(to_minimize, *self.valid_bounds, xtol=0.1)
+        # All years are solved together: the ELA is bracketed on a height
+        # grid (the same for all years), the bracket is refined with the
+        # same grid until it is smaller than xtol, and we finish with a
+        # linear interpolation. This needs a few calls to
+        # get_annual_mb_series (one row of heights per year) only.
+        xtol = 0.1
+        grid = np.linspace(0, 1, 51)
+        years = np.atleast_1d(year)
+        ny = len(years)
+        lo = np.full(ny, self.valid_bounds[0], dtype=np.float64)
+        hi = np.full(ny, self.valid_bounds[1], dtype=np.float64)
+        mb_lo = np.zeros(ny)
+        mb_hi = np.zeros(ny)
+        valid = np.ones(ny, dtype=bool)
+        todo = np.ones(ny, dtype=bool)
+        first = True
+        while np.any(todo):
+            idx = np.nonzero(todo)[0]
+            heights = lo[idx, np.newaxis] + (hi - lo)[idx, np.newaxis] * grid
+            mbs = self.get_annual_mb_series(heights, years[idx])
+            if first:
+                # Check for invalid ELAs
+                ok = (np.all(np.isfinite(mbs), axis=1) &
+                      (mbs[:, 0] <= 0) & (mbs[:, -1] >= 0))
+                valid[idx[~ok]] = False
+                todo[idx[~ok]] = False
+                idx, heights, mbs = idx[ok], heights[ok], mbs[ok]
+                first = False
+            # Bracket: last point with a negative MB and the next one
+            i = np.clip(np.argmax(mbs >= 0, axis=1), 1, len(grid) - 1)
+            r = np.arange(len(idx))
+            lo[idx], hi[idx] = heights[r, i-1], heights[r, i]
+            mb_lo[idx], mb_hi[idx] = mbs[r, i-1], mbs[r, i]
+            todo[idx[(hi[idx] - lo[idx]) < xtol]] = False
+
+        dmb = mb_hi - mb_lo
+        frac = np.where(dmb > 0, -mb_lo / np.where(dmb > 0, dmb, 1), 0)
+        out = np.where(valid, lo + (hi - lo) * frac, np.NaN)
+        if np.ndim(year) == 0:
+            return out[0]
+        return out
 
 
 class LinearMassBalance(MassBalanceModel):
@@ -208,13 +276,118 @@ class LinearMassBalance(MassBalanceModel):
     def get_annual_mb(self, heights, year=None, fl_id=None):
         return self.get_monthly_mb(heights, year=year)
 
+    def get_annual_mb_series(self, heights, years, fl_id=None):
+        # No time component
+        mb = self.get_annual_mb(heights)
+        return np.broadcast_to(mb, (len(years), mb.shape[-1])).copy()
+
+
+def _height_bins(gdir, climate_store, dh):
+    """Height grid covering the glacier and its possible growth."""
+    try:
+        fls = climate_store.read_pickle('model_flowlines')
+        h = []
+        for fl in fls:
+            # We use bed because of overdeepenings
+            h = np.append(h, fl.bed_h)
+            h = np.append(h, fl.surface_h)
+        zminmax = np.round([np.min(h)-50, np.max(h)+2000])
+    except FileNotFoundError:
+        # in case we don't have them
+        with ncDataset(gdir.get_filepath('gridded_data')) as nc:
+            zminmax = [nc.min_h_dem-250, nc.max_h_dem+1500]
+    return np.arange(*zminmax, step=dh)
+
+
+def _uniform_bins(hbins, heights):
+    """Bin index and interpolation weight of heights on a uniform grid."""
+    x = (np.asarray(heights, dtype=np.float64) -
+         hbins[0]) / (hbins[1] - hbins[0])
+    i = np.clip(x.astype(np.int64), 0, len(hbins) - 2)
+    return i, x - i
+
+
+class _ClimateStore(object):
+    """The climate time series of a glacier, read only once.
+
+    It is shared by the mass-balance models of the flowlines (see
+    :py:class:`MultipleFlowlineMassBalance`), which only differ in their
+    mu*. The arrays must not be modified. The glacier directory files read
+    by the models (calibration results...) are read only once as well.
+    """
+
+    def __init__(self, gdir, filename='climate_monthly', input_filesuffix=''):
+        """Read the climate file.
+
+        Parameters
+        ----------
+        gdir : GlacierDirectory
+            the glacier directory
+        filename : str, optional
+            set to a different BASENAME if you want to use alternative climate
+            data.
+        input_filesuffix : str
+            the file suffix of the input climate file
+        """
+
+        self.gdir = gdir
+        self._files = dict()
+
+        prcp_fac = cfg.PARAMS['prcp_scaling_factor']
+        default_grad = cfg.PARAMS['temp_default_gradient']
+
+        # Read file
+        fpath = gdir.get_filepath(filename, filesuffix=input_filesuffix)
+        with ncDataset(fpath, mode='r') as nc:
+            # time
+            time = nc.variables['time']
+            time = netCDF4.num2date(time[:], time.units)
+            ny, r = divmod(len(time), 12)
+            if r != 0:
+                raise ValueError('Climate data should be N full years')
+            # This is where we switch to hydro float year format
+            # Last year gives the tone of the hydro year
+            self.years = np.repeat(np.arange(time[-1].year-ny+1,
+                                             time[-1].year+1), 12)
+            self.months = np.tile(np.arange(1, 13), ny)
+            # Read timeseries
+            self.temp = nc.variables['temp'][:]
+            self.prcp = nc.variables['prcp'][:] * prcp_fac
+            if 'gradient' in nc.variables:
+                grad = nc.variables['gradient'][:]
+                # Security for stuff that can happen with local gradients
+                g_minmax = cfg.PARAMS['temp_local_gradient_bounds']
+                grad = np.where(~np.isfinite(grad), default_grad, grad)
+                grad = np.clip(grad, g_minmax[0], g_minmax[1])
+            else:
+                grad = self.prcp * 0 + default_grad
+            self.grad = grad
+            self.ref_hgt = nc.ref_hgt
+
+        for arr in [self.years, self.months, self.temp, self.prcp,
+                    self.grad]:
+            arr.flags.writeable = False
+
+    def read_json(self, filename):
+        """Same as ``gdir.read_json``, but read only once."""
+        if filename not in self._files:
+            self._files[filename] = self.gdir.read_json(filename)
+        return self._files[filename]
+
+    def read_pickle(self, filename):
+        """Same as ``gdir.read_pickle``, but read only once."""
+        if filename not in self._files:
+            self._files[filename] = self.gdir.read_pickle(filename)
+        return self._files[filename]
+
 
 class PastMassBalance(MassBalanceModel):
     """Mass balance during the climate data period."""
 
     def __init__(self, gdir, mu_star=None, bias=None,
                  filename='climate_monthly', input_filesuffix='',
-                 repeat=False, ys=None, ye=None, check_calib_params=True):
+                 repeat=False, ys=None, ye=None, check_calib_params=True,
+                 climate_store=None, table_dh=None):
         """Initialize.
 
         Parameters
@@ -248,6 +421,17 @@ class PastMassBalance(MassBalanceModel):
             the parameters used during calibration and the ones you are
             using at run time. If they don't match, it will raise an error.
             Set to False to suppress this check.
+        climate_store : _ClimateStore, optional
+            the climate data of another model of the same glacier, to share
+            instead of reading them again (then ``filename`` and
+            ``input_filesuffix`` are ignored)
+        table_dh : float, optional
+            if > 0, the annual MB of all years is tabulated on a height grid
+            of this resolution (m) and interpolated linearly in between,
+            which is much faster for long runs. The table is computed at
+            the first call and again when mu*, bias, temp_bias or prcp_bias
+            change. Heights out of the grid and the monthly MB are computed
+            exactly. The default is cfg.PARAMS['past_mb_table_dh']
 
         Attributes
         ----------
@@ -260,8 +444,13 @@ class PastMassBalance(MassBalanceModel):
 
         super(PastMassBalance, self).__init__()
         self.valid_bounds = [-1e4, 2e4]  # in m
+        if climate_store is None:
+            climate_store = _ClimateStore(gdir, filename=filename,
+                                          input_filesuffix=input_filesuffix)
+        self.climate_store = climate_store
+
         if mu_star is None:
-            df = gdir.read_json('local_mustar')
+            df = climate_store.read_json('local_mustar')
             mu_star = df['mu_star_glacierwide']
             if check_calib_params:
                 if not df['mu_star_allsame']:
@@ -274,7 +463,7 @@ class PastMassBalance(MassBalanceModel):
 
         if bias is None:
             if cfg.PARAMS['use_bias_for_run']:
-                df = gdir.read_json('local_mustar')
+                df = climate_store.read_json('local_mustar')
                 bias = df['bias']
             else:
                 bias = 0.
@@ -286,12 +475,11 @@ class PastMassBalance(MassBalanceModel):
         self.t_solid = cfg.PARAMS['temp_all_solid']
         self.t_liq = cfg.PARAMS['temp_all_liq']
         self.t_melt = cfg.PARAMS['temp_melt']
-        prcp_fac = cfg.PARAMS['prcp_scaling_factor']
-        default_grad = cfg.PARAMS['temp_default_gradient']
 
         # Check the climate related params to the GlacierDir to make sure
         if check_calib_params:
-            mb_calib = gdir.read_pickle('climate_info')['mb_calib_params']
+            mb_calib = climate_store.read_pickle('climate_info')
+            mb_calib = mb_calib['mb_calib_params']
             for k, v in mb_calib.items():
                 if v != cfg.PARAMS[k]:
                     raise RuntimeError('You seem to use different mass-'
@@ -305,35 +493,39 @@ class PastMassBalance(MassBalanceModel):
         self.prcp_bias = 1.
         self.repeat = repeat
 
-        # Read file
-        fpath = gdir.get_filepath(filename, filesuffix=input_filesuffix)
-        with ncDataset(fpath, mode='r') as nc:
-            # time
-            time = nc.variables['time']
-            time = netCDF4.num2date(time[:], time.units)
-            ny, r = divmod(len(time), 12)
-            if r != 0:
-                raise ValueError('Climate data should be N full years')
-            # This is where we switch to hydro float year format
-            # Last year gives the tone of the hydro year
-            self.years = np.repeat(np.arange(time[-1].year-ny+1,
-                                             time[-1].year+1), 12)
-            self.months = np.tile(np.arange(1, 13), ny)
-            # Read timeseries
-            self.temp = nc.variables['temp'][:]
-            self.prcp = nc.variables['prcp'][:] * prcp_fac
-            if 'gradient' in nc.variables:
-                grad = nc.variables['gradient'][:]
-                # Security for stuff that can happen with local gradients
-                g_minmax = cfg.PARAMS['temp_local_gradient_bounds']
-                grad = np.where(~np.isfinite(grad), default_grad, grad)
-                grad = np.clip(grad, g_minmax[0], g_minmax[1])
-            else:
-                grad = self.prcp * 0 + default_grad
-            self.grad = grad
-            self.ref_hgt = nc.ref_hgt
-            self.ys = self.years[0] if ys is None else ys
-            self.ye = self.years[-1] if ye is None else ye
+        # Climate time series (shared with the other models)
+        self.years = climate_store.years
+        self.months = climate_store.months
+        self.temp = climate_store.temp
+        self.prcp = climate_store.prcp
+        self.grad = climate_store.grad
+        self.ref_hgt = climate_store.ref_hgt
+        self.ys = self.years[0] if ys is None else ys
+        self.ye = self.years[-1] if ye is None else ye
+
+        # Tabulated annual MB
+        if table_dh is None:
+            table_dh = cfg.PARAMS['past_mb_table_dh']
+        self.table_dh = table_dh
+        self.hbins = None
+        if table_dh > 0:
+            self.hbins = _height_bins(gdir, climate_store, table_dh)
+        self._table = None
+        self._table_key = None
+
+    def _year_offset(self, year):
+        """Position of the first month of the year(s) in the time series.
+
+        The years of the climate file are consecutive and complete: no
+        need to search for them.
+        """
+        offset = (np.asarray(year, dtype=np.int64) - self.years[0]) * 12
+        missing = (offset < 0) | (offset >= len(self.years))
+        if np.any(missing):
+            raise ValueError('Year {} not in record'
+                             .format(int(np.atleast_1d(year)[
+                                 np.atleast_1d(missing)][0])))
+        return offset
 
     def get_monthly_climate(self, heights, year=None):
         """Monthly climate information at given heights.
@@ -352,7 +544,7 @@ class PastMassBalance(MassBalanceModel):
         if y < self.ys or y > self.ye:
             raise ValueError('year {} out of the valid time bounds: '
                              '[{}, {}]'.format(y, self.ys, self.ye))
-        pok = np.where((self.years == y) & (self.months == m))[0][0]
+        pok = self._year_offset(y) + m - 1
 
         # Read timeseries
         itemp = self.temp[pok] + self.temp_bias
@@ -373,36 +565,37 @@ class PastMassBalance(MassBalanceModel):
 
         return temp, tempformelt, prcp, prcpsol
 
-    def _get_2d_annual_climate(self, heights, year):
-        # Avoid code duplication with a getter routine
-        year = np.floor(year)
+    def _valid_years(self, years):
+        """Hydrological year(s) to read, after repeat and bounds check."""
+        years = np.floor(np.asarray(years, dtype=np.float64))
         if self.repeat:
-            year = self.ys + (year - self.ys) % (self.ye - self.ys + 1)
-        if year < self.ys or year > self.ye:
+            years = self.ys + (years - self.ys) % (self.ye - self.ys + 1)
+        out = (years < self.ys) | (years > self.ye)
+        if np.any(out):
             raise ValueError('year {} out of the valid time bounds: '
-                             '[{}, {}]'.format(year, self.ys, self.ye))
-        pok = np.where(self.years == year)[0]
-        if len(pok) < 1:
-            raise ValueError('Year {} not in record'.format(int(year)))
+                             '[{}, {}]'.format(np.atleast_1d(years)[
+                                 np.atleast_1d(out)][0], self.ys, self.ye))
+        return years
+
+    def _get_2d_annual_climate(self, heights, year):
+        # Avoid code duplication with a getter routine
+        pok = self._year_offset(self._valid_years(year))
+        pok = slice(pok, pok + 12)
 
         # Read timeseries
         itemp = self.temp[pok] + self.temp_bias
         iprcp = self.prcp[pok] * self.prcp_bias
         igrad = self.grad[pok]
 
-        # For each height pixel:
+        # For each height pixel (shape (heights, months)):
         # Compute temp and tempformelt (temperature above melting threshold)
-        heights = np.asarray(heights)
-        npix = len(heights)
-        grad_temp = np.atleast_2d(igrad).repeat(npix, 0)
-        grad_temp *= (heights.repeat(12).reshape(grad_temp.shape) -
-                      self.ref_hgt)
-        temp2d = np.atleast_2d(itemp).repeat(npix, 0) + grad_temp
+        heights = np.asarray(heights)[:, np.newaxis]
+        temp2d = itemp + igrad * (heights - self.ref_hgt)
         temp2dformelt = temp2d - self.t_melt
         temp2dformelt[:] = np.clip(temp2dformelt, 0, temp2dformelt.max())
 
         # Compute solid precipitation from total precipitation
-        prcp = np.atleast_2d(iprcp).repeat(npix, 0)
+        prcp = np.broadcast_to(iprcp, temp2d.shape)
         fac = 1 - (temp2d - self.t_solid) / (self.t_liq - self.t_solid)
         fac = np.clip(fac, 0, 1)
         prcpsol = prcp * fac
@@ -432,11 +625,93 @@ class PastMassBalance(MassBalanceModel):
 
     def get_annual_mb(self, heights, year=None, fl_id=None):
 
+        if self._use_table(heights):
+            iyr = self._year_offset(self._valid_years(year)) // 12
+            return self._interp_table(heights, iyr)
+
         _, temp2dformelt, _, prcpsol = self._get_2d_annual_climate(heights,
                                                                    year)
         mb_annual = np.sum(prcpsol - self.mu_star * temp2dformelt, axis=1)
         return (mb_annual - self.bias) / SEC_IN_YEAR / self.rho
 
+    def get_annual_mb_series(self, heights, years, fl_id=None):
+
+        # Same as get_annual_mb, but with the years as first dimension
+        pok = self._year_offset(self._valid_years(years))
+        if self._use_table(heights):
+            return self._interp_table(heights, pok[:, np.newaxis] // 12)
+        pok = pok[:, np.newaxis] + np.arange(12)
+        return self._annual_mb_from_offsets(heights, pok)
+
+    def _annual_mb_from_offsets(self, heights, pok):
+        """Annual MB for the months ``pok`` (shape (years, 12))."""
+
+        # Read timeseries
+        itemp = self.temp[pok] + self.temp_bias
+        iprcp = self.prcp[pok] * self.prcp_bias
+        igrad = self.grad[pok]
+
+        # Shape (years, heights, months). The heights can be different
+        # for each year
+        heights = np.asarray(heights)[..., np.newaxis]
+        temp3d = (itemp[:, np.newaxis, :] +
+                  igrad[:, np.newaxis, :] * (heights - self.ref_hgt))
+        temp3dformelt = temp3d - self.t_melt
+        # Clipped like in get_annual_mb (upper bound: max of each year)
+        temp3dformelt[:] = np.minimum(np.maximum(temp3dformelt, 0),
+                                      temp3dformelt.max(axis=(1, 2),
+                                                        keepdims=True))
+        fac = 1 - (temp3d - self.t_solid) / (self.t_liq - self.t_solid)
+        prcpsol = iprcp[:, np.newaxis, :] * np.clip(fac, 0, 1)
+
+        mb_annual = np.sum(prcpsol - self.mu_star * temp3dformelt, axis=2)
+        return (mb_annual - self.bias) / SEC_IN_YEAR / self.rho
+
+    def _monthly_mb_from_offsets(self, heights, pok):
+        """Monthly MB for the months ``pok`` (any shape), at the heights
+        (last dimension of the output).
+        """
+
+        # Read timeseries
+        itemp = self.temp[pok][..., np.newaxis] + self.temp_bias
+        iprcp = self.prcp[pok][..., np.newaxis] * self.prcp_bias
+        igrad = self.grad[pok][..., np.newaxis]
+
+        temp = itemp + igrad * (np.asarray(heights) - self.ref_hgt)
+        tempformelt = temp - self.t_melt
+        # Clipped like in get_monthly_climate (upper bound: max of each
+        # month)
+        tempformelt[:] = np.clip(tempformelt, 0,
+                                 tempformelt.max(axis=-1, keepdims=True))
+        fac = 1 - (temp - self.t_solid) / (self.t_liq - self.t_solid)
+        prcpsol = iprcp * np.clip(fac, 0, 1)
+
+        mb_month = prcpsol - self.mu_star * tempformelt
+        mb_month -= self.bias * SEC_IN_MONTH / SEC_IN_YEAR
+        return mb_month / SEC_IN_MONTH / self.rho
+
+    def _use_table(self, heights):
+        """Whether the heights can be looked up in the MB table."""
+        if self.hbins is None:
+            return False
+        heights = np.asarray(heights)
+        return (heights.size > 0 and heights.min() >= self.hbins[0] and
+                heights.max() <= self.hbins[-1])
+
+    def _interp_table(self, heights, iyr):
+        """Linear interpolation of the annual MB table on the height grid."""
+        key = (self.mu_star, self.bias, self.temp_bias, self.prcp_bias)
+        if self._table_key != key:
+            # All years in one pass, shape (years, hbins)
+            pok = np.arange(0, len(self.years), 12)[:, np.newaxis]
+            pok = pok + np.arange(12)
+            self._table = self._annual_mb_from_offsets(self.hbins, pok)
+            self._table_key = key
+
+        i, w = _uniform_bins(self.hbins, heights)
+        return (self._table[iyr, i] * (1 - w) +
+                self._table[iyr, i + 1] * w)
+
 
 class ConstantMassBalance(MassBalanceModel):
     """Constant mass-balance during a chosen period.
@@ -444,9 +719,12 @@ class ConstantMassBalance(MassBalanceModel):
     This is useful for equilibrium experiments.
     """
 
+    # Number of MB tables kept in memory (e.g. for bias experiments)
+    max_stored_tables = 20
+
     def __init__(self, gdir, mu_star=None, bias=None,
                  y0=None, halfsize=15, filename='climate_monthly',
-                 input_filesuffix=''):
+                 input_filesuffix='', climate_store=None):
         """Initialize
 
         Parameters
@@ -469,35 +747,38 @@ class ConstantMassBalance(MassBalanceModel):
             data.
         input_filesuffix : str
             the file suffix of the input climate file
+        climate_store : _ClimateStore, optional
+            see :py:class:`PastMassBalance`
+
+        Notes
+        -----
+        The MB averaged over the period is tabulated on a uniform height
+        grid (``hbins``) and interpolated linearly. The tables are computed
+        at the first call and again for each new set of parameters (mu*,
+        biases and temperature thresholds). The last
+        ``max_stored_tables`` of them are kept, so that going back to
+        previous parameters is cheap.
         """
 
         super(ConstantMassBalance, self).__init__()
         self.mbmod = PastMassBalance(gdir, mu_star=mu_star, bias=bias,
                                      filename=filename,
-                                     input_filesuffix=input_filesuffix)
+                                     input_filesuffix=input_filesuffix,
+                                     climate_store=climate_store,
+                                     table_dh=0)
+        climate_store = self.mbmod.climate_store
 
         if y0 is None:
-            df = gdir.read_json('local_mustar')
+            df = climate_store.read_json('local_mustar')
             y0 = df['t_star']
 
         # This is a quick'n dirty optimisation
-        try:
-            fls = gdir.read_pickle('model_flowlines')
-            h = []
-            for fl in fls:
-                # We use bed because of overdeepenings
-                h = np.append(h, fl.bed_h)
-                h = np.append(h, fl.surface_h)
-            zminmax = np.round([np.min(h)-50, np.max(h)+2000])
-        except FileNotFoundError:
-            # in case we don't have them
-            with ncDataset(gdir.get_filepath('gridded_data')) as nc:
-                zminmax = [nc.min_h_dem-250, nc.max_h_dem+1500]
-        self.hbins = np.arange(*zminmax, step=10)
+        self.hbins = _height_bins(gdir, climate_store, 10)
         self.valid_bounds = self.hbins[[0, -1]]
         self.y0 = y0
         self.halfsize = halfsize
         self.years = np.arange(y0-halfsize, y0+halfsize+1)
+        self._tables = dict()
 
     @property
     def temp_bias(self):
@@ -507,9 +788,6 @@ class ConstantMassBalance(MassBalanceModel):
     @temp_bias.setter
     def temp_bias(self, value):
         """Temperature bias to add to the original series."""
-        for attr_name in ['_lazy_interp_yr', '_lazy_interp_m']:
-            if hasattr(self, attr_name):
-                delattr(self, attr_name)
         self.mbmod.temp_bias = value
 
     @property
@@ -520,9 +798,6 @@ class ConstantMassBalance(MassBalanceModel):
     @prcp_bias.setter
     def prcp_bias(self, value):
         """Precipitation factor to apply to the original series."""
-        for attr_name in ['_lazy_interp_yr', '_lazy_interp_m']:
-            if hasattr(self, attr_name):
-                delattr(self, attr_name)
         self.mbmod.prcp_bias = value
 
     @property
@@ -535,26 +810,50 @@ class ConstantMassBalance(MassBalanceModel):
         """Residual bias to apply to the original series."""
         self.mbmod.bias = value
 
-    @lazy_property
+    def _get_tables(self):
+        """Annual and monthly MB on ``hbins``, shapes (hbins,), (12, hbins).
+
+        The tables are computed again if the model parameters changed.
+        """
+        mbmod = self.mbmod
+        key = (mbmod.mu_star, mbmod.bias, mbmod.temp_bias, mbmod.prcp_bias,
+               mbmod.t_solid, mbmod.t_liq, mbmod.t_melt)
+        if key not in self._tables:
+            # All years and months in one pass, shape (years, 12, hbins)
+            pok = mbmod._year_offset(mbmod._valid_years(self.years))
+            pok = pok[:, np.newaxis] + np.arange(12)
+            mb_m = mbmod._monthly_mb_from_offsets(self.hbins, pok)
+            mb_m = mb_m.mean(axis=0)
+            mb_yr = mbmod._annual_mb_from_offsets(self.hbins, pok)
+            mb_yr = mb_yr.mean(axis=0)
+            # Keep only the most recent ones
+            while len(self._tables) >= self.max_stored_tables:
+                del self._tables[next(iter(self._tables))]
+            self._tables[key] = (mb_yr, mb_m)
+        return self._tables[key]
+
+    @property
     def interp_yr(self):
-        # annual MB
-        mb_on_h = self.hbins*0.
-        for yr in self.years:
-            mb_on_h += self.mbmod.get_annual_mb(self.hbins, year=yr)
-        return interp1d(self.hbins, mb_on_h / len(self.years))
+        """Deprecated: use get_annual_mb instead."""
+        warnings.warn('ConstantMassBalance.interp_yr is deprecated. Use '
+                      'get_annual_mb instead.', DeprecationWarning)
+        return self.get_annual_mb
 
-    @lazy_property
+    @property
     def interp_m(self):
-        # monthly MB
-        months = np.arange(12)+1
-        interp_m = []
-        for m in months:
-            mb_on_h = self.hbins*0.
-            for yr in self.years:
-                yr = date_to_floatyear(yr, m)
-                mb_on_h += self.mbmod.get_monthly_mb(self.hbins, year=yr)
-            interp_m.append(interp1d(self.hbins, mb_on_h / len(self.years)))
-        return interp_m
+        """Deprecated: use get_monthly_mb instead."""
+        warnings.warn('ConstantMassBalance.interp_m is deprecated. Use '
+                      'get_monthly_mb instead.', DeprecationWarning)
+        return [partial(self._get_monthly_mb_from_table, m)
+                for m in np.arange(12)+1]
+
+    def _interp_tables(self, heights):
+        """Bin index and weight of the heights on ``hbins``."""
+        heights = np.asarray(heights, dtype=np.float64)
+        if np.any(heights < self.hbins[0]) or np.any(heights > self.hbins[-1]):
+            raise ValueError('heights out of the interpolation range: '
+                             '[{}, {}]'.format(self.hbins[0], self.hbins[-1]))
+        return _uniform_bins(self.hbins, heights)
 
     def get_climate(self, heights, year=None):
         """Average climate information at given heights.
@@ -587,12 +886,23 @@ class ConstantMassBalance(MassBalanceModel):
                 np.mean(prcp, axis=0) * 12,
                 np.mean(prcpsol, axis=0) * 12)
 
+    def _get_monthly_mb_from_table(self, m, heights):
+        i, w = self._interp_tables(heights)
+        mb_m = self._get_tables()[1][m-1]
+        return mb_m[i] * (1 - w) + mb_m[i + 1] * w
+
     def get_monthly_mb(self, heights, year=None, fl_id=None):
         yr, m = floatyear_to_date(year)
-        return self.interp_m[m-1](heights)
+        return self._get_monthly_mb_from_table(m, heights)
 
     def get_annual_mb(self, heights, year=None, fl_id=None):
-        return self.interp_yr(heights)
+        i, w = self._interp_tables(heights)
+        mb_yr = self._get_tables()[0]
+        return mb_yr[i] * (1 - w) + mb_yr[i + 1] * w
+
+    def get_annual_mb_series(self, heights, years, fl_id=None):
+        mb = self.get_annual_mb(heights)
+        return np.broadcast_to(mb, (len(years), mb.shape[-1])).copy()
 
 
 class RandomMassBalance(MassBalanceModel):
@@ -609,7 +919,7 @@ class RandomMassBalance(MassBalanceModel):
     def __init__(self, gdir, mu_star=None, bias=None,
                  y0=None, halfsize=15, seed=None, filename='climate_monthly',
                  input_filesuffix='', all_years=False,
-                 unique_samples=False):
+                 unique_samples=False, climate_store=None):
         """Initialize.
 
         Parameters
@@ -644,20 +954,23 @@ class RandomMassBalance(MassBalanceModel):
             once per random climate period-length
             if false, every model year will be chosen from the random climate
             period with the same probability
+        climate_store : _ClimateStore, optional
+            see :py:class:`PastMassBalance`
         """
 
         super(RandomMassBalance, self).__init__()
         self.valid_bounds = [-1e4, 2e4]  # in m
         self.mbmod = PastMassBalance(gdir, mu_star=mu_star, bias=bias,
                                      filename=filename,
-                                     input_filesuffix=input_filesuffix)
+                                     input_filesuffix=input_filesuffix,
+                                     climate_store=climate_store)
 
         # Climate period
         if all_years:
             self.years = self.mbmod.years
         else:
             if y0 is None:
-                df = gdir.read_json('local_mustar')
+                df = self.mbmod.climate_store.read_json('local_mustar')
                 y0 = df['t_star']
             self.years = np.arange(y0-halfsize, y0+halfsize+1)
         self.yr_range = (self.years[0], self.years[-1]+1)
@@ -680,9 +993,6 @@ class RandomMassBalance(MassBalanceModel):
     @temp_bias.setter
     def temp_bias(self, value):
         """Temperature bias to add to the original series."""
-        for attr_name in ['_lazy_interp_yr', '_lazy_interp_m']:
-            if hasattr(self, attr_name):
-                delattr(self, attr_name)
         self.mbmod.temp_bias = value
 
     @property
@@ -693,9 +1003,6 @@ class RandomMassBalance(MassBalanceModel):
     @prcp_bias.setter
     def prcp_bias(self, value):
         """Precipitation factor to apply to the original series."""
-        for attr_name in ['_lazy_interp_yr', '_lazy_interp_m']:
-            if hasattr(self, attr_name):
-                delattr(self, attr_name)
         self.mbmod.prcp_bias = value
 
     @property
@@ -739,6 +1046,15 @@ class RandomMassBalance(MassBalanceModel):
         ryr = self.get_state_yr(int(year))
         return self.mbmod.get_annual_mb(heights, year=ryr)
 
+    def get_annual_mb_series(self, heights, years, fl_id=None):
+        ryrs = [self.get_state_yr(int(yr)) for yr in years]
+        if np.ndim(heights) > 1:
+            # One row of heights per year
+            return self.mbmod.get_annual_mb_series(heights, ryrs)
+        # Each of the climate years is computed only once
+        ryrs, idx = np.unique(ryrs, return_inverse=True)
+        return self.mbmod.get_annual_mb_series(heights, ryrs)[idx]
+
 
 class UncertainMassBalance(MassBalanceModel):
     """Adding uncertainty to a mass balance model.
@@ -793,9 +1109,6 @@ class UncertainMassBalance(MassBalanceModel):
     @temp_bias.setter
     def temp_bias(self, value):
         """Temperature bias to add to the original series."""
-        for attr_name in ['_lazy_interp_yr', '_lazy_interp_m']:
-            if hasattr(self, attr_name):
-                delattr(self, attr_name)
         self.mbmod.temp_bias = value
 
     @property
@@ -917,16 +1230,32 @@ class MultipleFlowlineMassBalance(MassBalanceModel):
             for fl, mu in zip(self.fls, mu_star):
                 fl.mu_star = mu
 
-        # Initialise the mb models
+        # Initialise the mb models. The climate is read only once and
+        # shared by the models (they only differ in their mu*)
+        share = (issubclass(mb_model_class, (PastMassBalance,
+                                             ConstantMassBalance,
+                                             RandomMassBalance)) and
+                 'climate_store' not in kwargs)
+        stores = dict()
         self.flowline_mb_models = []
         for fl in self.fls:
             # Merged glaciers will need different climate files, use filesuffix
+            fl_suffix = input_filesuffix
             if (fl.rgi_id is not None) and (fl.rgi_id != gdir.rgi_id):
-                input_filesuffix = '_' + fl.rgi_id + input_filesuffix
+                fl_suffix = '_' + fl.rgi_id + input_filesuffix
+
+            fl_kwargs = kwargs
+            if share:
+                if fl_suffix not in stores:
+                    stores[fl_suffix] = _ClimateStore(
+                        gdir, filename=kwargs.get('filename',
+                                                  'climate_monthly'),
+                        input_filesuffix=fl_suffix)
+                fl_kwargs = dict(kwargs, climate_store=stores[fl_suffix])
 
             self.flowline_mb_models.append(
                 mb_model_class(gdir, mu_star=fl.mu_star,
-                               input_filesuffix=input_filesuffix, **kwargs))
+                               input_filesuffix=fl_suffix, **fl_kwargs))
 
         self.valid_bounds = self.flowline_mb_models[-1].valid_bounds
 
@@ -981,6 +1310,15 @@ class MultipleFlowlineMassBalance(MassBalanceModel):
         return self.flowline_mb_models[fl_id].get_annual_mb(heights,
                                                             year=year)
 
+    def get_annual_mb_series(self, heights, years, fl_id=None):
+
+        if fl_id is None:
+            raise ValueError('`fl_id` is required for '
+                             'MultipleFlowlineMassBalance!')
+
+        return self.flowline_mb_models[fl_id].get_annual_mb_series(heights,
+                                                                   years)
+
     def get_annual_mb_on_flowlines(self, fls=None, year=None):
         """Get the MB on all points of the glacier at once.
 
@@ -1020,31 +1358,32 @@ class MultipleFlowlineMassBalance(MassBalanceModel):
         if fls is None:
             fls = self.fls
 
-        if len(np.atleast_1d(year)) > 1:
-            out = [self.get_specific_mb(fls=fls, year=yr) for yr in year]
-            return np.asarray(out)
+        # All years at once (see get_annual_mb_series)
+        several = len(np.atleast_1d(year)) > 1
 
         mbs = []
         widths = []
-        for fl, mb_mod in zip(self.fls, self.flowline_mb_models):
-            mb = mb_mod.get_annual_mb(fl.surface_h, year=year)
-            mbs = np.append(mbs, mb * SEC_IN_YEAR * mb_mod.rho)
-            widths = np.append(widths, fl.widths)
+        for fl, mb_mod in zip(fls, self.flowline_mb_models):
+            if several:
+                mb = mb_mod.get_annual_mb_series(fl.surface_h, year)
+            else:
+                mb = mb_mod.get_annual_mb(fl.surface_h, year=year)
+            mbs.append(mb * SEC_IN_YEAR * mb_mod.rho)
+            # Weighted by the area of the grid points
+            widths.append(fl.widths * fl.dx)
 
-        return np.average(mbs, weights=widths)
+        return np.average(np.concatenate(mbs, axis=-1),
+                          weights=np.concatenate(widths), axis=-1)
 
     def get_ela(self, year=None):
 
         # ELA here is not without ambiguity.
         # We compute a mean weighted by area.
 
-        if len(np.atleast_1d(year)) > 1:
-            return np.asarray([self.get_ela(year=yr) for yr in year])
-
         elas = []
         areas = []
         for fl, mb_mod in zip(self.fls, self.flowline_mb_models):
-            elas = np.append(elas, mb_mod.get_ela(year=year))
-            areas = np.append(areas, np.sum(fl.widths))
+            elas.append(mb_mod.get_ela(year=year))
+            areas.append(np.sum(fl.widths))
 
-        return np.average(elas, weights=areas)
+        return np.average(elas, weights=areas, axis=0)
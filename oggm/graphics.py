@@ -666,7 +666,7 @@ def plot_modeloutput_section(model=None, ax=None, title=''):
         ax.plot(x, bed_t, color='crimson', linewidth=2.5, label='Bed (Rect.)')
 
     # Plot glacier
-    surfh = cls.surface_h
+    surfh = cls.surface_h.copy()
     pok = np.where(cls.thick == 0.)[0]
     if (len(pok) > 0) and (pok[0] < (len(surfh)-1)):
         surfh[pok[0]+1:] = np.NaN
@@ -754,7 +754,7 @@ def plot_modeloutput_section_withtrib(model=None, fig=None, title=''):
                     label='Bed (Rect.)')
 
         # Plot glacier
-        surfh = cls.surface_h
+        surfh = cls.surface_h.copy()
         pok = np.where(cls.thick == 0.)[0]
         if (len(pok) > 0) and (pok[0] < (len(surfh)-1)):
             surfh[pok[0]+1:] = np.NaN
@@ -33,15 +33,15 @@ def _find_inital_glacier(final_model, firstguess_mb, y0, y1,
              np.int64(y0), ref_area * 1e-6, rtol * 100)
 
     # are we trying to grow or to shrink the glacier?
-    prev_model = copy.deepcopy(final_model)
-    prev_fls = copy.deepcopy(prev_model.fls)
+    prev_model = final_model.copy()
+    prev_state = final_model.get_state()
     prev_model.reset_y0(y0)
     prev_model.run_until(y1)
     prev_area = prev_model.area_m2
 
     # Just in case we already hit the correct starting state
     if np.allclose(prev_area, ref_area, atol=atol, rtol=rtol):
-        model = copy.deepcopy(final_model)
+        model = final_model.copy()
         model.reset_y0(y0)
         log.info('iterative_initial_glacier_search: inital '
                  'starting glacier converges '
@@ -73,7 +73,7 @@ def _find_inital_glacier(final_model, firstguess_mb, y0, y1,
 
     mb = copy.deepcopy(firstguess_mb)
     mb.temp_bias = sign_mb * mb_bias
-    grow_model = FluxBasedModel(copy.deepcopy(final_model.fls), mb_model=mb,
+    grow_model = FluxBasedModel(final_model.fls, mb_model=mb,
                                 fs=final_model.fs,
                                 glen_a=final_model.glen_a,
                                 min_dt=final_model.min_dt,
@@ -85,7 +85,7 @@ def _find_inital_glacier(final_model, firstguess_mb, y0, y1,
         mb_bias += bias_step
         mb.temp_bias = sign_mb * mb_bias
         log.info(logtxt + ', ite: %d. New bias: %.2f', c, sign_mb * mb_bias)
-        grow_model.reset_flowlines(copy.deepcopy(prev_fls))
+        grow_model.set_state(prev_state)
         grow_model.reset_y0(0.)
         grow_model.run_until_equilibrium(rate=equi_rate)
         log.info(logtxt + ', ite: %d. Grew to equilibrium for %d years, '
@@ -93,16 +93,16 @@ def _find_inital_glacier(final_model, firstguess_mb, y0, y1,
                  grow_model.area_km2)
 
         # Shrink
-        new_fls = copy.deepcopy(grow_model.fls)
-        new_model = copy.deepcopy(final_model)
-        new_model.reset_flowlines(copy.deepcopy(new_fls))
+        new_state = grow_model.get_state()
+        new_model = final_model.copy()
+        new_model.set_state(new_state)
         new_model.reset_y0(y0)
         new_model.run_until(y1)
         new_area = new_model.area_m2
 
         # Maybe we done?
         if np.allclose(new_area, ref_area, atol=atol, rtol=rtol):
-            new_model.reset_flowlines(new_fls)
+            new_model.set_state(new_state)
             new_model.reset_y0(y0)
             log.info(logtxt + ', ite: %d. Converged with a '
                      'final dif of %.2f %%', c,
@@ -114,7 +114,7 @@ def _find_inital_glacier(final_model, firstguess_mb, y0, y1,
         do_cont_2 = (sign_mb > 0.) and (new_area > ref_area)
         if do_cont_1 or do_cont_2:
             # Reset the previous state and continue
-            prev_fls = new_fls
+            prev_state = new_state
 
             log.info(logtxt + ', ite: %d. Dif of %.2f %%. '
                               'Continue', c,
@@ -58,8 +58,8 @@ def run_uncertain_random_climate(gdir, nyears=700,
                        0, atol=0.01)
 
     rdf = pd.DataFrame(index=cyrs)
+    rdf['SMB'] = mbref.get_specific_mb(h, w, year=cyrs)
     for y in cyrs:
-        rdf.loc[y, 'SMB'] = mbref.get_specific_mb(h, w, year=y)
         t, _, p, _ = mbref.get_annual_climate([np.mean(h)], year=y)
         rdf.loc[y, 'TEMP'] = t
         rdf.loc[y, 'PRCP'] = p
@@ -34,7 +34,10 @@ from oggm.core.inversion import distribute_thickness_per_altitude
 from oggm.core.inversion import distribute_thickness_interp
 from oggm.core.flowline import init_present_time_glacier
 from oggm.core.flowline import run_random_climate
+from oggm.core.flowline import run_random_climate_ensemble
 from oggm.core.flowline import run_from_climate_data
+from oggm.core.flowline import run_random_climate_batch
+from oggm.core.flowline import run_from_climate_data_batch
 from oggm.core.flowline import run_constant_climate
 from oggm.utils import copy_to_basedir
 
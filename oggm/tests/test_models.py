@@ -22,6 +22,7 @@ from oggm import utils, workflow, tasks, cfg
 from oggm.core import gcm_climate, climate, inversion, centerlines
 from oggm.cfg import SEC_IN_DAY, SEC_IN_YEAR, SEC_IN_MONTH
 from oggm.utils import get_demo_file
+from oggm.exceptions import InvalidParamsError
 
 from oggm.tests.funcs import init_hef, get_test_dir, patch_url_retrieve_github
 from oggm.tests.funcs import (dummy_bumpy_bed, dummy_constant_bed,
@@ -38,7 +39,8 @@ from oggm.core.flowline import (FluxBasedModel, FlowlineModel,
                                 ParabolicBedFlowline, MixedBedFlowline,
                                 flowline_from_dataset, FileModel,
                                 run_constant_climate, run_random_climate,
-                                run_from_climate_data)
+                                run_random_climate_ensemble,
+                                run_from_climate_data, DiagnosticCollector)
 
 FluxBasedModel = partial(FluxBasedModel, inplace=True)
 FlowlineModel = partial(FlowlineModel, inplace=True)
@@ -320,6 +322,18 @@ class TestMassBalance(unittest.TestCase):
             totest = mb_mod.get_annual_mb([ela_z], year=yr) * F
             assert_allclose(totest[0], 0, atol=1)
 
+        # All years at once
+        yrs = np.arange(yrp[0], yrp[1]+1)
+        mbs = mb_mod.get_annual_mb_series(h, yrs)
+        assert mbs.shape == (len(yrs), len(h))
+        for yr, mb in zip(yrs, mbs):
+            np.testing.assert_allclose(mb, mb_mod.get_annual_mb(h, yr))
+        with pytest.raises(ValueError):
+            mb_mod.get_annual_mb_series(h, [yrp[0], 2100])
+        smb = mb_mod.get_specific_mb(h, w, year=yrs)
+        for yr, mb in zip(yrs[::10], smb[::10]):
+            assert_allclose(mb, mb_mod.get_specific_mb(h, w, year=yr))
+
         for i, yr in enumerate(np.arange(yrp[0], yrp[1]+1)):
 
             ref_mb_on_h = p[:, i] - mu_star * t[:, i]
@@ -387,6 +401,34 @@ class TestMassBalance(unittest.TestCase):
         mb_gw = mb_gw_mod.get_specific_mb(year=yrs)
         assert_allclose(mb, mb_gw)
 
+        # The climate is read only once
+        mods = mb_gw_mod.flowline_mb_models
+        assert len(mods) > 1
+        for mod in mods[1:]:
+            assert mod.climate_store is mods[0].climate_store
+            assert mod.temp is mods[0].temp
+        assert not mods[0].temp.flags.writeable
+
+        # Tabulated annual MB
+        yrs = np.arange(yrp[0], yrp[1]+1)
+        mb_mod = massbalance.PastMassBalance(gdir)
+        assert mb_mod.hbins is None
+        mb_tab = massbalance.PastMassBalance(gdir, table_dh=1)
+        assert mb_tab.hbins[0] < h.min() and mb_tab.hbins[-1] > h.max()
+        ref = mb_mod.get_annual_mb_series(h, yrs) * F
+        np.testing.assert_allclose(mb_tab.get_annual_mb_series(h, yrs) * F,
+                                   ref, atol=5)
+        np.testing.assert_allclose(mb_tab.get_annual_mb(h, 1950) * F,
+                                   ref[1950 - yrp[0]], atol=5)
+        # The table follows the biases
+        mb_mod.temp_bias = 1
+        mb_tab.temp_bias = 1
+        assert_allclose(mb_tab.get_specific_mb(h, w, year=yrs),
+                        mb_mod.get_specific_mb(h, w, year=yrs), atol=1)
+        # Out of the table: exact
+        assert_allclose(mb_tab.get_annual_mb([9000.], 1950),
+                        mb_mod.get_annual_mb([9000.], 1950))
+
     def test_glacierwide_mb_model(self):
 
         gdir = self.gdir
@@ -521,6 +563,28 @@ class TestMassBalance(unittest.TestCase):
         nobiasotmb = np.average(nobiasombh, weights=w)
         np.testing.assert_allclose(0, nobiasotmb + bias, atol=0.2)
 
+        # The tables are close to the average of the yearly MB
+        ref = cmb_mod.mbmod.get_annual_mb_series(h, cmb_mod.years)
+        assert_allclose(nobiasombh, ref.mean(axis=0) * SEC_IN_YEAR * rho,
+                        atol=5)
+        with pytest.raises(ValueError):
+            cmb_mod.get_annual_mb([cmb_mod.hbins[-1] + 1])
+
+        # Same for the monthly MB, on the table grid
+        hb = cmb_mod.hbins
+        ref = np.mean([cmb_mod.mbmod.get_monthly_mb(
+            hb, year=utils.date_to_floatyear(yr, 7)) for yr in cmb_mod.years],
+            axis=0)
+        assert_allclose(cmb_mod.get_monthly_mb(
+            hb, year=utils.date_to_floatyear(0, 7)), ref)
+
+        # The former interp1d attributes are deprecated
+        with pytest.warns(DeprecationWarning):
+            assert_allclose(cmb_mod.interp_yr(h), nobiasombh / SEC_IN_YEAR /
+                            rho)
+        with pytest.warns(DeprecationWarning):
+            assert_allclose(cmb_mod.interp_m[6](hb), ref)
+
         months = np.arange(12)
         monthly_1 = months * 0.
         monthly_2 = months * 0.
@@ -597,6 +661,11 @@ class TestMassBalance(unittest.TestCase):
         r_mbh2 = mb_mod.get_annual_mb(h, 1) * SEC_IN_YEAR
         np.testing.assert_allclose(r_mbh1, r_mbh2)
 
+        # also with all years at once
+        mbs = mb_mod.get_annual_mb_series(h, np.arange(1, 50))
+        for yr, mb in zip(np.arange(1, 50), mbs):
+            np.testing.assert_allclose(mb, mb_mod.get_annual_mb(h, yr))
+
         # After many trials the mb should be close to the same
         ny = 2000
         yrs = np.arange(ny)
@@ -807,6 +876,33 @@ class TestMassBalance(unittest.TestCase):
         assert np.std(unc_mb - ref_mb) > 50
         assert np.corrcoef(ref_mb, unc_mb)[0, 1] > 0.5
 
+    def test_ela(self):
+
+        from scipy.optimize import brentq
+
+        mb_mod = massbalance.PastMassBalance(self.gdir)
+        yrs = np.arange(1900, 2003)
+        elas = mb_mod.get_ela(year=yrs)
+        assert elas.shape == yrs.shape
+        assert mb_mod.get_ela(year=yrs[3]) == elas[3]
+
+        for yr, ela in zip(yrs[::10], elas[::10]):
+            def to_minimize(x):
+                return mb_mod.get_annual_mb([x], year=yr)[0]
+            ref = brentq(to_minimize, *mb_mod.valid_bounds, xtol=0.01)
+            assert_allclose(ela, ref, atol=0.1)
+
+        # The solver uses one row of heights per year
+        heights = np.linspace(2000, 3500, 8) + np.arange(3)[:, np.newaxis]
+        mbs = mb_mod.get_annual_mb_series(heights, yrs[:3])
+        for h, yr, mb in zip(heights, yrs[:3], mbs):
+            assert_allclose(mb, mb_mod.get_annual_mb(h, year=yr))
+
+        # No ELA within the bounds
+        mb_mod.temp_bias = 20
+        assert np.isnan(mb_mod.get_ela(year=1950))
+        assert np.all(np.isnan(mb_mod.get_ela(year=yrs[:3])))
+
     def test_mb_performance(self):
 
         gdir = self.gdir
@@ -1192,11 +1288,11 @@ class TestModelFlowlines(unittest.TestCase):
         widths[~is_trap] = rec2.widths[~is_trap]
         assert_allclose(rec.widths, widths)
 
-        widths_m = rec1.widths_m
+        widths_m = rec1.widths_m.copy()
         widths_m[~is_trap] = rec2.widths_m[~is_trap]
         assert_allclose(rec.widths_m, widths_m)
 
-        section = rec1.section
+        section = rec1.section.copy()
         section[~is_trap] = rec2.section[~is_trap]
         assert_allclose(rec.section, section)
 
@@ -1229,6 +1325,70 @@ class TestModelFlowlines(unittest.TestCase):
         assert_allclose(rec.thick, thick - 10)
         assert_allclose(rec.surface_h, surface_h - 10)
 
+    def test_cached_geometry(self):
+
+        map_dx = 100.
+        dx = 1.
+        nx = 200
+        coords = np.arange(0, nx - 0.5, 1)
+        line = shpg.LineString(np.vstack([coords, coords * 0.]).T)
+
+        bed_h = np.linspace(3000, 1000, nx)
+        surface_h = bed_h + 100
+        shapes = bed_h*0. + 0.003
+        is_trap = np.zeros(nx, dtype=bool)
+        is_trap[:50] = True
+        lambdas = bed_h*0. + 1
+        thick = surface_h - bed_h
+        section = 2 / 3 * thick * np.sqrt(4 * thick / shapes)
+        section[is_trap] = thick[is_trap] * (200 + thick[is_trap] / 2)
+
+        fl = MixedBedFlowline(line=line, dx=dx, map_dx=map_dx,
+                              surface_h=surface_h, bed_h=bed_h,
+                              section=section, bed_shape=shapes,
+                              is_trapezoid=is_trap, lambdas=lambdas)
+
+        # Repeated access returns the same arrays
+        assert fl.widths_m is fl.widths_m
+        assert fl.section is fl.section
+        assert fl.surface_h is fl.surface_h
+        assert_allclose(fl.section, section)
+
+        # Setting the thickness invalidates the cache
+        widths_m = fl.widths_m
+        area_m2 = fl.area_m2
+        fl.thick = fl.thick * 0.5
+        assert fl.widths_m is not widths_m
+        assert_allclose(fl.surface_h, bed_h + thick * 0.5)
+        assert np.all(fl.widths_m < widths_m)
+        assert fl.area_m2 < area_m2
+        fl.section = section
+        assert_allclose(fl.thick, thick)
+        assert_allclose(fl.widths_m, widths_m)
+        assert_allclose(fl.area_m2, area_m2)
+
+        # Copies do not share the cache
+        fl2 = copy.deepcopy(fl)
+        fl2.thick = fl2.thick * 0
+        assert_allclose(fl.section, section)
+        assert_allclose(fl2.section, 0)
+        assert fl2.area_m2 == 0
+
+        # The cached arrays can't be changed in place
+        with pytest.raises(ValueError):
+            fl.surface_h[0] = 0
+
+        # Setting the geometry invalidates the cache as well
+        fl.bed_h = bed_h - 10
+        assert_allclose(fl.surface_h, bed_h - 10 + thick)
+        fl = RectangularBedFlowline(line=line, dx=dx, map_dx=map_dx,
+                                    surface_h=surface_h, bed_h=bed_h,
+                                    widths=bed_h*0.+2)
+        assert_allclose(fl.section, 2 * map_dx * thick)
+        fl.widths = bed_h*0.+4
+        assert_allclose(fl.section, 4 * map_dx * thick)
+        assert_allclose(fl.area_m2, 4 * map_dx * fl.dx_meter * nx)
+
 
 class TestIO(unittest.TestCase):
 
@@ -1371,6 +1531,15 @@ class TestIO(unittest.TestCase):
             np.testing.assert_allclose(fmodel.volume_m3_ts(), vol_ref)
             np.testing.assert_allclose(fmodel.area_m2_ts(), a_ref)
             np.testing.assert_allclose(fmodel.length_m_ts(), l_ref)
+            df = fmodel.diagnostics_ts()
+            np.testing.assert_allclose(df.volume_m3, vol_ref)
+            np.testing.assert_allclose(df.area_m2, a_ref)
+            np.testing.assert_allclose(df.length_m, l_ref)
+            np.testing.assert_allclose(df.index, np.arange(501))
+
+            # Only the stored years are available
+            with pytest.raises(KeyError):
+                fmodel.run_until(300.5)
 
             # Can we start a run from the middle?
             fmodel.run_until(300)
@@ -1381,6 +1550,184 @@ class TestIO(unittest.TestCase):
             np.testing.assert_allclose(model.fls[0].section,
                                        fmodel.fls[0].section)
 
+    @pytest.mark.slow
+    def test_run_streaming(self):
+
+        mb = LinearMassBalance(2600.)
+        chunk_size = cfg.PARAMS['run_output_chunk_size']
+        cfg.PARAMS['run_output_chunk_size'] = 7
+        try:
+            paths = []
+            for stream in [False, True]:
+                run_path = os.path.join(self.test_dir,
+                                        'run_{}.nc'.format(stream))
+                diag_path = os.path.join(self.test_dir,
+                                         'diag_{}.nc'.format(stream))
+                model = FluxBasedModel(dummy_width_bed_tributary(),
+                                       mb_model=mb, y0=0.,
+                                       glen_a=self.glen_a)
+                out = model.run_until_and_store(50, run_path=run_path,
+                                                diag_path=diag_path,
+                                                store_monthly_step=True,
+                                                stream_output=stream)
+                paths.append((run_path, diag_path))
+            assert out == (None, None)
+
+            # Same files
+            (run_ref, diag_ref), (run_path, diag_path) = paths
+            with xr.open_dataset(diag_ref) as ref, \
+                    xr.open_dataset(diag_path) as ds:
+                assert ds.dims['time'] == 50 * 12 + 1
+                del ref.attrs['creation_date']
+                del ds.attrs['creation_date']
+                xr.testing.assert_identical(ref, ds)
+            for i in range(2):
+                group = 'fl_{}'.format(i)
+                with xr.open_dataset(run_ref, group=group) as ref, \
+                        xr.open_dataset(run_path, group=group) as ds:
+                    xr.testing.assert_equal(ref, ds)
+            with FileModel(run_ref) as ref, FileModel(run_path) as fmodel:
+                assert fmodel.last_yr == 50
+                np.testing.assert_allclose(fmodel.volume_m3_ts(),
+                                           ref.volume_m3_ts())
+
+            # The output is kept if the run fails
+            class FailingModel(FluxBasedModel.func):
+                def step(self, dt):
+                    if self.yr > 33:
+                        raise FloatingPointError('NaN in numerical solution.')
+                    return super(FailingModel, self).step(dt)
+
+            model = FailingModel(dummy_width_bed_tributary(), mb_model=mb,
+                                 y0=0., glen_a=self.glen_a)
+            with pytest.raises(FloatingPointError):
+                model.run_until_and_store(50, run_path=run_path,
+                                          diag_path=diag_path,
+                                          stream_output=True)
+            with xr.open_dataset(diag_path) as ds, \
+                    xr.open_dataset(diag_ref) as ref:
+                assert ds.dims['time'] == 34
+                np.testing.assert_allclose(ds.volume_m3,
+                                           ref.volume_m3.sel(time=ds.time))
+        finally:
+            cfg.PARAMS['run_output_chunk_size'] = chunk_size
+
+    @pytest.mark.slow
+    def test_run_stats(self):
+
+        mb = LinearMassBalance(2600.)
+        diag_path = self.gdir.get_filepath('model_diagnostics',
+                                           filesuffix='_stats')
+
+        # Off per default
+        model = FluxBasedModel(dummy_constant_bed(), mb_model=mb, y0=0.,
+                               glen_a=self.glen_a)
+        assert model.stats is None
+        _, ds = model.run_until_and_store(10)
+        assert 'stats_n_steps' not in ds.attrs
+
+        collect_run_stats = cfg.PARAMS['collect_run_stats']
+        cfg.PARAMS['collect_run_stats'] = True
+        try:
+            model = FluxBasedModel(dummy_width_bed_tributary(), mb_model=mb,
+                                   y0=0., glen_a=self.glen_a,
+                                   time_stepping='default')
+            model.run_until_and_store(50, diag_path=diag_path,
+                                      fallback_steps=['conservative'])
+            with xr.open_dataset(diag_path) as ds:
+                attrs = ds.attrs
+            # Default time stepping: between 1 hour and 10 days
+            assert attrs['stats_n_steps'] > 50 * 36
+            assert np.sum(attrs['stats_dt_hist']) == attrs['stats_n_steps']
+            assert np.sum(attrs['stats_dt_hist'][-3:]) == 0
+            assert attrs['stats_n_clipped_steps'] == 0
+            # Annual MB: one call per year and flowline
+            assert attrs['stats_n_mb_calls'] == 50 * 2
+            assert attrs['stats_wall_time_flux'] > 0
+            assert attrs['stats_wall_time_mb'] > 0
+            assert attrs['stats_n_rollbacks'] == 0
+            assert attrs['stats_time_stepping'] == 'default'
+
+            # Rollbacks
+            class FailingModel(FluxBasedModel.func):
+                def step(self, dt):
+                    if 33 < self.yr < 34 and self.time_stepping == 'default':
+                        raise FloatingPointError('NaN in numerical solution.')
+                    return super(FailingModel, self).step(dt)
+
+            model = FailingModel(dummy_width_bed_tributary(), mb_model=mb,
+                                 y0=0., glen_a=self.glen_a, inplace=True,
+                                 time_stepping='default')
+            _, ds = model.run_until_and_store(50,
+                                              fallback_steps=['conservative'])
+            assert ds.attrs['stats_n_rollbacks'] == 1
+            assert ds.attrs['stats_time_stepping'] == 'default,conservative'
+        finally:
+            cfg.PARAMS['collect_run_stats'] = collect_run_stats
+
+        # Compiled output: the glacier without stats has NaNs
+        new_dir = os.path.join(self.test_dir, 'nostats')
+        gdirs = [self.gdir,
+                 tasks.copy_to_basedir(self.gdir, base_dir=new_dir)]
+        ds.attrs = {k: v for k, v in ds.attrs.items()
+                    if not k.startswith('stats')}
+        ds.to_netcdf(gdirs[1].get_filepath('model_diagnostics',
+                                           filesuffix='_stats'))
+        ds = utils.compile_run_output(gdirs, path=False,
+                                      filesuffix='_stats')
+        np.testing.assert_allclose(ds.stats_n_steps,
+                                   [attrs['stats_n_steps'], np.NaN])
+        assert ds.stats_dt_hist.dims == ('rgi_id', 'dt_bin')
+        np.testing.assert_allclose(ds.stats_dt_hist.sum(dim='dt_bin')[0],
+                                   attrs['stats_n_steps'])
+        assert ds.stats_time_stepping.values.tolist() == ['default', '']
+
+    def test_diagnostics(self):
+
+        mb = LinearMassBalance(2600.)
+        diag_path = os.path.join(self.test_dir, 'diag_collectors.nc')
+
+        ref = FluxBasedModel(dummy_constant_bed(), mb_model=mb, y0=0.,
+                             glen_a=self.glen_a)
+        _, ref_diag = ref.run_until_and_store(20)
+        assert list(ref_diag.data_vars) == ['volume_m3', 'area_m2',
+                                            'length_m', 'ela_m']
+
+        # Only what we ask for
+        max_thick = DiagnosticCollector(
+            'max_thick_m', lambda m: max(fl.thick.max() for fl in m.fls),
+            description='Maximum ice thickness', unit='m')
+        for stream in [False, True]:
+            model = FluxBasedModel(dummy_constant_bed(), mb_model=mb, y0=0.,
+                                   glen_a=self.glen_a)
+            out = model.run_until_and_store(20, diag_path=diag_path,
+                                            diagnostics=['volume_m3',
+                                                         max_thick],
+                                            store_geometry=False,
+                                            stream_output=stream)
+            with xr.open_dataset(diag_path) as diag:
+                assert list(diag.data_vars) == ['volume_m3', 'max_thick_m']
+                np.testing.assert_allclose(diag.volume_m3,
+                                           ref_diag.volume_m3)
+                assert diag.max_thick_m.attrs['unit'] == 'm'
+                assert diag.max_thick_m[-1] > 0
+            if not stream:
+                assert out[0] is None
+
+        with pytest.raises(InvalidParamsError):
+            model.run_until_and_store(30, diagnostics=['volume_m2'])
+        with pytest.raises(InvalidParamsError):
+            model.run_until_and_store(30, run_path=diag_path,
+                                      store_geometry=False)
+
+        # Calving is only stored for tidewater glaciers
+        model = FluxBasedModel(dummy_constant_bed(hmax=1000., hmin=0.,
+                                                  nx=100),
+                               mb_model=LinearMassBalance(450.), y0=0.,
+                               glen_a=self.glen_a, is_tidewater=True)
+        _, diag = model.run_until_and_store(10)
+        assert 'calving_m3' in diag
+
     @pytest.mark.slow
     def test_run_annual_step(self):
         mb = LinearMassBalance(2600.)
@@ -2478,6 +2825,63 @@ class TestHEF(unittest.TestCase):
                     plt.tight_layout()
                     plt.show()
 
+    def test_random_ensemble_params(self):
+
+        init_present_time_glacier(self.gdir)
+        for kwargs in [dict(time_stepping='implicit'),
+                       dict(time_stepping='adaptive'),
+                       dict(subcycling=True)]:
+            with pytest.raises(InvalidParamsError):
+                run_random_climate_ensemble(self.gdir, nyears=10,
+                                            seeds=[1, 2], **kwargs)
+
+    @pytest.mark.slow
+    def test_implicit(self):
+
+        init_present_time_glacier(self.gdir)
+        for ts in ['default', 'implicit']:
+            run_random_climate(self.gdir, nyears=100, seed=6,
+                               fs=self.fs, glen_a=self.glen_a, bias=0,
+                               time_stepping=ts, output_filesuffix='_' + ts)
+
+        paths = [self.gdir.get_filepath('model_run', filesuffix='_default'),
+                 self.gdir.get_filepath('model_run', filesuffix='_implicit')]
+        with FileModel(paths[0]) as ref, FileModel(paths[1]) as model:
+            np.testing.assert_allclose(ref.volume_km3_ts(),
+                                       model.volume_km3_ts(), rtol=0.02)
+            np.testing.assert_allclose(ref.area_km2_ts(),
+                                       model.area_km2_ts(), rtol=0.02)
+            ref.run_until(ref.last_yr)
+            model.run_until(model.last_yr)
+            for fl, rfl in zip(model.fls, ref.fls):
+                assert utils.rmsd(fl.surface_h, rfl.surface_h) < 5
+
+    @pytest.mark.slow
+    def test_float32(self):
+
+        init_present_time_glacier(self.gdir)
+        float_dtype = cfg.PARAMS['float_dtype']
+        try:
+            for dtype in ['float64', 'float32']:
+                cfg.PARAMS['float_dtype'] = dtype
+                run_random_climate(self.gdir, nyears=100, seed=6,
+                                   fs=self.fs, glen_a=self.glen_a, bias=0,
+                                   output_filesuffix='_' + dtype)
+        finally:
+            cfg.PARAMS['float_dtype'] = float_dtype
+
+        # The tolerances given in params.cfg
+        paths = [self.gdir.get_filepath('model_run', filesuffix='_float64'),
+                 self.gdir.get_filepath('model_run', filesuffix='_float32')]
+        with FileModel(paths[0]) as ref, FileModel(paths[1]) as model:
+            np.testing.assert_allclose(ref.volume_km3_ts(),
+                                       model.volume_km3_ts(), rtol=1e-3)
+            np.testing.assert_allclose(ref.area_km2_ts(),
+                                       model.area_km2_ts(), rtol=1e-3)
+            np.testing.assert_allclose(ref.length_m_ts(),
+                                       model.length_m_ts(),
+                                       atol=ref.fls[-1].dx_meter)
+
     @pytest.mark.slow
     def test_random_sh(self):
 
@@ -1,18 +1,21 @@
 import warnings
 warnings.filterwarnings("once", category=DeprecationWarning)  # noqa: E402
 
+import os
 import unittest
 from functools import partial
 import pytest
 import copy
 import numpy as np
+import xarray as xr
 from numpy.testing import assert_allclose
 
 # Local imports
 import oggm
 from oggm.core.massbalance import LinearMassBalance
 from oggm import utils, cfg
-from oggm.cfg import SEC_IN_DAY
+from oggm.cfg import SEC_IN_DAY, SEC_IN_YEAR
+from oggm.exceptions import InvalidParamsError
 from oggm.core.sia2d import Upstream2D
 
 # Tests
@@ -22,13 +25,14 @@ from oggm.tests.funcs import (dummy_bumpy_bed, dummy_constant_bed,
                               dummy_noisy_bed, dummy_parabolic_bed,
                               dummy_trapezoidal_bed, dummy_width_bed,
                               dummy_width_bed_tributary,
-                              patch_url_retrieve_github)
+                              patch_url_retrieve_github, get_test_dir)
 
 # after oggm.test
 import matplotlib.pyplot as plt
 
 from oggm.core.flowline import (KarthausModel, FluxBasedModel,
-                                MUSCLSuperBeeModel, MassConservationChecker)
+                                MUSCLSuperBeeModel, MassConservationChecker,
+                                BatchFluxBasedModel, EnsembleFluxBasedModel)
 
 FluxBasedModel = partial(FluxBasedModel, inplace=True)
 KarthausModel = partial(KarthausModel, inplace=True)
@@ -60,7 +64,7 @@ class TestIdealisedCases(unittest.TestCase):
         self.fs_old = 5.7e-20  # outdated value
 
     def tearDown(self):
-        pass
+        cfg.initialize()
 
     @pytest.mark.slow
     def test_constant_bed(self):
@@ -423,6 +427,546 @@ class TestIdealisedCases(unittest.TestCase):
         np.testing.assert_allclose(volume[0][-1], volume[2][-1], atol=1e-2)
         np.testing.assert_allclose(volume[0][-1], volume[3][-1], atol=1e-2)
 
+    @pytest.mark.slow
+    def test_implicit(self):
+
+        beds = [dummy_constant_bed, dummy_width_bed_tributary,
+                dummy_mixed_bed, dummy_parabolic_bed]
+        yrs = np.arange(1, 300, 2)
+        for bed in beds:
+            volume = []
+            surface_h = []
+            for kw in [dict(time_stepping='default'),
+                       dict(time_stepping='implicit'),
+                       dict(time_stepping='implicit',
+                            fixed_dt=90 * SEC_IN_DAY)]:
+                fls = bed()
+                mb = LinearMassBalance(2600.)
+                model = FluxBasedModel(fls, mb_model=mb, glen_a=self.glen_a,
+                                       **kw)
+                vol = yrs * 0.
+                for i, y in enumerate(yrs):
+                    model.run_until(y)
+                    vol[i] = model.volume_km3
+                volume.append(vol)
+                surface_h.append(fls[-1].surface_h.copy())
+
+            # The explicit 'default' scheme itself is off by a few meters
+            # in the tributary case (compared to much smaller time steps)
+            for vol, sh in zip(volume[1:], surface_h[1:]):
+                np.testing.assert_allclose(volume[0][-1], vol[-1], rtol=0.01)
+                assert utils.rmsd(volume[0], vol) < 2e-3
+                assert utils.rmsd(surface_h[0], sh) < 10
+
+        # Mass conservation
+        fls = dummy_width_bed_tributary()
+        mb = LinearMassBalance(2600.)
+        model = MassConservationChecker(fls, mb_model=mb, y0=0.,
+                                        glen_a=self.glen_a,
+                                        time_stepping='implicit')
+        model.run_until(200)
+        assert_allclose(model.total_mass, model.volume_m3, rtol=1e-3)
+
+        fls = dummy_constant_bed(hmax=1000., hmin=0., nx=100)
+        mb = LinearMassBalance(450.)
+        model = MassConservationChecker(fls, mb_model=mb, y0=0.,
+                                        glen_a=self.glen_a,
+                                        is_tidewater=True,
+                                        time_stepping='implicit')
+        model.run_until(500)
+        tot_vol = model.volume_m3 + model.calving_m3_since_y0
+        assert_allclose(model.total_mass, tot_vol, rtol=2e-2)
+
+    @pytest.mark.slow
+    def test_adaptive_time_stepping(self):
+
+        cfg.PARAMS['collect_run_stats'] = True
+        yrs = np.arange(1, 300, 2)
+        for bed in [dummy_constant_bed, dummy_width_bed_tributary,
+                    dummy_parabolic_bed]:
+            volume = []
+            surface_h = []
+            n_steps = []
+            for ts in ['conservative', 'default', 'adaptive']:
+                fls = bed()
+                mb = LinearMassBalance(2600.)
+                model = FluxBasedModel(fls, mb_model=mb, glen_a=self.glen_a,
+                                       time_stepping=ts)
+                vol = yrs * 0.
+                for i, y in enumerate(yrs):
+                    model.run_until(y)
+                    vol[i] = model.volume_km3
+                volume.append(vol)
+                surface_h.append(fls[-1].surface_h.copy())
+                n_steps.append(model.stats.n_steps)
+                assert model.stats.n_clipped_steps == 0
+
+            # As accurate as the conservative scheme (the default scheme is
+            # up to 1% off at the tributary junction)
+            ref_vol, _, vol = volume
+            np.testing.assert_allclose(vol[-1], ref_vol[-1], rtol=1e-3)
+            assert utils.rmsd(vol, ref_vol) < 2e-3
+            assert utils.rmsd(surface_h[2], surface_h[0]) < 5
+            # Fewer steps than the explicit schemes, much fewer than the
+            # conservative one. At the tributary junction the step stays
+            # limited by the stability of the explicit scheme.
+            assert n_steps[2] < n_steps[1]
+            assert n_steps[2] < n_steps[0] / 2
+
+        # The MB model might change between runs
+        models = []
+        for new_mb in [False, True]:
+            mb = LinearMassBalance(2600.)
+            model = FluxBasedModel(dummy_width_bed_tributary(), mb_model=mb,
+                                   glen_a=self.glen_a,
+                                   mb_elev_feedback='always',
+                                   time_stepping='adaptive')
+            model.run_until(50.5)
+            if new_mb:
+                model.mb_model = LinearMassBalance(2600.)
+                model.mb_model.temp_bias = 1
+            else:
+                mb.temp_bias = 1
+            model.run_until(60)
+            models.append(model)
+        assert models[0].volume_m3 == models[1].volume_m3
+
+        # Mass conservation
+        fls = dummy_constant_bed(hmax=1000., hmin=0., nx=100)
+        mb = LinearMassBalance(450.)
+        model = MassConservationChecker(fls, mb_model=mb, y0=0.,
+                                        glen_a=self.glen_a,
+                                        is_tidewater=True,
+                                        time_stepping='adaptive')
+        model.run_until(500)
+        tot_vol = model.volume_m3 + model.calving_m3_since_y0
+        assert_allclose(model.total_mass, tot_vol, rtol=2e-2)
+
+        # Too large steps are done again
+        model = FluxBasedModel(dummy_constant_bed(),
+                               mb_model=LinearMassBalance(2600.),
+                               glen_a=self.glen_a, adaptive_tol=1e-4)
+        model.run_until(100)
+        model.set_time_stepping('adaptive')
+        model._next_dt = model.max_dt
+        model.run_until(101)
+        assert model.stats.n_rejected_steps > 0
+        assert np.all(np.isfinite(model.fls[-1].thick))
+
+        # Also the steps which blew up
+        from oggm.core.flowline import FluxBasedModel as Model
+
+        class BlowingUpModel(Model):
+            """NaNs with steps longer than ten days."""
+            def step(self, dt):
+                self.t_step = self.t
+                return super(BlowingUpModel, self).step(dt)
+
+            def _section_rates(self, rates):
+                out = super(BlowingUpModel, self)._section_rates(rates)
+                if self.t - self.t_step > 10 * SEC_IN_DAY:
+                    rates[-1][:] = np.NaN
+                return out
+
+        model = BlowingUpModel(dummy_constant_bed(),
+                               mb_model=LinearMassBalance(2600.),
+                               glen_a=self.glen_a, time_stepping='adaptive',
+                               collect_stats=True)
+        model.run_until(10)
+        assert model.stats.n_rejected_steps > 0
+        assert model.stats.n_steps > 365
+        assert np.all(np.isfinite(model.fls[-1].thick))
+
+        with pytest.raises(ValueError):
+            BatchFluxBasedModel([model])
+
+    @pytest.mark.slow
+    def test_steady_state(self):
+
+        mb = LinearMassBalance(2600.)
+        for bed in [dummy_constant_bed, dummy_bumpy_bed, dummy_mixed_bed]:
+            # Reference: long enough to be really at equilibrium
+            ref = FluxBasedModel(bed(), mb_model=mb, glen_a=self.glen_a)
+            ref.run_until(3000)
+
+            model = FluxBasedModel(bed(), mb_model=mb, glen_a=self.glen_a)
+            assert model.solve_steady_state() > 0
+            assert model.yr == 0
+            assert_allclose(model.volume_m3, ref.volume_m3, rtol=0.01)
+            assert utils.rmsd(model.fls[-1].surface_h,
+                              ref.fls[-1].surface_h) < 2
+
+            model = FluxBasedModel(bed(), mb_model=mb, glen_a=self.glen_a)
+            model.run_until_equilibrium(steady_state_solver=True)
+            assert model.yr < 50
+            assert_allclose(model.volume_m3, ref.volume_m3, rtol=0.01)
+
+        # No equilibrium found: back to the initial state
+        model = FluxBasedModel(dummy_constant_bed(), mb_model=mb,
+                               glen_a=self.glen_a)
+        with pytest.raises(RuntimeError):
+            model.solve_steady_state(max_ite=5)
+        assert model.volume_m3 == 0
+        assert model.yr == 0
+
+    @pytest.mark.slow
+    def test_active_window(self):
+
+        from oggm.core.flowline import FluxBasedModel as Model
+
+        class FullDomainModel(Model):
+            """Computes all grid points at each step."""
+            def _active_window(self, i, thick, mb):
+                return self.fls[i].nx
+
+        cases = [(partial(dummy_constant_bed, nx=400), 2600., False),
+                 (dummy_width_bed_tributary, 2600., False),
+                 (partial(dummy_constant_bed, hmax=1000., hmin=0.,
+                          nx=100), 450., True)]
+        for bed, ela, tidewater in cases:
+            models = [m(bed(), mb_model=LinearMassBalance(ela),
+                        glen_a=self.glen_a, is_tidewater=tidewater)
+                      for m in [Model, FullDomainModel]]
+            for m in models:
+                # Advance, retreat and restart from a modified geometry
+                m.run_until(100)
+                m.mb_model = LinearMassBalance(ela + 300)
+                m.run_until(200.5)
+                fl = m.fls[-1]
+                thick = fl.thick
+                thick[-20:-10] = 200
+                fl.thick = thick
+                m.run_until(201)
+            model, ref = models
+            for fl, rfl in zip(model.fls, ref.fls):
+                assert_allclose(fl.section, rfl.section)
+            assert_allclose(model.calving_m3_since_y0,
+                            ref.calving_m3_since_y0)
+            assert model.volume_m3 > 0
+
+    def test_subcycling(self):
+
+        mb = LinearMassBalance(2600.)
+        models = [MassConservationChecker(dummy_width_bed_tributary(),
+                                          mb_model=mb, y0=0.,
+                                          glen_a=self.glen_a,
+                                          max_dt=60*SEC_IN_DAY,
+                                          subcycling=sc)
+                  for sc in [False, True]]
+        for m in models:
+            m.run_until(200)
+        ref, model = models
+        # Some ice is on its way to the trunk
+        transit = np.sum(model._inflows[-1]) * model.fls[-1].dx_meter
+        assert transit > 0
+        assert_allclose(model.total_mass, model.volume_m3 + transit,
+                        rtol=1e-3)
+        assert_allclose(model.volume_m3, ref.volume_m3, rtol=1e-3)
+        assert_allclose(model.length_m, ref.length_m, atol=100)
+        assert_allclose(model.copy()._inflows[-1], model._inflows[-1])
+
+        # Empty flowlines are skipped
+        model.mb_model = LinearMassBalance(4000.)
+        model.run_until(300)
+        assert model.volume_m3 == 0
+        assert model._flowline_flux(0, model.yr, [0, 0]) is None
+
+        # New flowlines, new work arrays
+        model.reset_flowlines(dummy_constant_bed())
+        assert [len(a) for a in model._inflows] == [model.fls[0].nx]
+        model.mb_model = mb
+        model.run_until(310)
+        assert model.volume_m3 > 0
+
+        with pytest.raises(ValueError):
+            BatchFluxBasedModel([FluxBasedModel(dummy_width_bed_tributary(),
+                                                mb_model=mb,
+                                                subcycling=True)])
+        for ts in ['implicit', 'adaptive']:
+            with pytest.raises(InvalidParamsError):
+                FluxBasedModel(dummy_width_bed_tributary(), mb_model=mb,
+                               subcycling=True, time_stepping=ts)
+
+    def test_float32(self):
+
+        cases = [(dummy_bumpy_bed, 2600.), (dummy_width_bed_tributary, 2600.),
+                 (dummy_mixed_bed, 2800.)]
+        out = []
+        for dtype in ['float64', 'float32']:
+            cfg.PARAMS['float_dtype'] = dtype
+            models = [FluxBasedModel(bed(), mb_model=LinearMassBalance(ela),
+                                     y0=0., glen_a=self.glen_a)
+                      for bed, ela in cases]
+            batch = BatchFluxBasedModel([FluxBasedModel(
+                bed(), mb_model=LinearMassBalance(ela), y0=0.,
+                glen_a=self.glen_a) for bed, ela in cases])
+            for m in models:
+                m.run_until(200)
+            batch.run_until(200)
+            out.append(models + batch.models)
+            # Only the numerical kernel is in single precision
+            assert models[0]._stags[0][10].dtype == dtype
+            assert models[0]._stags[0][14].dtype == np.float64
+            assert batch._mb.dtype == dtype
+
+        # The tolerances given in params.cfg
+        for ref, model in zip(*out):
+            assert model.volume_m3 > 0
+            assert_allclose(model.volume_m3, ref.volume_m3, rtol=1e-3)
+            assert_allclose(model.area_m2, ref.area_m2, rtol=1e-3)
+            assert_allclose(model.length_m, ref.length_m,
+                            atol=ref.fls[-1].dx_meter)
+
+        cfg.PARAMS['float_dtype'] = 'float16'
+        with pytest.raises(ValueError):
+            FluxBasedModel(dummy_constant_bed())
+
+    @pytest.mark.slow
+    def test_shape_factor_update(self):
+
+        for sf in ['Adhikari', 'Huss']:
+            cfg.PARAMS['use_shape_factor_for_fluxbasedmodel'] = sf
+            vols = []
+            for update, rtol in [('step', 0.), ('annual', 0.),
+                                 ('annual', 0.01)]:
+                cfg.PARAMS['shape_factor_update'] = update
+                cfg.PARAMS['shape_factor_update_rtol'] = rtol
+                fls = dummy_parabolic_bed()
+                for fl in fls:
+                    fl.is_rectangular = np.zeros(fl.nx, dtype=bool)
+                model = FluxBasedModel(fls, mb_model=LinearMassBalance(2500.),
+                                       y0=0., glen_a=self.glen_a)
+
+                # Count the calls
+                sf_func = model.sf_func
+                ncalls = []
+
+                def count_calls(*args):
+                    ncalls.append(1)
+                    return sf_func(*args)
+
+                model.sf_func = count_calls
+                model.run_until(150)
+                vols.append(model.volume_m3)
+                if update == 'annual' and rtol == 0:
+                    assert len(ncalls) == 150
+                else:
+                    assert len(ncalls) > 150
+
+            assert_allclose(vols[1:], vols[0], rtol=1e-3)
+
+        cfg.PARAMS['shape_factor_update'] = 'never'
+        with pytest.raises(ValueError):
+            FluxBasedModel(dummy_parabolic_bed())
+
+    def test_state(self):
+
+        mb = LinearMassBalance(2600.)
+        model = FluxBasedModel(dummy_width_bed_tributary(), mb_model=mb,
+                               glen_a=self.glen_a, y0=0.)
+        model.run_until(20)
+        state = model.get_state()
+        assert state['thick'].shape == (sum(fl.nx for fl in model.fls),)
+
+        # The copy shares the geometry, but not the state
+        new = model.copy()
+        for fl, nfl in zip(model.fls, new.fls):
+            assert nfl is not fl
+            assert nfl.bed_h is fl.bed_h
+            assert nfl.thick is not fl.thick
+        assert new.fls[0].flows_to is new.fls[1]
+        assert new.fls[1].inflows == [new.fls[0]]
+
+        model.run_until(40)
+        vol = model.volume_m3
+        assert new.yr == 20
+        new.run_until(40)
+        assert new.volume_m3 == vol
+        assert_allclose(new.fls[-1].thick, model.fls[-1].thick)
+
+        # Back in time
+        model.set_state(state)
+        assert model.yr == 20
+        model.run_until(40)
+        assert model.volume_m3 == vol
+
+    def test_mb_tables(self):
+
+        # Without MB elevation feedback, the MB is computed once per run
+        mb = LinearMassBalance(2800.)
+        ref = FluxBasedModel(dummy_width_bed_tributary(), mb_model=mb,
+                             glen_a=self.glen_a, y0=0.,
+                             mb_elev_feedback='never')
+        while ref.yr < 100:
+            # One year after the other, without precomputed MB
+            ref.step((100 - ref.yr) * SEC_IN_YEAR)
+        model = FluxBasedModel(dummy_width_bed_tributary(), mb_model=mb,
+                               glen_a=self.glen_a, y0=0.,
+                               mb_elev_feedback='never', collect_stats=True)
+        model.run_until(100)
+        assert model.stats.n_mb_calls == 2
+        assert model.volume_m3 > 0
+        assert model.volume_m3 == ref.volume_m3
+
+        # The model might change between runs
+        mb.temp_bias = 1
+        model.run_until(200)
+        assert model.volume_m3 < ref.volume_m3
+
+        # Also in the middle of a year: the MB of the current year is kept
+        # (as without precomputed MB), not the one of the next years
+        mb = LinearMassBalance(2800.)
+        ref = FluxBasedModel(dummy_width_bed_tributary(), mb_model=mb,
+                             glen_a=self.glen_a, y0=0.,
+                             mb_elev_feedback='never')
+        while ref.yr < 100.5:
+            ref.step((100.5 - ref.yr) * SEC_IN_YEAR)
+        mb.temp_bias = 10
+        while ref.yr < 102:
+            ref.step((102 - ref.yr) * SEC_IN_YEAR)
+        mb = LinearMassBalance(2800.)
+        model = FluxBasedModel(dummy_width_bed_tributary(), mb_model=mb,
+                               glen_a=self.glen_a, y0=0.,
+                               mb_elev_feedback='never')
+        model.run_until(100.5)
+        mb.temp_bias = 10
+        model.run_until(102)
+        assert model.volume_m3 == ref.volume_m3
+
+        # Runs of less than a year do not compute the annual MB again
+        mb = LinearMassBalance(2800.)
+        ref = FluxBasedModel(dummy_width_bed_tributary(), mb_model=mb,
+                             glen_a=self.glen_a, y0=0., collect_stats=True)
+        ref.run_until_and_store(10, store_monthly_step=True)
+        model = FluxBasedModel(dummy_width_bed_tributary(), mb_model=mb,
+                               glen_a=self.glen_a, y0=0., collect_stats=True)
+        for yr in utils.monthly_timeseries(0, 10):
+            model.run_until(yr)
+        assert model.stats.n_mb_calls == ref.stats.n_mb_calls == 20
+        assert model.volume_m3 == ref.volume_m3
+
+        # Same without MB elevation feedback once the glacier is gone
+        mb = LinearMassBalance(2800.)
+        model = FluxBasedModel(dummy_width_bed_tributary(), mb_model=mb,
+                               glen_a=self.glen_a, y0=0., collect_stats=True)
+        model.run_until(100)
+        assert model.stats.n_mb_calls == 200
+        mb.temp_bias = 10
+        model.run_until(400)
+        assert model.volume_m3 == 0
+        assert model.stats.n_mb_calls < 300
+
+    def test_rollback(self):
+
+        from oggm.core.flowline import FluxBasedModel as Model
+
+        class FailingModel(Model):
+            """Fails once (or always) after year 47 with default steps."""
+            def __init__(self, *args, fail_always=False, **kwargs):
+                super(FailingModel, self).__init__(*args, **kwargs)
+                self.fail_always = fail_always
+                self.n_fails = 0
+
+            def step(self, dt):
+                if self.yr > 47 and (self.fail_always or
+                                     (self.time_stepping == 'default' and
+                                      self.n_fails == 0)):
+                    self.n_fails += 1
+                    raise FloatingPointError('NaN in numerical solution.')
+                return super(FailingModel, self).step(dt)
+
+        mb = LinearMassBalance(2600.)
+        ref = Model(dummy_constant_bed(), mb_model=mb, glen_a=self.glen_a,
+                    time_stepping='default')
+        _, ref_diag = ref.run_until_and_store(100)
+
+        model = FailingModel(dummy_constant_bed(), mb_model=mb,
+                             glen_a=self.glen_a, time_stepping='default')
+        with pytest.raises(FloatingPointError):
+            model.run_until_and_store(100)
+
+        model = FailingModel(dummy_constant_bed(), mb_model=mb,
+                             glen_a=self.glen_a, time_stepping='default')
+        ds, diag = model.run_until_and_store(100,
+                                             fallback_steps=['conservative'],
+                                             checkpoint_interval=10)
+        assert model.n_fails == 1
+        assert model.time_stepping == 'default'
+        assert model.yr == 100
+
+        # Same output until the checkpoint, close afterwards
+        vol = diag.volume_m3.values
+        ref_vol = ref_diag.volume_m3.values
+        np.testing.assert_equal(vol[:40], ref_vol[:40])
+        assert_allclose(vol, ref_vol, rtol=1e-3)
+        assert np.all(np.isfinite(ds[0].ts_section.values))
+
+        # All schemes fail
+        model = FailingModel(dummy_constant_bed(), mb_model=mb,
+                             glen_a=self.glen_a, time_stepping='default',
+                             fail_always=True)
+        with pytest.raises(FloatingPointError):
+            model.run_until_and_store(100, fallback_steps=['conservative',
+                                                           'implicit'])
+        assert model.n_fails == 3
+
+        # The output of the discarded attempts does not remain
+        class FailingTwiceModel(Model):
+            """Fails after the years of the list, once each."""
+            def __init__(self, *args, fail_at=(), **kwargs):
+                super(FailingTwiceModel, self).__init__(*args, **kwargs)
+                self.fail_at = list(fail_at)
+
+            def step(self, dt):
+                if self.fail_at and self.yr > self.fail_at[0]:
+                    self.fail_at.pop(0)
+                    raise FloatingPointError('NaN in numerical solution.')
+                return super(FailingTwiceModel, self).step(dt)
+
+        # Same scheme after the rollback: same output as without failure
+        model = FailingTwiceModel(dummy_constant_bed(), mb_model=mb,
+                                  glen_a=self.glen_a, time_stepping='default',
+                                  fail_at=[52])
+        _, diag = model.run_until_and_store(100, fallback_steps=['default'])
+        assert not model.fail_at
+        np.testing.assert_equal(diag.volume_m3.values, ref_vol)
+
+        # Failing for good after a rollback, with the output written to
+        # disk: same output as failing without rollback
+        cfg.PARAMS['run_output_chunk_size'] = 5
+        testdir = os.path.join(get_test_dir(), 'tmp_rollback')
+        utils.mkdir(testdir, reset=True)
+        out = []
+        for fail_at, steps in [([53], None), ([57, 53], ['default'])]:
+            run_path = os.path.join(testdir, 'run.nc')
+            diag_path = os.path.join(testdir, 'diag.nc')
+            model = FailingTwiceModel(dummy_constant_bed(), mb_model=mb,
+                                      glen_a=self.glen_a,
+                                      time_stepping='default',
+                                      fail_at=fail_at)
+            with pytest.raises(FloatingPointError):
+                model.run_until_and_store(100, run_path=run_path,
+                                          diag_path=diag_path,
+                                          fallback_steps=steps,
+                                          stream_output=True)
+            with xr.open_dataset(diag_path) as ds:
+                vol = ds.volume_m3.values
+            with xr.open_dataset(run_path, group='fl_0') as ds:
+                sect = ds.ts_section.values
+            out.append((vol, sect))
+        (vol, sect), (vol_rb, sect_rb) = out
+        assert np.all(np.isfinite(vol)) and len(vol) < len(vol_rb)
+        np.testing.assert_equal(vol_rb[:len(vol)], vol)
+        assert np.all(np.isnan(vol_rb[len(vol):]))
+        np.testing.assert_equal(sect_rb[:len(sect)], sect)
+        assert np.all(np.isnan(sect_rb[len(sect):]))
+
+        # Only for the models with several time stepping schemes
+        model = KarthausModel(dummy_constant_bed(), mb_model=mb,
+                              glen_a=self.glen_a)
+        with pytest.raises(InvalidParamsError):
+            model.run_until_and_store(100, fallback_steps=['conservative'])
+
     @pytest.mark.slow
     def test_bumpy_bed(self):
 
@@ -855,6 +1399,98 @@ class TestIdealisedCases(unittest.TestCase):
             model.run_until(300)
         assert 'exceeds domain boundaries' in str(excinfo.value)
 
+    def test_batch_model(self):
+
+        def models():
+            kw = dict(y0=0., glen_a=self.glen_a)
+            return [FluxBasedModel(dummy_constant_bed(),
+                                   mb_model=LinearMassBalance(2600.), **kw),
+                    FluxBasedModel(dummy_width_bed_tributary(),
+                                   mb_model=LinearMassBalance(2500.), **kw),
+                    FluxBasedModel(dummy_mixed_bed(),
+                                   mb_model=LinearMassBalance(2600.), **kw),
+                    FluxBasedModel(dummy_parabolic_bed(),
+                                   mb_model=LinearMassBalance(2700.),
+                                   fs=self.fs_old, **kw),
+                    FluxBasedModel(dummy_trapezoidal_bed(),
+                                   mb_model=LinearMassBalance(2600.), **kw),
+                    FluxBasedModel(dummy_constant_bed(),
+                                   mb_model=LinearMassBalance(2600.),
+                                   is_tidewater=True, **kw),
+                    FluxBasedModel(dummy_width_bed(),
+                                   mb_model=LinearMassBalance(2800.),
+                                   time_stepping='conservative', **kw),
+                    # this one will fail
+                    FluxBasedModel(dummy_constant_bed(),
+                                   mb_model=LinearMassBalance(1000.), **kw),
+                    ]
+
+        ref = models()
+        for model in ref[:-1]:
+            model.run_until(50)
+            model.run_until(100)
+
+        batch = BatchFluxBasedModel(models())
+        batch.run_until(50)
+        batch.run_until(100)
+
+        # Same results as with the models on their own
+        for model, bmodel in zip(ref[:-1], batch.models[:-1]):
+            assert model.yr == bmodel.yr
+            assert model.calving_m3_since_y0 == bmodel.calving_m3_since_y0
+            for fl, bfl in zip(model.fls, bmodel.fls):
+                np.testing.assert_equal(fl.thick, bfl.thick)
+        assert batch.errors[:-1] == [None] * 7
+        assert isinstance(batch.errors[-1], (RuntimeError,
+                                             FloatingPointError))
+
+        # Storage
+        ref = models()[:3]
+        out = [m.run_until_and_store(20) for m in ref]
+        batch = BatchFluxBasedModel(models()[:3])
+        bout = batch.run_until_and_store(20)
+        for (ds, diag), (bds, bdiag) in zip(out, bout):
+            np.testing.assert_equal(diag.volume_m3.values,
+                                    bdiag.volume_m3.values)
+            np.testing.assert_equal(diag.ela_m.values, bdiag.ela_m.values)
+            for fl_ds, bfl_ds in zip(ds, bds):
+                np.testing.assert_equal(fl_ds.ts_section.values,
+                                        bfl_ds.ts_section.values)
+
+        # All models must start together
+        ref = models()[:2]
+        ref[0].run_until(1)
+        batch = BatchFluxBasedModel(ref)
+        with pytest.raises(ValueError):
+            batch.run_until_and_store(2)
+
+    def test_ensemble_model(self):
+
+        elas = [2500., 2600., 2700., 1000.]  # the last one fails
+        model = FluxBasedModel(dummy_constant_bed(), y0=0.,
+                               glen_a=self.glen_a)
+        ens = EnsembleFluxBasedModel(model,
+                                     [LinearMassBalance(e) for e in elas])
+        diag = ens.run_until_and_store(100)
+        assert diag.volume_m3.dims == ('time', 'member')
+        np.testing.assert_equal(diag.member, np.arange(4))
+        assert np.all(np.isnan(diag.volume_m3.sel(member=3)))
+        assert ens.errors[:3] == [None] * 3
+        # The initial model is left untouched
+        assert model.yr == 0
+
+        # Same results as with the models on their own
+        for i, ela in enumerate(elas[:-1]):
+            ref = FluxBasedModel(dummy_constant_bed(), y0=0.,
+                                 glen_a=self.glen_a,
+                                 mb_model=LinearMassBalance(ela))
+            _, ref_diag = ref.run_until_and_store(100)
+            np.testing.assert_equal(diag.volume_m3.sel(member=i).values,
+                                    ref_diag.volume_m3.values)
+            np.testing.assert_equal(diag.ela_m.sel(member=i).values,
+                                    ref_diag.ela_m.values)
+            assert ens.volume_m3[i] == ref.volume_m3
+
 
 class TestSia2d(unittest.TestCase):
 
@@ -448,13 +448,14 @@ def floatyear_to_date(yr):
             sec = 0
         out_m = int(sec / SEC_IN_MONTH) + 1
     except TypeError:
-        # TODO: inefficient but no time right now
-        out_y = np.zeros(len(yr), np.int64)
-        out_m = np.zeros(len(yr), np.int64)
-        for i, y in enumerate(yr):
-            y, m = floatyear_to_date(y)
-            out_y[i] = y
-            out_m[i] = m
+        # Same as above, but vectorized
+        sec, out_y = np.modf(np.asarray(yr, dtype=np.float64))
+        out_y = out_y.astype(np.int64)
+        sec = np.round(sec * SEC_IN_YEAR)
+        fix = sec == SEC_IN_YEAR
+        out_y[fix] += 1
+        sec[fix] = 0
+        out_m = np.trunc(sec / SEC_IN_MONTH).astype(np.int64) + 1
     return out_y, out_m
 
 
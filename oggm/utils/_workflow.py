@@ -376,6 +376,17 @@ def compile_run_output(gdirs, path=True, filesuffix=''):
         where to store (default is on the working dir).
     filesuffix : str
         the filesuffix of the run
+
+    The output of ensemble runs (see
+    :py:func:`oggm.tasks.run_random_climate_ensemble`) has an additional
+    ``member`` dimension.
+
+    If the runs were made with ``cfg.PARAMS['collect_run_stats']``, their
+    numerical statistics (number of steps, wall times, etc.) are added to
+    the output as ``stats_*`` variables along the ``rgi_id`` dimension.
+
+    The variables which were not stored by the runs (see
+    ``cfg.PARAMS['store_diagnostic_variables']``) are NaN.
     """
 
     # Get the dimensions of all this
@@ -399,6 +410,10 @@ def compile_run_output(gdirs, path=True, filesuffix=''):
 
     with xr.open_dataset(ppath) as ds_diag:
         time = ds_diag.time.values
+        # Ensemble runs have one more dimension
+        members = ds_diag.get('member')
+        if members is not None:
+            members = members.values
         yrs = ds_diag.hydro_year.values
         months = ds_diag.hydro_month.values
         cyrs = ds_diag.calendar_year.values
@@ -428,38 +443,54 @@ def compile_run_output(gdirs, path=True, filesuffix=''):
         ds['calendar_month'].attrs['description'] = 'Calendar month'
 
     shape = (len(time), len(rgi_ids))
-    vol = np.zeros(shape)
-    area = np.zeros(shape)
-    length = np.zeros(shape)
-    ela = np.zeros(shape)
+    dims = ('time', 'rgi_id')
+    if members is not None:
+        ds.coords['member'] = ('member', members)
+        ds['member'].attrs['description'] = 'Ensemble member'
+        shape = shape + (len(members),)
+        dims = dims + ('member',)
+    vol = np.zeros(shape) * np.NaN
+    area = np.zeros(shape) * np.NaN
+    length = np.zeros(shape) * np.NaN
+    ela = np.zeros(shape) * np.NaN
+    run_stats = OrderedDict()
     for i, gdir in enumerate(gdirs):
         try:
             ppath = gdir.get_filepath('model_diagnostics',
                                       filesuffix=filesuffix)
             with xr.open_dataset(ppath) as ds_diag:
-                vol[:, i] = ds_diag.volume_m3.values
-                area[:, i] = ds_diag.area_m2.values
-                length[:, i] = ds_diag.length_m.values
-                ela[:, i] = ds_diag.ela_m.values
+                # Not all variables have to be stored by the runs
+                for out, k in [(vol, 'volume_m3'), (area, 'area_m2'),
+                               (length, 'length_m'), (ela, 'ela_m')]:
+                    if k in ds_diag:
+                        out[:, i] = ds_diag[k].values
+                # Numerical stats of the run, if any
+                for k, v in ds_diag.attrs.items():
+                    if k.startswith('stats_'):
+                        run_stats.setdefault(k[6:],
+                                             [None] * len(gdirs))[i] = v
         except BaseException:
             vol[:, i] = np.NaN
             area[:, i] = np.NaN
             length[:, i] = np.NaN
             ela[:, i] = np.NaN
 
-    ds['volume'] = (('time', 'rgi_id'), vol)
+    ds['volume'] = (dims, vol)
     ds['volume'].attrs['description'] = 'Total glacier volume'
     ds['volume'].attrs['units'] = 'm 3'
-    ds['area'] = (('time', 'rgi_id'), area)
+    ds['area'] = (dims, area)
     ds['area'].attrs['description'] = 'Total glacier area'
     ds['area'].attrs['units'] = 'm 2'
-    ds['length'] = (('time', 'rgi_id'), length)
+    ds['length'] = (dims, length)
     ds['length'].attrs['description'] = 'Glacier length'
     ds['length'].attrs['units'] = 'm'
-    ds['ela'] = (('time', 'rgi_id'), ela)
+    ds['ela'] = (dims, ela)
     ds['ela'].attrs['description'] = 'Glacier Equilibrium Line Altitude (ELA)'
     ds['ela'].attrs['units'] = 'm a.s.l'
 
+    if run_stats:
+        _add_run_stats(ds, run_stats)
+
     if path:
         if path is True:
             path = os.path.join(cfg.PATHS['working_dir'],
@@ -468,6 +499,52 @@ def compile_run_output(gdirs, path=True, filesuffix=''):
     return ds
 
 
+_RUN_STATS_DESC = {
+    'n_steps': ('Number of model time steps', None),
+    'n_clipped_steps': ('Number of time steps clipped to the minimum time '
+                        'step', None),
+    'dt_hist': ('Number of model time steps per time step range', None),
+    'n_mb_calls': ('Number of calls to the mass-balance model', None),
+    'wall_time_flux': ('Wall time spent computing the ice flux', 's'),
+    'wall_time_mb': ('Wall time spent in the mass-balance model', 's'),
+    'n_rollbacks': ('Number of rollbacks after a failure', None),
+    'n_rejected_steps': ('Number of time steps done again with a shorter '
+                         'time step (adaptive time stepping)', None),
+    'time_stepping': ('Time stepping scheme(s) used', None),
+}
+
+
+def _add_run_stats(ds, stats):
+    """Add the numerical stats of the runs (attrs of the diag files)."""
+
+    # Upper bounds of the dt histogram
+    bins = [b for b in stats.pop('dt_hist_bins') if b is not None][0]
+    ds.coords['dt_bin'] = ('dt_bin', np.append(bins, np.inf))
+    ds['dt_bin'].attrs['description'] = 'Upper bound of the time step range'
+    ds['dt_bin'].attrs['units'] = 's'
+
+    for k, vals in stats.items():
+        if k == 'dt_hist':
+            out = np.zeros((len(vals), len(bins) + 1)) * np.NaN
+            for i, v in enumerate(vals):
+                if v is not None:
+                    out[i, :] = v
+            dims = ('rgi_id', 'dt_bin')
+        elif k == 'time_stepping':
+            out = np.array(['' if v is None else v for v in vals])
+            dims = ('rgi_id',)
+        else:
+            out = np.array([np.NaN if v is None else v for v in vals],
+                           dtype=np.float64)
+            dims = ('rgi_id',)
+        vn = 'stats_' + k
+        ds[vn] = (dims, out)
+        desc, units = _RUN_STATS_DESC.get(k, (k, None))
+        ds[vn].attrs['description'] = desc
+        if units is not None:
+            ds[vn].attrs['units'] = units
+
+
 def compile_climate_input(gdirs, path=True, filename='climate_monthly',
                           filesuffix=''):
     """Merge the climate input files in the glacier directories into one file.